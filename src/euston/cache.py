@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+# system modules
+import hashlib
+import os
+import tempfile
+import time
+
+# third-party modules
+import numpy as np
+
+#: Environment variable overriding the default cache directory
+CACHE_DIR_VARIABLE = 'EUSTON_CACHE'
+#: Environment variable overriding the default cache size limit in bytes
+CACHE_SIZE_VARIABLE = 'EUSTON_CACHE_SIZE'
+#: Default cache size limit in bytes
+DEFAULT_CACHE_SIZE = 4 * 1024 ** 3
+#: Age in seconds after which temporary files of interrupted writes are deleted
+STALE_TEMPORARY_AGE = 600
+
+
+def default_cache_directory():
+	"""Cache directory from the environment or below the home directory of the user."""
+	if CACHE_DIR_VARIABLE in os.environ:
+		return os.environ[CACHE_DIR_VARIABLE]
+	return os.path.join(os.path.expanduser('~'), '.cache', 'euston')
+
+
+def default_cache_size():
+	"""Cache size limit in bytes from the environment or :data:`DEFAULT_CACHE_SIZE`."""
+	try:
+		return int(os.environ[CACHE_SIZE_VARIABLE])
+	except (KeyError, ValueError):
+		return DEFAULT_CACHE_SIZE
+
+
+class FileCache(object):
+	"""Directory of binary sidecar files for parsed input files.
+
+	Every entry consists of a metadata archive (.npz) and one array (.npy) that can be memory-mapped. Entries are keyed
+	by the absolute path of the source file together with its size and modification time, so changed source files
+	never hit stale data. Outdated entries of the same source file are removed on access. Once the total size exceeds
+	the configured limit, the least recently used entries are deleted. The entry written last is always kept.
+	"""
+
+	def __init__(self, directory=None, max_size=None):
+		"""Prepares the cache directory.
+
+		:param directory: Cache directory. Defaults to :func:`default_cache_directory`.
+		:type directory: String
+		:param max_size: Maximum total size of all entries in bytes. Defaults to :func:`default_cache_size`.
+		:type max_size: Integer
+		"""
+		if directory is None:
+			directory = default_cache_directory()
+		if max_size is None:
+			max_size = default_cache_size()
+		if max_size < 0:
+			raise ValueError('Cache size has to be non-negative.')
+		self._directory = directory
+		self._max_size = max_size
+		if not os.path.isdir(directory):
+			try:
+				os.makedirs(directory)
+			except OSError:
+				if not os.path.isdir(directory):
+					raise
+
+	def get_directory(self):
+		return self._directory
+
+	def _path_key(self, filename):
+		return hashlib.sha1(os.path.abspath(filename)).hexdigest()[:16]
+
+	def _state_key(self, filename):
+		stat = os.stat(filename)
+		return hashlib.sha1('%d %r' % (stat.st_size, stat.st_mtime)).hexdigest()[:16]
+
+	def _entry(self, filename):
+		return os.path.join(self._directory, '%s-%s' % (self._path_key(filename), self._state_key(filename)))
+
+	def _drop_stale(self, filename):
+		prefix = self._path_key(filename) + '-'
+		current = os.path.basename(self._entry(filename))
+		for name in os.listdir(self._directory):
+			if name.startswith(prefix) and not name.startswith(current):
+				self._remove(os.path.join(self._directory, name))
+
+	def _remove(self, path):
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+	def load(self, filename, mmap_mode=None):
+		"""Reads an entry for a source file.
+
+		:param filename: Source file name.
+		:type filename: String
+		:param mmap_mode: Memory-map mode for the array as in :func:`numpy.load`.
+		:type mmap_mode: String
+		:return: Tuple of metadata dictionary and array or None if there is no valid entry.
+		"""
+		self._drop_stale(filename)
+		return self._load(self._entry(filename), mmap_mode)
+
+	def load_keyed(self, key, mmap_mode=None):
+		"""Reads an entry that is identified by a content key instead of a source file, e.g. derived data shared by
+		many input files.
+
+		:param key: Entry name. Letters, digits and dashes only.
+		:type key: String
+		:param mmap_mode: Memory-map mode for the array as in :func:`numpy.load`.
+		:type mmap_mode: String
+		:return: Tuple of metadata dictionary and array or None if there is no valid entry.
+		"""
+		return self._load(os.path.join(self._directory, key), mmap_mode)
+
+	def _load(self, entry, mmap_mode):
+		try:
+			archive = np.load(entry + '.npz')
+			meta = dict((key, archive[key]) for key in archive.files)
+			archive.close()
+			data = np.load(entry + '.npy', mmap_mode=mmap_mode)
+		except (IOError, OSError, ValueError):
+			return None
+
+		# mark as recently used
+		for suffix in ('.npz', '.npy'):
+			try:
+				os.utime(entry + suffix, None)
+			except OSError:
+				pass
+		return meta, data
+
+	def _atomic_write(self, target, writer):
+		fd, tmpname = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'wb') as fh:
+				writer(fh)
+			os.rename(tmpname, target)
+		except:
+			self._remove(tmpname)
+			raise
+
+	def store(self, filename, meta, data=None):
+		"""Writes an entry for a source file and enforces the size limit.
+
+		:param filename: Source file name.
+		:type filename: String
+		:param meta: Arrays to keep in the metadata archive.
+		:type meta: Dictionary
+		:param data: Array to keep in a separate file. If None, only the metadata archive is replaced.
+		:type data: Numpy array
+		"""
+		self._drop_stale(filename)
+		self._store(self._entry(filename), meta, data)
+
+	def store_keyed(self, key, meta, data):
+		"""Writes an entry identified by a content key and enforces the size limit.
+
+		:param key: Entry name. Letters, digits and dashes only.
+		:type key: String
+		:param meta: Arrays to keep in the metadata archive.
+		:type meta: Dictionary
+		:param data: Array to keep in a separate file.
+		:type data: Numpy array
+		"""
+		self._store(os.path.join(self._directory, key), meta, data)
+
+	def _store(self, entry, meta, data):
+		if data is not None:
+			self._atomic_write(entry + '.npy', lambda fh: np.save(fh, data))
+		self._atomic_write(entry + '.npz', lambda fh: np.savez(fh, **meta))
+		self.evict(keep=os.path.basename(entry))
+
+	def allocate(self, filename, shape, dtype):
+		"""Creates the array file of an entry as writable memory map.
+
+		The entry only becomes valid once its metadata are written with :meth:`store`.
+
+		:param filename: Source file name.
+		:type filename: String
+		:param shape: Array shape.
+		:type shape: Tuple
+		:param dtype: Array data type.
+		:return: Memory-mapped array.
+		"""
+		self._drop_stale(filename)
+		entry = self._entry(filename)
+		self._remove(entry + '.npz')
+		return np.lib.format.open_memmap(entry + '.npy', mode='w+', dtype=dtype, shape=shape)
+
+	def evict(self, keep=None):
+		"""Deletes least recently used entries until the cache fits into the size limit.
+
+		Temporary files of writes in progress do not count towards the limit. Those older than
+		:data:`STALE_TEMPORARY_AGE` are left over from interrupted writes and are deleted.
+
+		:param keep: Name of an entry that is not to be deleted even if the limit cannot be met otherwise.
+		:type keep: String
+		"""
+		entries = {}
+		for name in os.listdir(self._directory):
+			path = os.path.join(self._directory, name)
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			if name.endswith('.tmp'):
+				if time.time() - stat.st_mtime > STALE_TEMPORARY_AGE:
+					self._remove(path)
+				continue
+			base = name.rsplit('.', 1)[0]
+			size, mtime = entries.get(base, (0, 0))
+			entries[base] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+		total = sum(size for size, mtime in entries.values())
+		for base, (size, mtime) in sorted(entries.items(), key=lambda item: item[1][1]):
+			if total <= self._max_size:
+				break
+			if base == keep:
+				continue
+			for suffix in ('.npz', '.npy'):
+				self._remove(os.path.join(self._directory, base + suffix))
+			total -= size
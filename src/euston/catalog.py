@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# system modules
+import fnmatch
+import json
+import multiprocessing
+import os
+
+# third-party modules
+import numpy as np
+
+# custom modules
+import io
+
+#: Default file name pattern for cube files
+CUBE_PATTERN = '*.cube*'
+#: Number of decimals of grid vectors and origin compared when grouping compatible grids
+GRID_DECIMALS = 6
+
+
+def read_header(filename):
+	""" Reads the metadata of a cube file without touching the voxel data.
+
+	:param filename: Cube file name. May be gzipped.
+	:type filename: String
+	:return: Dictionary with file size and modification time, atom count, voxel counts, voxel vectors, origin and H
+		matrix. Lengths in Angstrom.
+	"""
+	stat = os.stat(filename)
+	cube = io.CubeFile(filename, stream=True)
+	cube.close()
+	return {
+		'size': stat.st_size,
+		'mtime': stat.st_mtime,
+		'natoms': cube.count_atoms(),
+		'nvoxel': [int(_) for _ in cube._nvoxel],
+		'vectors': cube._vectors.tolist(),
+		'origin': cube.get_origin().tolist(),
+		'h_matrix': cube.get_h_matrix().tolist(),
+	}
+
+
+def _read_header_safe(filename):
+	try:
+		return filename, read_header(filename), None
+	except (IOError, OSError, ValueError) as e:
+		return filename, None, str(e)
+
+
+class CubeCatalog(object):
+	"""Index of cube file metadata that is kept in a JSON file."""
+
+	def __init__(self, filename=None):
+		"""Loads an existing index.
+
+		:param filename: Index file name. The index starts empty if the file does not exist.
+		:type filename: String
+		"""
+		self._entries = {}
+		self._filename = filename
+		if filename is not None and os.path.exists(filename):
+			with open(filename) as fh:
+				self._entries = json.load(fh)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, filename):
+		return os.path.abspath(filename) in self._entries
+
+	def get(self, filename):
+		"""Metadata of a cube file as given by :func:`read_header`."""
+		return self._entries[os.path.abspath(filename)]
+
+	def get_filenames(self):
+		return sorted(self._entries.keys())
+
+	def save(self, filename=None):
+		"""Writes the index.
+
+		:param filename: Index file name. Defaults to the file the index has been loaded from.
+		:type filename: String
+		"""
+		if filename is None:
+			filename = self._filename
+		if filename is None:
+			raise ValueError('No index file name given.')
+		tmpname = filename + '.tmp'
+		with open(tmpname, 'w') as fh:
+			json.dump(self._entries, fh, indent=1, sort_keys=True)
+		os.rename(tmpname, filename)
+
+	def _is_current(self, filename):
+		entry = self._entries.get(filename)
+		if entry is None:
+			return False
+		stat = os.stat(filename)
+		return entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+	def update(self, directory, pattern=CUBE_PATTERN, jobs=1):
+		"""Scans a directory tree and reads the headers of new or modified files in parallel.
+
+		Entries of files that no longer exist below the directory are removed.
+
+		:param directory: Root directory.
+		:type directory: String
+		:param pattern: Shell pattern for file names.
+		:type pattern: String
+		:param jobs: Number of parallel processes.
+		:type jobs: Integer
+		:return: Dictionary of file names that could not be read with the corresponding error message.
+		"""
+		directory = os.path.abspath(directory)
+		found = set()
+		for root, dirnames, filenames in os.walk(directory):
+			for name in fnmatch.filter(filenames, pattern):
+				found.add(os.path.join(root, name))
+
+		for filename in self._entries.keys():
+			if filename.startswith(directory + os.sep) and filename not in found:
+				del self._entries[filename]
+
+		pending = sorted(_ for _ in found if not self._is_current(_))
+		if jobs > 1 and len(pending) > 1:
+			pool = multiprocessing.Pool(min(jobs, len(pending)))
+			results = pool.map(_read_header_safe, pending, chunksize=max(1, len(pending) // (4 * jobs)))
+			pool.close()
+			pool.join()
+		else:
+			results = map(_read_header_safe, pending)
+
+		errors = {}
+		for filename, header, error in results:
+			if header is None:
+				errors[filename] = error
+			else:
+				self._entries[filename] = header
+		return errors
+
+	def group_compatible(self, filenames=None):
+		"""Groups cube files of identical grids, i.e. identical voxel counts, voxel vectors and origin.
+
+		:param filenames: Files to consider. Defaults to all files in the index.
+		:type filenames: List of strings
+		:return: List of lists of file names. Largest groups first.
+		"""
+		if filenames is None:
+			filenames = self.get_filenames()
+		groups = {}
+		for filename in filenames:
+			entry = self.get(filename)
+			key = (tuple(entry['nvoxel']), tuple(np.round(entry['vectors'], GRID_DECIMALS).ravel()),
+				   tuple(np.round(entry['origin'], GRID_DECIMALS)))
+			groups.setdefault(key, []).append(os.path.abspath(filename))
+		return sorted(groups.values(), key=lambda group: (-len(group), group[0]))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# system modules
+import os
+
+# third-party modules
+import numpy as np
+
+# custom modules
+import io
+
+#: Number of voxels per chunk processed at once for every input file
+CHUNK_VOXELS = 2 ** 17
+
+
+def check_compatible(cubes):
+	""" Verifies that cube files share the same grid.
+
+	:param cubes: Cube files to compare.
+	:type cubes: List of :class:`euston.io.CubeFile`
+	"""
+	# compare in Angstrom, so files of different length units can be combined
+	reference = cubes[0]
+	for cube in cubes[1:]:
+		if not np.all(cube._nvoxel == reference._nvoxel):
+			raise ValueError('Incompatible voxel counts.')
+		if not np.allclose(cube.get_h_matrix(), reference.get_h_matrix()):
+			raise ValueError('Incompatible voxel vectors.')
+		if not np.allclose(cube.get_origin(), reference.get_origin()):
+			raise ValueError('Incompatible origin.')
+
+
+def iter_chunks(blocks, size=CHUNK_VOXELS):
+	""" Regroups a sequence of arrays into chunks of equal length. Only the last chunk may be shorter.
+
+	:param blocks: Iterable of flat arrays.
+	:param size: Chunk length.
+	:type size: Integer
+	"""
+	pending = []
+	count = 0
+	for block in blocks:
+		pending.append(block)
+		count += len(block)
+		if count < size:
+			continue
+		data = np.concatenate(pending)
+		full = len(data) - len(data) % size
+		for start in range(0, full, size):
+			yield data[start:start + size]
+		pending = [data[full:]]
+		count = len(pending[0])
+	if count > 0:
+		yield np.concatenate(pending)
+
+
+def iter_linear_combination(cubes, weights, constant=0., chunksize=CHUNK_VOXELS):
+	""" Evaluates a linear combination of cube files chunk by chunk.
+
+	Only one chunk per input file is held in memory at any time, so the input files may be opened in streaming mode.
+
+	:param cubes: Cube files of identical grids.
+	:type cubes: List of :class:`euston.io.CubeFile`
+	:param weights: Coefficient for each cube file.
+	:type weights: List of floats
+	:param constant: Value added to every voxel.
+	:type constant: Float
+	:param chunksize: Number of voxels per chunk.
+	:type chunksize: Integer
+	:return: Generator of flat voxel data chunks.
+	"""
+	if len(cubes) == 0 or len(cubes) != len(weights):
+		raise ValueError('Need one weight per cube file.')
+	check_compatible(cubes)
+	return _iter_linear_combination(cubes, weights, constant, chunksize)
+
+
+def _iter_linear_combination(cubes, weights, constant, chunksize):
+	streams = [iter_chunks(cube.iter_voxels(), chunksize) for cube in cubes]
+	while True:
+		chunks = [next(stream, None) for stream in streams]
+		if chunks[0] is None:
+			if any(chunk is not None for chunk in chunks):
+				raise ValueError('Inconsistent voxel data lengths.')
+			return
+		if any(chunk is None or len(chunk) != len(chunks[0]) for chunk in chunks):
+			raise ValueError('Inconsistent voxel data lengths.')
+		result = np.zeros(len(chunks[0])) + constant
+		for weight, chunk in zip(weights, chunks):
+			result += weight * chunk
+		yield result
+
+
+def linear_combination(filenames, weights, output, constant=0., compress=None):
+	""" Writes a linear combination of cube files to a new cube file without loading any full grid.
+
+	Header and atoms are taken from the first input file.
+
+	:param filenames: Input cube file names.
+	:type filenames: List of strings
+	:param weights: Coefficient for each input file.
+	:type weights: List of floats
+	:param output: Output file name.
+	:type output: String
+	:param constant: Value added to every voxel.
+	:type constant: Float
+	:param compress: Whether to write gzipped output. See :meth:`euston.io.CubeFile.write`.
+	:type compress: Boolean
+	"""
+	# the output is written while the input files are still being read
+	if os.path.exists(output) and any(os.path.samefile(output, filename) for filename in filenames):
+		raise ValueError('Output file %s is one of the input files.' % output)
+	cubes, voxels = [], None
+	try:
+		for filename in filenames:
+			cubes.append(io.CubeFile(filename, stream=True))
+		voxels = iter_linear_combination(cubes, weights, constant)
+		cubes[0].write(output, compress=compress, voxels=voxels)
+	finally:
+		# also releases the input files if a check fails or writing stops early
+		if voxels is not None:
+			voxels.close()
+		for cube in cubes:
+			cube.close()
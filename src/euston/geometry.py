@@ -1,8 +1,31 @@
 #!/usr/bin/env python
 
-import math
 import numpy as np
 
+#: Approximate number of vector pairs processed at once in batched distance calculations
+PAIR_BLOCK_SIZE = 2 ** 18
+
+def _angles_between(a, b):
+	""" Calculates the angles between pairs of vectors safely.
+
+	:param a: First input vectors
+	:type a: Numpy array of shape (..., 3)
+	:param b: Second input vectors
+	:type b: Numpy array of shape (..., 3)
+	:return: Angles of shape (...)
+	:rtype: Radians
+	"""
+	a = np.asarray(a, dtype=np.float64)
+	b = np.asarray(b, dtype=np.float64)
+	norms = np.sqrt((a ** 2).sum(axis=-1) * (b ** 2).sum(axis=-1))
+	if np.any(norms == 0):
+		raise ValueError('Got zero vector.')
+	cosines = (a * b).sum(axis=-1) / norms
+	if np.any(np.isnan(cosines)):
+		raise ValueError('NaN in vectors.')
+	# rounding may leave parallel vectors slightly outside the domain of arccos
+	return np.arccos(np.clip(cosines, -1., 1.))
+
 def _angle_between(a, b):
 	""" Calculates the angle between two vectors safely.
 
@@ -13,22 +36,7 @@ def _angle_between(a, b):
 	:return: Angle
 	:rtype: Radians
 	"""
-	a = np.copy(np.array(a))
-	b = np.copy(np.array(b))
-	if np.linalg.norm(a) == 0 or np.linalg.norm(b) == 0:
-		raise ValueError('Got zero vector.')
-	a /= np.linalg.norm(a)
-	b /= np.linalg.norm(b)
-	angle = np.arccos(np.dot(a, b))
-
-	if np.isnan(angle):
-		if np.isnan(np.min(a)) or np.isnan(np.min(b)):
-			raise ValueError('NaN in vectors.')
-		if (a == b).all():
-			return 0.0
-		else:
-			return np.pi
-	return angle
+	return float(_angles_between(a, b))
 
 def distance_pbc(a, b, h_matrix):
 	""" Calculates the distance between two vectors using periodic boundary conditions and the minimum image convention.
@@ -37,70 +45,159 @@ def distance_pbc(a, b, h_matrix):
 	:type a: Numpy array of shape (3)
 	:param b: Second vector
 	:type b: Numpy array of shape (3)
-	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
-	:type h_matrix: Numpy array of shape (3, 3)
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom. Pass a :class:`Cell` when
+		calling in a loop, so the cell is reduced only once.
+	:type h_matrix: Numpy array of shape (3, 3) or :class:`Cell`
 	:return: Distance between vectors.
 	:rtype: Float
 	"""
-	hinv = np.linalg.inv(h_matrix)
-	a_t = np.dot(hinv, a)
-	b_t = np.dot(hinv, b)
-	t_12 = b_t-a_t
-	t_12 -= np.round(t_12)
-	return np.linalg.norm(np.dot(h_matrix, t_12))
+	return np.linalg.norm(_as_cell(h_matrix).wrap_vectors(np.asarray(b, dtype=np.float64) - a))
+
+
+def _wrapped_pair_vectors(scaled_a, scaled_b, cell):
+	return cell._wrap_scaled(scaled_b[np.newaxis, :, :] - scaled_a[:, np.newaxis, :])
+
+
+def distances_pbc(a, b, h_matrix, return_vectors=False, blocksize=PAIR_BLOCK_SIZE):
+	""" Calculates all distances between two sets of vectors using periodic boundary conditions and the minimum image
+	convention.
+
+	The H matrix is reduced and inverted once and the pairs are processed in blocks of rows to limit the memory
+	requirements.
+
+	:param a: First set of vectors.
+	:type a: Numpy array of shape (n, 3)
+	:param b: Second set of vectors.
+	:type b: Numpy array of shape (m, 3)
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+	:type h_matrix: Numpy array of shape (3, 3) or :class:`Cell`
+	:param return_vectors: Whether to return the minimum image displacement vectors from a to b as well.
+	:type return_vectors: Boolean
+	:param blocksize: Approximate number of pairs evaluated at once.
+	:type blocksize: Integer
+	:return: Distances as numpy array of shape (n, m). If requested, tuple of distances and displacement vectors of
+		shape (n, m, 3).
+	"""
+	a = np.asarray(a, dtype=np.float64).reshape(-1, 3)
+	b = np.asarray(b, dtype=np.float64).reshape(-1, 3)
+	cell = _as_cell(h_matrix).get_reduced()
+	hinv = cell.get_inverse()
+	scaled_a = np.dot(a, hinv.T)
+	scaled_b = np.dot(b, hinv.T)
+
+	distances = np.empty((len(a), len(b)))
+	if return_vectors:
+		vectors = np.empty((len(a), len(b), 3))
+	step = max(1, blocksize // max(1, len(b)))
+	for start in range(0, len(a), step):
+		block = _wrapped_pair_vectors(scaled_a[start:start + step], scaled_b, cell)
+		distances[start:start + step] = np.sqrt((block ** 2).sum(axis=2))
+		if return_vectors:
+			vectors[start:start + step] = block
+	if return_vectors:
+		return distances, vectors
+	return distances
+
+
+def pairwise_distances_pbc(a, h_matrix, return_vectors=False, blocksize=PAIR_BLOCK_SIZE):
+	""" Calculates the distances of all pairs within one set of vectors using periodic boundary conditions and the
+	minimum image convention.
+
+	:param a: Vectors.
+	:type a: Numpy array of shape (n, 3)
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+	:type h_matrix: Numpy array of shape (3, 3) or :class:`Cell`
+	:param return_vectors: Whether to return the minimum image displacement vectors from the first to the second
+		vector of each pair as well.
+	:type return_vectors: Boolean
+	:param blocksize: Approximate number of pairs evaluated at once.
+	:type blocksize: Integer
+	:return: Condensed distances of the pairs (0, 1), (0, 2), ..., (1, 2), ... as numpy array of length n(n-1)/2, the
+		same order as :func:`scipy.spatial.distance.pdist`. If requested, tuple of distances and displacement vectors.
+	"""
+	a = np.asarray(a, dtype=np.float64).reshape(-1, 3)
+	cell = _as_cell(h_matrix).get_reduced()
+	scaled = np.dot(a, cell.get_inverse().T)
+
+	count = len(a)
+	distances = np.empty(count * (count - 1) // 2)
+	if return_vectors:
+		vectors = np.empty((len(distances), 3))
+	step = max(1, blocksize // max(1, count))
+	offset = 0
+	for start in range(0, count, step):
+		stop = min(start + step, count)
+		rows = np.arange(start, stop)
+		# only columns right of the first row of the block can hold pairs
+		upper = np.arange(start + 1, count)[np.newaxis, :] > rows[:, np.newaxis]
+		block = _wrapped_pair_vectors(scaled[start:stop], scaled[start + 1:], cell)[upper]
+		distances[offset:offset + len(block)] = np.sqrt((block ** 2).sum(axis=1))
+		if return_vectors:
+			vectors[offset:offset + len(block)] = block
+		offset += len(block)
+	if return_vectors:
+		return distances, vectors
+	return distances
+
 
 def hmatrix_to_abc(h_matrix, degrees=False):
 	""" H matrix representation as box lengths and box angles.
 
-	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
-	:type h_matrix: Numpy array of shape (3, 3)
+	:param h_matrix: H matrix with the cell vectors as columns or a stack of them, e.g. one per frame. Unit of
+		length: Angstrom.
+	:type h_matrix: Numpy array of shape (3, 3) or (frames, 3, 3)
 	:param degrees: Switch to return angles in degrees instead of radians.
 	:type degrees: Boolean
 	:return: Box specification following a, b, c, alpha, beta, gamma. Distances in Angstrom.
-	:rtype: Numpy array of length 6
-	"""
-	result = np.zeros(6)
-	for i in range(3):
-		result[i] = np.linalg.norm(h_matrix[:, i])
-	result[3] = _angle_between(h_matrix[:, 1], h_matrix[:, 2])
-	result[4] = _angle_between(h_matrix[:, 0], h_matrix[:, 2])
-	result[5] = _angle_between(h_matrix[:, 0], h_matrix[:, 1])
+	:rtype: Numpy array of length 6 or of shape (frames, 6)
+	"""
+	if isinstance(h_matrix, Cell):
+		return np.copy(h_matrix.get_abc(degrees=degrees))
+	h_matrix = np.asarray(h_matrix, dtype=np.float64)
+	result = np.zeros(h_matrix.shape[:-2] + (6, ))
+	result[..., :3] = np.sqrt((h_matrix ** 2).sum(axis=-2))
+	result[..., 3] = _angles_between(h_matrix[..., :, 1], h_matrix[..., :, 2])
+	result[..., 4] = _angles_between(h_matrix[..., :, 0], h_matrix[..., :, 2])
+	result[..., 5] = _angles_between(h_matrix[..., :, 0], h_matrix[..., :, 1])
 	if degrees:
-		result[3:] = map(math.degrees, result[3:])
+		result[..., 3:] = np.degrees(result[..., 3:])
 	return result
 
 def abc_to_hmatrix(a, b, c, alpha, beta, gamma, degrees=True):
 	""" Box vectors from box vector lengths and box vector angles.
 
+	All arguments may be arrays of the same shape, e.g. one entry per frame, which gives a stack of H matrices. Box
+	specifications of shape (frames, 6) convert with ``abc_to_hmatrix(*abc.T)``.
+
 	:param a: First box vector length in Angstrom.
-	:type a: Float
+	:type a: Float or numpy array
 	:param b: Second box vector length in Angstrom.
-	:type b: Float
+	:type b: Float or numpy array
 	:param c: Third box vector length in Angstrom.
-	:type c: Float
+	:type c: Float or numpy array
 	:param alpha: Fist box angle in radians.
-	:type alpha: Float
+	:type alpha: Float or numpy array
 	:param beta: Second box angle in radians.
-	:type beta: Float
+	:type beta: Float or numpy array
 	:param gamma: Third box angle in radians.
-	:type gamma: Float
+	:type gamma: Float or numpy array
 	:param degrees: Switch to accept input angles in degrees.
 	:type degrees: Boolean
 	:return: H matrix with the cell vectors as columns. Unit of length: Angstrom.
-	:rtype: Numpy array of shape (3, 3)
+	:rtype: Numpy array of shape (3, 3) or (frames, 3, 3)
 	"""
+	a, b, c, alpha, beta, gamma = np.broadcast_arrays(*[np.asarray(_, dtype=np.float64) for _ in (a, b, c, alpha, beta, gamma)])
 	if degrees:
-		alpha, beta, gamma = map(math.radians, (alpha, beta, gamma))
-	result = np.zeros((3, 3))
+		alpha, beta, gamma = np.radians(alpha), np.radians(beta), np.radians(gamma)
+	result = np.zeros(a.shape + (3, 3))
 
-	a = np.array((a, 0, 0))
-	b = b * np.array((math.cos(gamma), math.sin(gamma), 0))
-	bracket = (math.cos(alpha) - math.cos(beta) * math.cos(gamma)) / math.sin(gamma)
-	c = c * np.array((math.cos(beta), bracket, math.sqrt(math.sin(beta) ** 2 - bracket ** 2)))
-
-	result[:, 0] = a
-	result[:, 1] = b
-	result[:, 2] = c
+	result[..., 0, 0] = a
+	result[..., 0, 1] = b * np.cos(gamma)
+	result[..., 1, 1] = b * np.sin(gamma)
+	bracket = (np.cos(alpha) - np.cos(beta) * np.cos(gamma)) / np.sin(gamma)
+	result[..., 0, 2] = c * np.cos(beta)
+	result[..., 1, 2] = c * bracket
+	result[..., 2, 2] = c * np.sqrt(np.sin(beta) ** 2 - bracket ** 2)
 
 	return result
 
@@ -118,6 +215,7 @@ def repeat_vector(h_matrix, repeat_a, repeat_b, repeat_c):
 	:return: Cartesian vector. Unit of length: Angstrom.
 	:rtype: Numpy array of length 3
 	"""
+	h_matrix = np.asarray(h_matrix)
 	return h_matrix[:, 0] * repeat_a + h_matrix[:, 1] * repeat_b + h_matrix[:, 2] * repeat_c
 
 def box_vertices(h_matrix, repeat_a, repeat_b, repeat_c):
@@ -145,6 +243,7 @@ def vector_repetitions(minrval, h_matrix, index):
 	:return: Number of necessary repetitions of the selected cell vector.
 	:rtype: Integer
 	"""
+	h_matrix = np.asarray(h_matrix)
 	if index == 0:
 		j1, j2 = 1, 2
 	if index == 1:
@@ -161,21 +260,106 @@ def vector_repetitions(minrval, h_matrix, index):
 
 
 def cell_volume(h_matrix):
-	ab = np.cross(h_matrix[:, 0], h_matrix[:, 1])
-	return np.abs(np.dot(ab, h_matrix[:, 2]))
+	""" Volume of a cell or of each cell in a stack.
 
+	:param h_matrix: H matrix with the cell vectors as columns or a stack of them. Unit of length: Angstrom.
+	:type h_matrix: Numpy array of shape (3, 3) or (frames, 3, 3)
+	:return: Volume in cubic Angstrom. Numpy array of length frames for stacks.
+	"""
+	if isinstance(h_matrix, Cell):
+		return h_matrix.get_volume()
+	h_matrix = np.asarray(h_matrix)
+	ab = np.cross(h_matrix[..., :, 0], h_matrix[..., :, 1])
+	return np.abs((ab * h_matrix[..., :, 2]).sum(axis=-1))
 
-def cartesian_to_scaled_coordinates(coordinates, h_matrix):
-	h = np.linalg.inv(h_matrix)
-	for i in range(len(coordinates)):
-		coordinates[i] = (h * coordinates[i]).sum(axis=1)
-	return coordinates
 
+def cell_inverse(h_matrix):
+	""" Inverse of an H matrix or of each H matrix in a stack.
+
+	:param h_matrix: H matrix with the cell vectors as columns or a stack of them. Unit of length: Angstrom.
+	:type h_matrix: Numpy array of shape (3, 3) or (frames, 3, 3)
+	:return: Numpy array of the same shape.
+	"""
+	if isinstance(h_matrix, Cell):
+		return h_matrix.get_inverse()
+	return np.linalg.inv(np.asarray(h_matrix, dtype=np.float64))
 
-def scaled_to_cartesian_coordinates(coordinates, h_matrix):
-	for i in range(len(coordinates)):
-		coordinates[i] = (h_matrix * coordinates[i]).sum(axis=1)
-	return coordinates
+
+def _transform_coordinates(coordinates, matrix, out, inplace):
+	""" Applies a matrix to the last axis of a coordinate array.
+
+	:param coordinates: Coordinates of shape (..., 3).
+	:param matrix: Matrix of shape (3, 3) or one matrix per frame of shape (frames, 3, 3) for coordinates of shape
+		(frames, n, 3).
+	:param out: Optional output array of the same shape.
+	:param inplace: Whether to overwrite the input coordinates.
+	:return: Transformed coordinates.
+	"""
+	if inplace:
+		if out is not None:
+			raise ValueError('Either give an output array or convert in place.')
+		if not isinstance(coordinates, np.ndarray) or coordinates.dtype.kind != 'f':
+			raise TypeError('In place conversion requires a floating point numpy array.')
+		out = coordinates
+	coordinates = np.asarray(coordinates)
+	if coordinates.shape[-1:] != (3, ):
+		raise ValueError('Coordinates need to be of shape (..., 3).')
+	if matrix.ndim == 3:
+		if coordinates.ndim != 3 or len(coordinates) != len(matrix):
+			raise ValueError('Need coordinates of shape (frames, n, 3) for one H matrix per frame.')
+		result = np.matmul(coordinates, np.swapaxes(matrix, 1, 2))
+		if out is None:
+			return result
+		if out.shape != coordinates.shape:
+			raise ValueError('Output array has the wrong shape.')
+		out[...] = result
+		return out
+	if out is None:
+		return np.dot(coordinates, matrix.T)
+
+	if out.shape != coordinates.shape:
+		raise ValueError('Output array has the wrong shape.')
+	if out is not coordinates and out.dtype == np.float64 and out.flags.c_contiguous and coordinates.ndim == 2:
+		np.dot(coordinates, matrix.T, out=out)
+	else:
+		out[...] = np.dot(coordinates, matrix.T)
+	return out
+
+
+def cartesian_to_scaled_coordinates(coordinates, h_matrix, out=None, inplace=False):
+	""" Converts cartesian coordinates to fractional coordinates of the cell vectors.
+
+	:param coordinates: Cartesian coordinates, e.g. of shape (n, 3) or (frames, n, 3). Unit of length: Angstrom.
+	:type coordinates: Numpy array of shape (..., 3)
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom. For coordinates of shape
+		(frames, n, 3), one H matrix per frame may be given.
+	:type h_matrix: Numpy array of shape (3, 3) or (frames, 3, 3)
+	:param out: Array to write the result to.
+	:type out: Numpy array of the same shape as the coordinates
+	:param inplace: Whether to overwrite the input coordinates. The input is left untouched otherwise.
+	:type inplace: Boolean
+	:return: Scaled coordinates.
+	"""
+	if isinstance(h_matrix, Cell) or np.ndim(h_matrix) == 2:
+		return _transform_coordinates(coordinates, _as_cell(h_matrix).get_inverse(), out, inplace)
+	return _transform_coordinates(coordinates, cell_inverse(h_matrix), out, inplace)
+
+
+def scaled_to_cartesian_coordinates(coordinates, h_matrix, out=None, inplace=False):
+	""" Converts fractional coordinates of the cell vectors to cartesian coordinates.
+
+	:param coordinates: Scaled coordinates, e.g. of shape (n, 3) or (frames, n, 3).
+	:type coordinates: Numpy array of shape (..., 3)
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom. For coordinates of shape
+		(frames, n, 3), one H matrix per frame may be given.
+	:type h_matrix: Numpy array of shape (3, 3) or (frames, 3, 3)
+	:param out: Array to write the result to.
+	:type out: Numpy array of the same shape as the coordinates
+	:param inplace: Whether to overwrite the input coordinates. The input is left untouched otherwise.
+	:type inplace: Boolean
+	:return: Cartesian coordinates. Unit of length: Angstrom.
+	"""
+	return _transform_coordinates(coordinates, np.asarray(h_matrix), out, inplace)
 
 
 def cell_longest_diameter(h_matrix):
@@ -185,6 +369,8 @@ def cell_longest_diameter(h_matrix):
 	:type h_matrix: Numpy array of shape (3, 3)
 	:return: Float
 	"""
+	if isinstance(h_matrix, Cell):
+		return h_matrix.get_longest_diameter()
 	a = h_matrix[:, 0]
 	b = h_matrix[:, 1]
 	c = h_matrix[:, 2]
@@ -197,54 +383,600 @@ def cell_longest_diameter(h_matrix):
 	return mdist
 
 
-def cell_multiply(coord, x, y, z, h_matrix=None, scaling_in=False, scaling_out=False):
+def image_offsets(x, y, z):
+	""" Lattice translations of the images of a supercell in fractional coordinates.
+
+	:param x: Number of images along the first cell vector.
+	:type x: Integer
+	:param y: Number of images along the second cell vector.
+	:type y: Integer
+	:param z: Number of images along the third cell vector.
+	:type z: Integer
+	:return: Numpy array of shape (x * y * z, 3) with the last axis running fastest, starting with (0, 0, 0).
+	"""
 	for i in (x, y, z):
 		if i < 1 or int(i) != i:
 			raise ValueError('Invalid image count.')
+	return np.indices((int(x), int(y), int(z))).reshape(3, -1).T
 
-	# copy input
-	coord = np.copy(coord)
 
-	# prepare data
-	factor = x * y * z
-	atoms = coord.shape[0]
-	newcoord = np.zeros((atoms * factor, 3))
-	offset = 1
+def cell_multiply(coord, x, y, z, h_matrix=None, scaling_in=False, scaling_out=False):
+	""" Repeats atoms to a supercell.
+
+	:param coord: Atom positions.
+	:type coord: Numpy array of shape (n, 3)
+	:param x: Number of images along the first cell vector.
+	:type x: Integer
+	:param y: Number of images along the second cell vector.
+	:type y: Integer
+	:param z: Number of images along the third cell vector.
+	:type z: Integer
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom. Not needed if both input and
+		output are scaled coordinates.
+	:type h_matrix: Numpy array of shape (3, 3)
+	:param scaling_in: Whether the input positions are scaled coordinates.
+	:type scaling_in: Boolean
+	:param scaling_out: Whether to return scaled coordinates of the supercell.
+	:type scaling_out: Boolean
+	:return: Numpy array of shape (x * y * z * n, 3), one block of n atoms per image in the order of
+		:func:`image_offsets`.
+	"""
+	offsets = image_offsets(x, y, z)
+	coord = np.asarray(coord, dtype=np.float64).reshape(-1, 3)
+	if scaling_in != scaling_out or not scaling_in:
+		if h_matrix is None:
+			if scaling_out:
+				raise TypeError('H matrix has to be given for partially cartesian data.')
+			raise TypeError('H matrix has to be given for cartesian data.')
+		h_matrix = np.asarray(h_matrix, dtype=np.float64)
 
-	# copy data
 	if scaling_out:
 		if not scaling_in:
-			if h_matrix is None:
-				raise TypeError('H matrix has to be given for partially cartesian data.')
 			coord = cartesian_to_scaled_coordinates(coord, h_matrix)
-		newcoord[:atoms] = coord
-
-		for i_x in range(x):
-			for i_y in range(y):
-				for i_z in range(z):
-					if i_x == i_y == i_z == 0:
-						continue
-					newcoord[atoms * offset:atoms * (offset + 1)] = coord
-					newcoord[atoms * offset:atoms * (offset + 1), 0] += (i_x)
-					newcoord[atoms * offset:atoms * (offset + 1), 1] += (i_y)
-					newcoord[atoms * offset:atoms * (offset + 1), 2] += (i_z)
-					offset += 1
-		newcoord[:, 0] /= x
-		newcoord[:, 1] /= y
-		newcoord[:, 2] /= z
+		newcoord = coord[np.newaxis, :, :] + offsets[:, np.newaxis, :]
+		newcoord /= np.array((x, y, z), dtype=np.float64)
 	else:
-		if h_matrix is None:
-			raise TypeError('H matrix has to be given for cartesian data.')
 		if scaling_in:
 			coord = scaled_to_cartesian_coordinates(coord, h_matrix)
-		newcoord[:atoms] = coord
-		for i_x in range(x):
-			for i_y in range(y):
-				for i_z in range(z):
-					if i_x == i_y == i_z == 0:
-						continue
-					vector = h_matrix[:, 0] * i_x + h_matrix[:, 1] * i_y + h_matrix[:, 2] * i_z
-					newcoord[atoms * offset:atoms * (offset + 1)] = coord + vector
-					offset += 1
-
-	return newcoord
\ No newline at end of file
+		newcoord = coord[np.newaxis, :, :] + np.dot(offsets, h_matrix.T)[:, np.newaxis, :]
+	return newcoord.reshape(-1, 3)
+
+
+class Supercell(object):
+	""" Supercell that computes atom positions on demand instead of storing all images. """
+
+	def __init__(self, coord, x, y, z, h_matrix, scaling_in=False):
+		"""Defines the supercell.
+
+		:param coord: Atom positions in the unit cell.
+		:type coord: Numpy array of shape (n, 3)
+		:param x: Number of images along the first cell vector.
+		:type x: Integer
+		:param y: Number of images along the second cell vector.
+		:type y: Integer
+		:param z: Number of images along the third cell vector.
+		:type z: Integer
+		:param h_matrix: H matrix of the unit cell with the cell vectors as columns. Unit of length: Angstrom.
+		:type h_matrix: Numpy array of shape (3, 3)
+		:param scaling_in: Whether the input positions are scaled coordinates.
+		:type scaling_in: Boolean
+		"""
+		image_offsets(x, y, z)
+		self._h_matrix = np.array(h_matrix, dtype=np.float64)
+		self._coord = np.array(coord, dtype=np.float64).reshape(-1, 3)
+		if scaling_in:
+			self._coord = scaled_to_cartesian_coordinates(self._coord, self._h_matrix)
+		self._repeats = (int(x), int(y), int(z))
+
+	def __len__(self):
+		return self.count_images() * len(self._coord)
+
+	def count_atoms(self):
+		"""Number of atoms in the unit cell."""
+		return len(self._coord)
+
+	def count_images(self):
+		return self._repeats[0] * self._repeats[1] * self._repeats[2]
+
+	def get_h_matrix(self):
+		"""H matrix of the supercell."""
+		return self._h_matrix * np.array(self._repeats, dtype=np.float64)
+
+	def get_position(self, atom, a, b, c):
+		""" Position of one atom in one image.
+
+		:param atom: Atom index in the unit cell.
+		:type atom: Integer
+		:param a: Image index along the first cell vector.
+		:type a: Integer
+		:param b: Image index along the second cell vector.
+		:type b: Integer
+		:param c: Image index along the third cell vector.
+		:type c: Integer
+		:return: Cartesian position. Unit of length: Angstrom.
+		"""
+		for index, repeats in zip((a, b, c), self._repeats):
+			if not 0 <= index < repeats:
+				raise IndexError('Image index out of range.')
+		return self._coord[atom] + repeat_vector(self._h_matrix, a, b, c)
+
+	def iter_blocks(self, images=None, blocksize=PAIR_BLOCK_SIZE):
+		""" Yields the positions of consecutive images in the order of :func:`cell_multiply`.
+
+		:param images: Number of images per block. Defaults to as many as fit into the block size.
+		:type images: Integer
+		:param blocksize: Approximate number of positions per block.
+		:type blocksize: Integer
+		:return: Generator of numpy arrays of shape (images * n, 3).
+		"""
+		if images is None:
+			images = max(1, blocksize // max(1, len(self._coord)))
+		total = self.count_images()
+		for start in range(0, total, images):
+			offsets = np.array(np.unravel_index(np.arange(start, min(start + images, total)), self._repeats)).T
+			shifts = np.dot(offsets, self._h_matrix.T)
+			yield (self._coord[np.newaxis, :, :] + shifts[:, np.newaxis, :]).reshape(-1, 3)
+
+	def get_coordinates(self):
+		"""All positions at once. Same as :func:`cell_multiply`."""
+		return np.concatenate(list(self.iter_blocks(images=self.count_images())))
+
+def _face_distances(h_matrix):
+	"""Distances between opposite faces of the cell. Unit of length: Angstrom."""
+	return 1. / np.linalg.norm(np.linalg.inv(np.asarray(h_matrix)), axis=1)
+
+
+class PeriodicKDTree(object):
+	""" Nearest neighbour search in periodic boundary conditions for arbitrary triclinic cells.
+
+	Sites and query points are wrapped into the unit cell in fractional coordinates. Instead of copying all sites for
+	every neighbouring cell, only the images within a margin around the cell are added to the search tree. Queries with a
+	nearest distance or search radius beyond the margin would be unreliable, so the tree is rebuilt with a larger margin
+	and searched again for the remaining points. The enlarged tree is kept, so later queries, e.g. of further chunks of
+	a grid, do not pay for the rebuild again. The result is exact for any cell shape, including cells where the minimum
+	image convention in fractional coordinates fails.
+	"""
+
+	def __init__(self, sites, h_matrix, leafsize=16, margin=None):
+		"""Prepares the search.
+
+		:param sites: Positions. Unit of length: Angstrom.
+		:type sites: Numpy array of shape (n, 3)
+		:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+		:type h_matrix: Numpy array of shape (3, 3) or :class:`Cell`
+		:param leafsize: Leaf size of the k-d tree.
+		:type leafsize: Integer
+		:param margin: Initial image margin around the cell. Defaults to the mean distance between sites.
+		:type margin: Float
+		"""
+		sites = np.array(sites, dtype=np.float64).reshape(-1, 3)
+		if len(sites) == 0:
+			raise ValueError('Need at least one site.')
+		# a reduced basis keeps the margin images close to the cell
+		cell = _as_cell(h_matrix).get_reduced()
+		self._h_matrix = cell.get_h_matrix()
+		self._h_inv = cell.get_inverse()
+		self._face_distances = cell.get_face_distances()
+		self._leafsize = leafsize
+		scaled = np.dot(sites, self._h_inv.T)
+		self._scaled = scaled - np.floor(scaled)
+		if margin is None:
+			margin = (cell_volume(self._h_matrix) / len(sites)) ** (1. / 3)
+		self._margin = None
+		self._tree = None
+		self._index = None
+		self._build(margin)
+
+	def _build(self, margin):
+		# import here to keep scipy optional for the remaining geometry functions
+		from scipy.spatial import cKDTree
+
+		extent = margin / self._face_distances
+		repeats = np.ceil(extent).astype(np.int)
+		shifts = np.array([(x, y, z) for x in range(-repeats[0], repeats[0] + 1)
+						   for y in range(-repeats[1], repeats[1] + 1) for z in range(-repeats[2], repeats[2] + 1)])
+		images = (self._scaled[np.newaxis, :, :] + shifts[:, np.newaxis, :]).reshape(-1, 3)
+		index = np.tile(np.arange(len(self._scaled)), len(shifts))
+		keep = np.all((images >= -extent) & (images <= 1 + extent), axis=1)
+		self._tree = cKDTree(np.dot(images[keep], self._h_matrix.T), leafsize=self._leafsize)
+		self._index = index[keep]
+		self._margin = margin
+
+	def count_images(self):
+		"""Number of site images currently in the search tree, including the sites themselves. Grows with the margin."""
+		return len(self._index)
+
+	def wrap(self, points):
+		""" Maps points into the unit cell.
+
+		:param points: Positions. Unit of length: Angstrom.
+		:type points: Numpy array of shape (n, 3)
+		:return: Positions inside the unit cell. Unit of length: Angstrom.
+		"""
+		scaled = np.dot(points, self._h_inv.T)
+		scaled -= np.floor(scaled)
+		return np.dot(scaled, self._h_matrix.T)
+
+	def query(self, points, n_jobs=1):
+		""" Closest site for each point, mirroring :meth:`scipy.spatial.cKDTree.query`.
+
+		:param points: Positions. Unit of length: Angstrom.
+		:type points: Numpy array of shape (n, 3)
+		:param n_jobs: Number of threads. -1 uses all cores.
+		:type n_jobs: Integer
+		:return: Tuple of distances and site indices.
+		"""
+		points = self.wrap(np.array(points, dtype=np.float64).reshape(-1, 3))
+		distances = np.empty(len(points))
+		indices = np.empty(len(points), dtype=np.int)
+		pending = np.arange(len(points))
+		while len(pending) > 0:
+			d, i = self._tree.query(points[pending], distance_upper_bound=self._margin, n_jobs=n_jobs)
+			found = np.isfinite(d)
+			distances[pending[found]] = d[found]
+			indices[pending[found]] = self._index[i[found]]
+			pending = pending[~found]
+			if len(pending) > 0:
+				self._build(2 * self._margin)
+		return distances, indices
+
+	def query_ball_point(self, points, r, n_jobs=1):
+		""" Sites with any image within a distance, mirroring :meth:`scipy.spatial.cKDTree.query_ball_point`.
+
+		:param points: Positions. Unit of length: Angstrom.
+		:type points: Numpy array of shape (n, 3)
+		:param r: Search radius. Unit of length: Angstrom.
+		:type r: Float
+		:param n_jobs: Number of threads. -1 uses all cores.
+		:type n_jobs: Integer
+		:return: List of sorted arrays of site indices, one per point.
+		"""
+		# every image within r of a point in the cell lies within a margin of r around the cell
+		if r > self._margin:
+			self._build(r)
+		points = self.wrap(np.array(points, dtype=np.float64).reshape(-1, 3))
+		found = self._tree.query_ball_point(points, r, n_jobs=n_jobs)
+		return [np.unique(self._index[np.array(_, dtype=np.int)]) for _ in found]
+
+
+class NeighborList(object):
+	""" Pairs of atoms within a cutoff distance in periodic boundary conditions for arbitrary triclinic cells.
+
+	Atoms are sorted into linked cells in fractional coordinates, so building the list scales linearly with the number
+	of atoms. Pairs are stored once each, together with the lattice translation of the partner image. Cutoffs longer
+	than the cell give multiple images of the same pair, including an atom with its own images.
+
+	With a non-zero skin, the list holds all pairs within cutoff plus skin and is only rebuilt once any atom has moved
+	by more than half the skin since the last build or the cell has changed. In between, distances are recalculated
+	for the stored pairs only. This requires trajectories that are not wrapped into the cell between frames, otherwise
+	every jump across the boundary causes a rebuild.
+	"""
+
+	def __init__(self, cutoff, skin=0.):
+		"""Prepares the neighbour search.
+
+		:param cutoff: Maximum pair distance. Unit of length: Angstrom.
+		:type cutoff: Float
+		:param skin: Additional distance of pairs kept for later frames. Unit of length: Angstrom.
+		:type skin: Float
+		"""
+		if cutoff <= 0 or skin < 0:
+			raise ValueError('Cutoff has to be positive and skin non-negative.')
+		self._cutoff = cutoff
+		self._skin = skin
+		self._reference = None
+		self._h_matrix = None
+		self._reduced = None
+		self._coordinates = None
+		self._first = None
+		self._second = None
+		self._translations = None
+		self._rebuilds = 0
+
+	def count_rebuilds(self):
+		return self._rebuilds
+
+	def update(self, coordinates, h_matrix):
+		""" Sets the coordinates of a new frame and rebuilds the list if necessary.
+
+		:param coordinates: Atom positions. Unit of length: Angstrom.
+		:type coordinates: Numpy array of shape (n, 3)
+		:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+		:type h_matrix: Numpy array of shape (3, 3) or :class:`Cell`
+		:return: Whether the list has been rebuilt.
+		:rtype: Boolean
+		"""
+		coordinates = np.array(coordinates, dtype=np.float64).reshape(-1, 3)
+		cell = _as_cell(h_matrix)
+		h_matrix = cell.get_h_matrix()
+		self._coordinates = coordinates
+		rebuild = self._reference is None or len(coordinates) != len(self._reference)
+		rebuild = rebuild or not np.allclose(h_matrix, self._h_matrix)
+		if not rebuild:
+			displacement = np.sqrt(((coordinates - self._reference) ** 2).sum(axis=1)).max()
+			rebuild = displacement > self._skin / 2
+		if rebuild:
+			self._h_matrix = h_matrix
+			# pairs are searched and stored in the reduced basis which needs fewer cells for skewed cells
+			self._reduced = cell.get_reduced().get_h_matrix()
+			self._build(coordinates)
+		return rebuild
+
+	def _build(self, coordinates):
+		rc = self._cutoff + self._skin
+		h_inv = np.linalg.inv(self._reduced)
+		raw = np.dot(coordinates, h_inv.T)
+		wraps = np.floor(raw)
+		scaled = raw - wraps
+
+		# linked cells of at least the search radius in width where possible
+		faces = _face_distances(self._reduced)
+		ncells = np.maximum(1, np.floor(faces / rc)).astype(np.int)
+		reach = np.ceil(rc / (faces / ncells) - 1e-12).astype(np.int)
+		cells = np.minimum((scaled * ncells).astype(np.int), ncells - 1)
+		cellid = np.ravel_multi_index(cells.T, ncells)
+		order = np.argsort(cellid, kind='mergesort')
+		counts = np.bincount(cellid, minlength=np.prod(ncells))
+		starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+		first, second, translations = [], [], []
+		atoms = np.arange(len(coordinates))
+		for offset in [(x, y, z) for x in range(-reach[0], reach[0] + 1) for y in range(-reach[1], reach[1] + 1)
+					   for z in range(-reach[2], reach[2] + 1)]:
+			target = cells + offset
+			shift = np.floor_divide(target, ncells)
+			target -= shift * ncells
+			targetid = np.ravel_multi_index(target.T, ncells)
+
+			# all atoms i paired with all atoms in the target cell of i
+			repeats = counts[targetid]
+			i = np.repeat(atoms, repeats)
+			if len(i) == 0:
+				continue
+			within = np.arange(len(i)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+			j = order[np.repeat(starts[targetid], repeats) + within]
+			s = shift[i]
+
+			# store each pair once
+			positive = (s[:, 0] > 0) | ((s[:, 0] == 0) & ((s[:, 1] > 0) | ((s[:, 1] == 0) & (s[:, 2] > 0))))
+			keep = (i < j) | ((i == j) & positive)
+			i, j, s = i[keep], j[keep], s[keep]
+
+			vectors = np.dot(scaled[j] + s - scaled[i], self._reduced.T)
+			keep = (vectors ** 2).sum(axis=1) < rc ** 2
+			first.append(i[keep])
+			second.append(j[keep])
+			# translation relative to the unwrapped input coordinates
+			translations.append(s[keep] - wraps[j[keep]] + wraps[i[keep]])
+
+		self._first = np.concatenate(first) if first else np.zeros(0, dtype=np.int)
+		self._second = np.concatenate(second) if second else np.zeros(0, dtype=np.int)
+		self._translations = np.concatenate(translations) if translations else np.zeros((0, 3))
+		self._reference = coordinates
+		self._rebuilds += 1
+
+	def get_pairs(self):
+		""" Pairs within the cutoff for the coordinates of the last update.
+
+		:return: Tuple of first atom indices, second atom indices, distances and vectors from the first to the second
+			atom. Unit of length: Angstrom.
+		"""
+		if self._reference is None:
+			raise AssertionError('No coordinates given yet.')
+		vectors = self._coordinates[self._second] - self._coordinates[self._first]
+		vectors += np.dot(self._translations, self._reduced.T)
+		distances = np.sqrt((vectors ** 2).sum(axis=1))
+		keep = distances < self._cutoff
+		return self._first[keep], self._second[keep], distances[keep], vectors[keep]
+
+
+def reduce_h_matrix(h_matrix):
+	""" Reduces the cell vectors to a basis of short and nearly orthogonal vectors spanning the same lattice.
+
+	Every vector is shortened by integer multiples of the other two until no combination with coefficients -1, 0 or 1
+	gives a shorter vector, i.e. the basis is Minkowski-reduced. Rounding in fractional coordinates of the reduced
+	basis gives the minimum image for all distances up to half the shortest distance between opposite faces of the
+	reduced cell, which is the largest such radius any basis of the lattice can offer.
+
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+	:type h_matrix: Numpy array of shape (3, 3)
+	:return: Tuple of the reduced H matrix and the integer matrix T with reduced = h_matrix T. The handedness is kept.
+	"""
+	h = np.array(h_matrix, dtype=np.float64)
+	transformation = np.eye(3, dtype=np.int)
+	combinations = [(x, y) for x in (-1, 0, 1) for y in (-1, 0, 1) if (x, y) != (0, 0)]
+	changed = True
+	while changed:
+		changed = False
+		for i in range(3):
+			j, k = [_ for _ in range(3) if _ != i]
+
+			# pairwise reduction for large multiples
+			for other in (j, k):
+				mu = np.dot(h[:, i], h[:, other]) / np.dot(h[:, other], h[:, other])
+				if abs(mu) > 0.5 + 1e-10:
+					shift = int(np.round(mu))
+					h[:, i] -= shift * h[:, other]
+					transformation[:, i] -= shift * transformation[:, other]
+					changed = True
+
+			# shortest combination with the other two vectors
+			best = np.dot(h[:, i], h[:, i]) * (1 - 1e-10)
+			choice = None
+			for x, y in combinations:
+				candidate = h[:, i] + x * h[:, j] + y * h[:, k]
+				length = np.dot(candidate, candidate)
+				if length < best:
+					best, choice = length, (x, y)
+			if choice is not None:
+				x, y = choice
+				h[:, i] += x * h[:, j] + y * h[:, k]
+				transformation[:, i] += x * transformation[:, j] + y * transformation[:, k]
+				changed = True
+	return h, transformation
+
+
+#: Last raw H matrix converted to a cell, as tuple of the matrix bytes and the cell
+def _as_cell(h_matrix):
+	if isinstance(h_matrix, Cell):
+		return h_matrix
+	return Cell(h_matrix)
+
+
+class Cell(object):
+	""" Immutable periodic cell that calculates derived quantities once.
+
+	Wherever an H matrix is expected, a cell can be passed instead, so repeated calls do not repeat matrix inversions
+	or lattice reductions. Converts to the H matrix with :func:`numpy.asarray`. Iterating over a cell yields the three
+	cell vectors, so ``a, b, c = cell`` works.
+	"""
+
+	__slots__ = ('_h_matrix', '_cache')
+
+	def __init__(self, h_matrix):
+		"""Defines the cell.
+
+		:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+		:type h_matrix: Numpy array of shape (3, 3)
+		"""
+		h_matrix = np.array(h_matrix, dtype=np.float64)
+		if h_matrix.shape != (3, 3):
+			raise ValueError('H matrix has to be of shape (3, 3).')
+		if abs(np.linalg.det(h_matrix)) < 1e-12:
+			raise ValueError('Cell vectors are linearly dependent.')
+		h_matrix.flags.writeable = False
+		object.__setattr__(self, '_h_matrix', h_matrix)
+		object.__setattr__(self, '_cache', {})
+
+	def __setattr__(self, name, value):
+		raise AttributeError('Cell objects are immutable.')
+
+	def __reduce__(self):
+		return Cell, (np.array(self._h_matrix), )
+
+	@classmethod
+	def from_abc(cls, a, b, c, alpha, beta, gamma, degrees=True):
+		"""Cell from box vector lengths and angles. See :func:`abc_to_hmatrix`."""
+		return cls(abc_to_hmatrix(a, b, c, alpha, beta, gamma, degrees=degrees))
+
+	@classmethod
+	def from_vectors(cls, a, b, c):
+		"""Cell from the three cell vectors."""
+		return cls(np.array([a, b, c], dtype=np.float64).T)
+
+	@classmethod
+	def from_string(cls, text, abc=False, degrees=True):
+		""" Cell from a command line argument.
+
+		:param text: Comma-separated values without spaces. Either the nine components of the three cell vectors one
+			after another or a, b, c, alpha, beta, gamma.
+		:type text: String
+		:param abc: Whether the text gives lengths and angles.
+		:type abc: Boolean
+		:param degrees: Whether angles are given in degrees.
+		:type degrees: Boolean
+		"""
+		try:
+			values = map(float, text.split(','))
+		except ValueError:
+			raise ValueError('Invalid %s entries.' % ('abc' if abc else 'H matrix'))
+		if abc:
+			if len(values) != 6:
+				raise ValueError('Not enough entries for cell lengths.')
+			return cls.from_abc(*values, degrees=degrees)
+		if len(values) != 9:
+			raise ValueError('Invalid H matrix entries.')
+		return cls(np.array(values).reshape((3, 3)).T)
+
+	def __array__(self, dtype=None):
+		if dtype is None:
+			return self._h_matrix
+		return self._h_matrix.astype(dtype)
+
+	def __iter__(self):
+		return iter(self.get_vectors())
+
+	def __repr__(self):
+		return 'Cell(%r)' % self._h_matrix.tolist()
+
+	def _cached(self, key, function):
+		if key not in self._cache:
+			self._cache[key] = function()
+		return self._cache[key]
+
+	def get_h_matrix(self):
+		"""Read-only H matrix with the cell vectors as columns."""
+		return self._h_matrix
+
+	def get_vectors(self):
+		"""Tuple of the three cell vectors."""
+		return tuple(self._h_matrix[:, i] for i in range(3))
+
+	def get_inverse(self):
+		"""Inverse of the H matrix, i.e. the reciprocal vectors without 2 pi as rows."""
+		return self._cached('inverse', lambda: np.linalg.inv(self._h_matrix))
+
+	def get_volume(self):
+		return self._cached('volume', lambda: cell_volume(self._h_matrix))
+
+	def get_abc(self, degrees=False):
+		"""Box lengths and angles. See :func:`hmatrix_to_abc`."""
+		return self._cached(('abc', degrees), lambda: hmatrix_to_abc(self._h_matrix, degrees=degrees))
+
+	def get_longest_diameter(self):
+		return self._cached('diameter', lambda: cell_longest_diameter(self._h_matrix))
+
+	def get_face_distances(self):
+		"""Distances between opposite faces."""
+		return self._cached('faces', lambda: _face_distances(self._h_matrix))
+
+	def get_reduced(self):
+		"""Cell of the same lattice with a reduced basis. See :func:`reduce_h_matrix`."""
+		def _reduce():
+			reduced, transformation = reduce_h_matrix(self._h_matrix)
+			if np.all(transformation == np.eye(3)):
+				return self
+			return Cell(reduced)
+		return self._cached('reduced', _reduce)
+
+	def wrap_vectors(self, vectors):
+		""" Minimum image of difference vectors by rounding in fractional coordinates of the reduced cell.
+
+		:param vectors: Difference vectors. Unit of length: Angstrom.
+		:type vectors: Numpy array of shape (..., 3)
+		:return: Wrapped vectors.
+		"""
+		reduced = self.get_reduced()
+		return reduced._wrap_scaled(np.dot(vectors, reduced.get_inverse().T))
+
+	def _wrap_scaled(self, scaled):
+		# rounding gives the minimum image unless a lattice vector l shortens the result, i.e. its projection on l
+		# exceeds |l|^2 / 2 in magnitude. Only those vectors are moved towards their shortest image.
+		scaled = scaled - np.round(scaled)
+		vectors = np.dot(scaled, self._h_matrix.T)
+		relevant, limits, neighbours, halves = self._cached('wrapping', self._wrapping_candidates)
+		if relevant is None:
+			return vectors
+		flat = vectors.reshape(-1, 3)
+		check = np.where((np.abs(np.dot(flat, relevant.T)) > limits).any(axis=1))[0]
+		# descend to the shortest image, each step picks the neighbour that shortens the vector most
+		while len(check) > 0:
+			gain = np.dot(flat[check], neighbours.T) + halves
+			check = check[gain.min(axis=1) < -1e-12 * halves.min()]
+			if len(check) > 0:
+				flat[check] += neighbours[np.argmin(np.dot(flat[check], neighbours.T) + halves, axis=1)]
+		return vectors
+
+	def _wrapping_candidates(self):
+		offsets = image_offsets(3, 3, 3) - 1
+		neighbours = np.dot(offsets[np.any(offsets != 0, axis=1)], self._h_matrix.T)
+		# the rounded vectors lie within the cell centered at the origin, so their projection on a lattice vector is
+		# bounded by half the sum of the absolute projections of the cell vectors
+		bound = .5 * np.abs(np.dot(neighbours, self._h_matrix)).sum(axis=1)
+		lengths = .5 * (neighbours ** 2).sum(axis=1)
+		relevant = neighbours[bound > lengths * (1 + 1e-10)]
+		# the neighbours are symmetric around the origin, the test for l covers -l
+		relevant = relevant[:len(relevant) // 2]
+		if len(relevant) == 0:
+			return None, None, None, None
+		return relevant, .5 * (relevant ** 2).sum(axis=1), neighbours, lengths
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+# third-party modules
+import numpy as np
+
+# custom modules
+import geometry as geo
+import slabs
+
+#: Edge length of the voxel bricks evaluated at once
+BRICK_VOXELS = 16
+#: Default cutoff of the reference profiles in Angstrom
+CUTOFF = 5.
+#: Decay length of the default profile of hydrogen in Angstrom, scaled by Z^(-1/3) for heavier elements
+DECAY_LENGTH = 0.5
+
+
+class ExponentialProfile(object):
+	"""Spherical reference density decaying exponentially, normalised to the given charge."""
+
+	def __init__(self, charge, decay):
+		"""Defines the profile.
+
+		:param charge: Integral of the profile.
+		:type charge: Float
+		:param decay: Decay length in Angstrom.
+		:type decay: Float
+		"""
+		self._prefactor = charge / (8 * np.pi * decay ** 3)
+		self._decay = decay
+
+	def __call__(self, r):
+		return self._prefactor * np.exp(-r / self._decay)
+
+
+class TabulatedProfile(object):
+	"""Spherical reference density interpolated linearly from tabulated values, zero beyond the last radius."""
+
+	def __init__(self, radii, values):
+		"""Defines the profile.
+
+		:param radii: Increasing radii in Angstrom.
+		:type radii: Numpy array
+		:param values: Density at the radii.
+		:type values: Numpy array
+		"""
+		self._radii = np.array(radii, dtype=np.float64)
+		self._values = np.array(values, dtype=np.float64)
+		if self._radii.shape != self._values.shape or np.any(np.diff(self._radii) <= 0):
+			raise ValueError('Need increasing radii and one value each.')
+
+	def __call__(self, r):
+		return np.interp(r, self._radii, self._values, right=0.)
+
+
+def default_profile(atomic_number):
+	""" Crude free-atom density for elements without tabulated reference.
+
+	:param atomic_number: Atomic number.
+	:type atomic_number: Integer
+	:return: :class:`ExponentialProfile`
+	"""
+	return ExponentialProfile(atomic_number, DECAY_LENGTH / atomic_number ** (1. / 3))
+
+
+def _local_atoms(centers, coordinates, cell, radius):
+	# import here to keep scipy optional for the remaining modules
+	from scipy.spatial import cKDTree
+
+	if cell is None:
+		found = cKDTree(coordinates).query_ball_point(centers, radius)
+		return [np.array(_, dtype=np.int) for _ in found]
+	return geo.PeriodicKDTree(coordinates, cell, margin=radius).query_ball_point(centers, radius)
+
+
+def _hirshfeld_slab(parts, start, grid, coordinates, numbers, profiles, cutoff, cell, bricksize):
+	origin, vectors, nvoxel = grid
+	data = parts[0]
+	result = np.zeros(len(coordinates))
+
+	# atoms within the cutoff of each brick from a neighbour search around the brick centers
+	corners = [(i, j, k) for i in range(0, data.shape[0], bricksize) for j in range(0, data.shape[1], bricksize)
+			   for k in range(0, data.shape[2], bricksize)]
+	shape = np.minimum(bricksize, data.shape)
+	centers = np.dot(np.array(corners) + (start, 0, 0) + .5 * shape, vectors) + origin
+	radius = .5 * np.dot(shape, np.linalg.norm(vectors, axis=1))
+	neighbours = _local_atoms(centers, coordinates, cell, cutoff + radius)
+
+	# two images of an atom within the search radius of a brick center are one lattice vector apart, so unless the
+	# lattice has shorter vectors than twice the search radius, the image closest to the brick center is the only one
+	# within the cutoff of its voxels
+	exact = cell is not None and 2 * (cutoff + radius) >= min(np.linalg.norm(cell.get_reduced().get_vectors(), axis=1))
+
+	for (i, j, k), center, local in zip(corners, centers, neighbours):
+		if len(local) == 0:
+			continue
+		brick = data[i:i + bricksize, j:j + bricksize, k:k + bricksize]
+		index = np.indices(brick.shape).reshape(3, -1).transpose() + (start + i, j, k)
+		positions = np.dot(index + .5, vectors) + origin - center
+
+		# voxel-atom distances for local atoms only, grouped by element
+		local = local[np.argsort(numbers[local], kind='mergesort')]
+		sites = coordinates[local] - center
+		if cell is not None:
+			sites = cell.wrap_vectors(sites)
+		if exact:
+			delta = cell.wrap_vectors(positions[:, np.newaxis, :] - sites[np.newaxis, :, :])
+			squared = (delta ** 2).sum(axis=2)
+		else:
+			# relative to the brick center, the expanded square loses no relevant precision
+			squared = (positions ** 2).sum(axis=1)[:, np.newaxis] + (sites ** 2).sum(axis=1)
+			squared -= 2 * np.dot(positions, sites.T)
+		distances = np.sqrt(np.maximum(squared, 0.))
+
+		weights = np.empty(distances.shape)
+		elements = numbers[local]
+		bounds = np.flatnonzero(np.diff(elements)) + 1
+		for first, last in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(local)]))):
+			weights[:, first:last] = profiles[elements[first]](distances[:, first:last])
+		weights[distances > cutoff] = 0.
+
+		# normalising the voxel values instead of the weights saves a pass over the weights
+		total = weights.sum(axis=1)
+		values = brick.reshape(-1).astype(np.float64)
+		values[total > 0] /= total[total > 0]
+		values[total == 0] = 0.
+		result[local] += np.dot(values, weights)
+	return result
+
+
+def hirshfeld_charges(cube, profiles=None, cutoff=CUTOFF, periodic=True, processes=1, bricksize=BRICK_VOXELS):
+	""" Integrates the voxel data per atom with smooth Hirshfeld weights.
+
+	The weight of an atom at a voxel is its spherical reference density divided by the sum of the reference densities
+	of all atoms at that voxel. The grid is processed in bricks of voxels and only the atoms within the cutoff of a brick
+	are considered. These are found with a k-d tree search, periodic via :class:`euston.geometry.PeriodicKDTree`, so the
+	cost grows linearly with the grid size for a fixed density of atoms. Voxels without any atom within the cutoff are
+	not assigned.
+
+	:param cube: Cube file with stored voxel data.
+	:type cube: :class:`euston.io.CubeFile`
+	:param profiles: Reference density for each atomic number as callable of the distance in Angstrom. Defaults to
+		:func:`default_profile` for missing elements. Need to be picklable for multiple processes.
+	:type profiles: Dictionary
+	:param cutoff: Distance in Angstrom beyond which reference densities are taken to vanish. In periodic boundary
+		conditions, only the nearest image of each atom contributes.
+	:type cutoff: Float
+	:param periodic: Whether to use minimum image distances in the cube cell.
+	:type periodic: Boolean
+	:param processes: Number of worker processes for slabs of the grid.
+	:type processes: Integer
+	:param bricksize: Edge length of voxel bricks evaluated at once.
+	:type bricksize: Integer
+	:return: Numpy array of integrated voxel values, one entry per atom. Multiplied by the voxel volume.
+	"""
+	data = cube.get_data()
+	if data is None:
+		raise ValueError('Hirshfeld partitioning requires stored voxel data.')
+	numbers = cube.get_atomic_numbers()
+	lookup = {}
+	for number in set(numbers):
+		lookup[number] = default_profile(number)
+	if profiles is not None:
+		lookup.update(profiles)
+
+	grid = (cube.get_origin(), np.array(cube._vectors), tuple(cube._nvoxel))
+	cell = geo.Cell(cube.get_h_matrix()) if periodic else None
+	args = (grid, cube.get_coordinates().astype(np.float64), numbers, lookup, cutoff, cell, bricksize)
+	result = slabs.reduce_slabs(_hirshfeld_slab, [data], processes, args)
+	return result * cube.get_voxel_volume()
@@ -3,9 +3,13 @@
 # system modules
 import abc
 import gzip
+import hashlib
 import math
 import itertools
+import numbers
+import os
 import re
+import zlib
 
 # third-party modules
 import numpy as np
@@ -18,9 +22,42 @@ except:
 	HAS_MDA = False
 
 # custom modules
+import cache as fcache
 import geometry as geo
+import slabs
 
 BOHR2ANGSTROM = 1 / 0.529177210
+#: Approximate number of bytes converted to floats in one go when reading bulk data
+VALUE_BLOCK_SIZE = 2 ** 20
+#: Floating point type for coordinates and volumetric data unless specified per object
+DEFAULT_DTYPE = np.float64
+#: Suffix of the frame index files stored next to XYZ trajectories
+FRAME_INDEX_SUFFIX = '.frames.npz'
+#: Uncompressed bytes between two decompressor checkpoints for random access into gzipped trajectories
+GZIP_CHECKPOINT_BYTES = 2 ** 24
+#: Compressed bytes read at once from gzipped trajectories
+GZIP_CHUNK_BYTES = 2 ** 16
+
+
+def set_default_dtype(dtype):
+	""" Selects the floating point type for coordinates and volumetric data of objects created afterwards.
+
+	Single precision halves memory and bandwidth requirements. Sums over stored data are accumulated in double
+	precision regardless of this setting.
+
+	:param dtype: Either numpy.float32 or numpy.float64.
+	"""
+	global DEFAULT_DTYPE
+	DEFAULT_DTYPE = _check_dtype(dtype)
+
+
+def _check_dtype(dtype):
+	if dtype is None:
+		return np.dtype(DEFAULT_DTYPE)
+	dtype = np.dtype(dtype)
+	if dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+		raise ValueError('Only float32 and float64 are supported.')
+	return dtype
 
 
 def require_parsed(f):
@@ -53,6 +90,107 @@ def write_lines(filename, lines, terminate='\n'):
 	fh.close()
 
 
+def _iter_text_blocks(fh, blocksize=VALUE_BLOCK_SIZE):
+	""" Yields the remaining content of a file handle in chunks that end on a line break.
+
+	Plain file objects do not allow to mix line iteration and block reads, so they are consumed in batches of lines.
+	All other handles (gzip, StringIO) are read in raw blocks which is considerably faster for compressed input.
+
+	:param fh: File handle or line iterator.
+	:param blocksize: Approximate size of a chunk in bytes.
+	:type blocksize: Integer
+	"""
+	if isinstance(fh, file) or not hasattr(fh, 'read'):
+		while True:
+			lines = list(itertools.islice(fh, max(1, blocksize // 64)))
+			if len(lines) == 0:
+				return
+			yield ''.join(lines)
+	else:
+		rest = ''
+		while True:
+			block = fh.read(blocksize)
+			if len(block) == 0:
+				break
+			cut = block.rfind('\n') + 1
+			if cut == 0:
+				rest += block
+				continue
+			yield rest + block[:cut]
+			rest = block[cut:]
+		if len(rest) > 0:
+			yield rest
+
+
+def _check_values(values, block):
+	# numpy stops silently at the first invalid character, which leaves the token it stopped in partially parsed. Tokens
+	# are counted on the raw bytes, which is much cheaper than splitting the block, and only looked at if values are
+	# missing. Otherwise, just the last token may have been parsed partially.
+	whitespace = np.frombuffer(block, dtype=np.uint8) <= 32
+	count = np.count_nonzero(whitespace[:-1] > whitespace[1:]) + (len(block) > 0 and not whitespace[0])
+	if count == len(values):
+		if count > 0:
+			_check_token(block.rsplit(None, 1)[-1])
+		return
+	tokens = block.split()
+	start = max(0, len(values) - 1)
+	for token in tokens[start:start + 2]:
+		_check_token(token)
+	raise ValueError('Invalid voxel data.')
+
+
+def _check_token(token):
+	try:
+		float(token)
+	except ValueError:
+		raise ValueError('Invalid voxel value %r.' % token)
+
+
+def iter_values(fh, divisor=1, blocksize=VALUE_BLOCK_SIZE):
+	""" Yields blocks of whitespace-separated floats from a file handle.
+
+	The input is consumed in chunks of about `blocksize` bytes and every chunk is converted to floats at once. Works
+	with plain and gzipped file handles as well as any other line iterator.
+
+	:param fh: File handle positioned at the first value.
+	:param divisor: Value all entries are divided by.
+	:type divisor: Float
+	:param blocksize: Approximate number of bytes converted in one go.
+	:type blocksize: Integer
+	"""
+	for block in _iter_text_blocks(fh, blocksize):
+		values = np.fromstring(block, sep=' ')
+		_check_values(values, block)
+		if divisor != 1:
+			values /= divisor
+		yield values
+
+
+def read_values(fh, out, divisor=1, blocksize=VALUE_BLOCK_SIZE):
+	""" Reads whitespace-separated floats from a file handle into a preallocated buffer.
+
+	Uses :func:`iter_values`. Since the buffer is written sequentially, it may be a memory-mapped array.
+
+	:param fh: File handle positioned at the first value.
+	:param out: Flat buffer to fill. Its length defines the number of expected values.
+	:type out: Numpy array of shape (n)
+	:param divisor: Value all entries are divided by.
+	:type divisor: Float
+	:param blocksize: Approximate number of bytes converted in one go.
+	:type blocksize: Integer
+	:return: The filled buffer.
+	"""
+	count = 0
+	for values in iter_values(fh, divisor, blocksize):
+		if count + len(values) > len(out):
+			raise IndexError('More values than expected.')
+		out[count:count + len(values)] = values
+		count += len(values)
+	if count != len(out):
+		raise ValueError('Truncated voxel data.')
+	return out
+
+
 class HoldsCoordinates(object):
 	__metaclass__ = abc.ABCMeta
 
@@ -69,6 +207,43 @@ class HoldsUnitcell(object):
 		pass
 
 
+def grid_positions(origin, vectors, nvoxel, start, stop, centered=False):
+	""" Positions of a range of grid points with the last axis running fastest.
+
+	:param origin: Position of the first grid point.
+	:type origin: Numpy array of length 3
+	:param vectors: Grid vectors as rows.
+	:type vectors: Numpy array of shape (3, 3)
+	:param nvoxel: Number of grid points along each vector.
+	:type nvoxel: Iterable of length 3
+	:param start: First flat index.
+	:type start: Integer
+	:param stop: Flat index after the last point.
+	:type stop: Integer
+	:param centered: Whether to shift all positions by half a grid vector each.
+	:type centered: Boolean
+	:return: Numpy array of shape (stop - start, 3).
+	"""
+	grid = np.array(np.unravel_index(np.arange(start, stop), tuple(nvoxel)), dtype=np.float64).transpose()
+	if centered:
+		grid += .5
+	positions = np.dot(grid, vectors)
+	positions += origin
+	return positions
+
+
+def _project_slab(parts, start, axis_index, absolute, length):
+	slab = parts[0]
+	if absolute:
+		slab = np.absolute(slab)
+	other_axes = tuple(sorted(set(range(3)) - set([axis_index])))
+	if axis_index == 0:
+		result = np.zeros(length)
+		result[start:start + len(slab)] = np.sum(slab, axis=other_axes, dtype=np.float64)
+		return result
+	return np.sum(slab, axis=other_axes, dtype=np.float64)
+
+
 def anyopen(filename):
 	rawname = filename
 	gzip = '.gz .gzip'.split()
@@ -93,11 +268,15 @@ class FileIO(object):
 	#: Whether the input has been parsed already
 	_parsed = False
 
-	def __init__(self, filename=None, filehandle=None):
+	def __init__(self, filename=None, filehandle=None, dtype=None):
 		"""Prepares reading input files.
 
 		:param filename: Optional input filename.
+		:param filehandle: Optional input file handle.
+		:param dtype: Floating point type for coordinates and volumetric data. Defaults to :data:`DEFAULT_DTYPE`.
 		"""
+		#: Floating point type for bulk data
+		self._dtype = _check_dtype(dtype)
 		if filename is not None and filehandle is not None:
 			raise ValueError('Only one argument (either filename or filehandle) is allowed.')
 		if filename is None and filehandle is None:
@@ -123,6 +302,12 @@ class FileIO(object):
 		"""Finalises file content parsing."""
 		self._parsed = True
 
+	def close(self):
+		"""Closes the input file handle, e.g. if only the header of a file in streaming mode has been of interest."""
+		if self._fh is not None:
+			self._fh.close()
+			self._fh = None
+
 
 class DCD(HoldsCoordinates, HoldsUnitcell, FileIO):
 	@require_loaded
@@ -131,7 +316,7 @@ class DCD(HoldsCoordinates, HoldsUnitcell, FileIO):
 			raise TypeError('MDAnalysis required in order to load a DCD file.')
 		reader = mda.coordinates.DCD.DCDReader(self._fh.name)
 		self._hmat = geo.abc_to_hmatrix(*reader.ts.dimensions, degrees=True)
-		self._coordinates = np.zeros((reader.ts.numatoms, 3))
+		self._coordinates = np.zeros((reader.ts.numatoms, 3), dtype=self._dtype)
 		self._coordinates[:, 0] = reader.ts._x
 		self._coordinates[:, 1] = reader.ts._y
 		self._coordinates[:, 2] = reader.ts._z
@@ -148,6 +333,9 @@ class DCD(HoldsCoordinates, HoldsUnitcell, FileIO):
 	def get_h_matrix(self):
 		return self._hmat
 
+	def get_cell(self):
+		return geo.Cell(self._hmat)
+
 
 class XYZ(HoldsCoordinates, FileIO):
 	@require_loaded
@@ -181,9 +369,9 @@ class XYZ(HoldsCoordinates, FileIO):
 		if len(lines) < num_atoms + 2:
 			raise ValueError('XYZ file contains less atoms than specified.')
 		if len(lines) > num_atoms + 2:
-			raise NotImplementedError('Only single frame XYZ files are supported.')
+			raise NotImplementedError('Only single frame XYZ files are supported. Use XYZTrajectory for multiple frames.')
 
-		self._coordinates = np.zeros((num_atoms, 3))
+		self._coordinates = np.zeros((num_atoms, 3), dtype=self._dtype)
 		self._labels = []
 		self._comment = lines[1].strip()
 		for line in lines[2:]:
@@ -207,6 +395,445 @@ class XYZ(HoldsCoordinates, FileIO):
 		return self._labels
 
 
+def _read_xyz_frame(fh, dtype, out=None, skip=False, complete=False):
+	""" Reads the next frame of an XYZ file.
+
+	:param fh: File handle positioned at the start of a frame.
+	:param dtype: Floating point type of the coordinates.
+	:param out: Array to write the coordinates to, if of matching shape.
+	:param skip: Whether to only advance the file handle past the frame.
+	:param complete: Whether to treat frames as not yet written unless all their lines are present and end with a line
+		break, e.g. for files that are still being written. Such frames are reported as the end of the file.
+	:return: Tuple of labels, coordinates and comment. None at the end of the file. Labels and coordinates are None
+		when skipping.
+	"""
+	line = fh.readline()
+	while line != '' and line.strip() == '':
+		line = fh.readline()
+	if line == '' or (complete and line[-1] != '\n'):
+		return None
+	try:
+		num_atoms = int(line.strip())
+	except ValueError:
+		raise ValueError('Invalid atom count specified.')
+	comment = fh.readline()
+	if complete and comment[-1:] != '\n':
+		return None
+	if comment == '':
+		raise ValueError('XYZ file contains less atoms than specified.')
+
+	if skip:
+		for i in range(num_atoms):
+			last = fh.readline()
+			if complete and last[-1:] != '\n':
+				return None
+			if last == '':
+				raise ValueError('XYZ file contains less atoms than specified.')
+		return None, None, comment.strip()
+
+	lines = [fh.readline() for i in range(num_atoms)]
+	if complete and num_atoms > 0 and lines[-1][-1:] != '\n':
+		return None
+	if num_atoms > 0 and lines[-1] == '':
+		raise ValueError('XYZ file contains less atoms than specified.')
+	tokens = ''.join(lines).split()
+	if len(tokens) != 4 * num_atoms:
+		for line in lines:
+			if len(line.split()) != 4:
+				raise ValueError('Invalid atom line: %s' % line.strip())
+	table = np.array(tokens).reshape(num_atoms, 4)
+	if out is None or out.shape != (num_atoms, 3):
+		out = np.empty((num_atoms, 3), dtype=dtype)
+	try:
+		out[...] = table[:, 1:].astype(dtype)
+	except ValueError:
+		raise ValueError('Invalid coordinates in frame: %s' % comment.strip())
+	return table[:, 0].tolist(), out, comment.strip()
+
+
+def _is_gzip_name(filename):
+	return filename[-3:] == '.gz' or filename[-5:] == '.gzip'
+
+
+class _GzipReader(object):
+	""" Line reader for gzipped files which can be resumed from a saved decompressor state.
+
+	The decompressor state is copied every few megabytes of uncompressed data, so that reading can later start from the
+	last checkpoint before a given position instead of from the beginning of the file. Multi-member files are supported.
+	"""
+
+	def __init__(self, raw, decompressor=None, position=0, checkpoints=None, spacing=None):
+		"""Starts reading.
+
+		:param raw: File handle of the compressed data, positioned where the decompressor state belongs.
+		:param decompressor: Decompressor state. Defaults to the start of a gzip member.
+		:param position: Uncompressed position that corresponds to the decompressor state.
+		:type position: Integer
+		:param checkpoints: List to append tuples of uncompressed position, compressed position and decompressor state to.
+		:type checkpoints: List
+		:param spacing: Uncompressed bytes between checkpoints. Defaults to :data:`GZIP_CHECKPOINT_BYTES`.
+		:type spacing: Integer
+		"""
+		if decompressor is None:
+			decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		self._raw = raw
+		self._decompressor = decompressor
+		self._buffer = ''
+		self._offset = 0
+		self._position = position
+		self._checkpoints = checkpoints
+		self._spacing = GZIP_CHECKPOINT_BYTES if spacing is None else spacing
+
+	def _fill(self):
+		chunk = self._raw.read(GZIP_CHUNK_BYTES)
+		if chunk == '':
+			return False
+		data = self._decompressor.decompress(chunk)
+		while self._decompressor.unused_data != '':
+			rest = self._decompressor.unused_data
+			self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+			data += self._decompressor.decompress(rest)
+
+		self._position += self._offset
+		self._buffer = self._buffer[self._offset:] + data
+		self._offset = 0
+
+		if self._checkpoints is not None:
+			end = self._position + len(self._buffer)
+			if end - self._checkpoints[-1][0] >= self._spacing:
+				self._checkpoints.append((end, self._raw.tell(), self._decompressor.copy()))
+		return True
+
+	def tell(self):
+		return self._position + self._offset
+
+	def readline(self):
+		while True:
+			end = self._buffer.find('\n', self._offset)
+			if end >= 0:
+				line = self._buffer[self._offset:end + 1]
+				self._offset = end + 1
+				return line
+			if not self._fill():
+				line = self._buffer[self._offset:]
+				self._offset = len(self._buffer)
+				return line
+
+	def skip(self, count):
+		"""Advances by count uncompressed bytes or to the end of the file."""
+		while self._offset + count > len(self._buffer):
+			count -= len(self._buffer) - self._offset
+			self._offset = len(self._buffer)
+			if not self._fill():
+				return
+		self._offset += count
+
+
+class FrameIndex(object):
+	""" Byte offsets of the frames of an XYZ trajectory, persisted next to the file.
+
+	The index is valid as long as size and modification time of the trajectory match the stored values. Plain files that
+	grew in the meantime, e.g. during a running simulation, are only scanned from the end of the last complete frame on,
+	provided their first and last indexed frame are unchanged. A frame counts as complete once all its lines are present
+	and end with a line break, so the last frame of a file without final line break is not indexed.
+
+	For gzipped files, offsets refer to the uncompressed data and seeking resumes decompression from the closest
+	checkpoint before the frame. The checkpoints are kept in memory only. After loading the index, they are recreated
+	while decompressing up to the frames that are accessed, so the first access to a late frame still reads the file up
+	to that frame once.
+	"""
+
+	def __init__(self, filename, persistent=True, spacing=None):
+		"""Loads the index if present. Call :meth:`update` to bring it up to date with the trajectory.
+
+		:param filename: Trajectory file name.
+		:type filename: String
+		:param persistent: Whether to read and write the index file :data:`FRAME_INDEX_SUFFIX` next to the trajectory.
+		:type persistent: Boolean
+		:param spacing: Uncompressed bytes between checkpoints of gzipped files. Defaults to :data:`GZIP_CHECKPOINT_BYTES`.
+		:type spacing: Integer
+		"""
+		self._filename = filename
+		self._indexname = filename + FRAME_INDEX_SUFFIX if persistent else None
+		self._gzip = _is_gzip_name(filename)
+		self._spacing = GZIP_CHECKPOINT_BYTES if spacing is None else spacing
+		self._checkpoints = None
+		self._positions = None
+		self._raw = None
+		self._reader = None
+		self._reset()
+		if self._indexname is not None and os.path.exists(self._indexname):
+			self._load()
+
+	def _reset(self):
+		self._offsets = np.zeros(0, dtype=np.int64)
+		self._end = 0
+		self._size = None
+		self._mtime = None
+		self._digest = ''
+
+	def _load(self):
+		try:
+			with np.load(self._indexname) as data:
+				offsets = data['offsets'].astype(np.int64)
+				end, size, mtime = int(data['end']), int(data['size']), float(data['mtime'])
+				digest = str(data['digest'])
+		except (IOError, ValueError, KeyError):
+			return
+		self._offsets, self._end, self._size, self._mtime, self._digest = offsets, end, size, mtime, digest
+
+	def save(self):
+		"""Writes the index file atomically."""
+		if self._indexname is None:
+			raise ValueError('Index is not persistent.')
+		# worker processes may update the same index concurrently
+		tmpname = '%s.%d.tmp' % (self._indexname, os.getpid())
+		with open(tmpname, 'wb') as fh:
+			np.savez(
+				fh, offsets=self._offsets, end=self._end, size=self._size, mtime=self._mtime, digest=self._digest)
+		os.rename(tmpname, self._indexname)
+
+	def update(self):
+		""" Brings the index up to date with the trajectory.
+
+		Unchanged files are not read at all. Plain files that grew are scanned from the end of the last indexed frame if
+		their first and last indexed frame still match, all other changes cause a full scan. The index file is rewritten
+		if it changed and the directory is writable.
+
+		:return: Boolean, whether the trajectory had to be scanned.
+		"""
+		stat = os.stat(self._filename)
+		if stat.st_size == self._size and stat.st_mtime == self._mtime:
+			return False
+		if self._size is None or self._gzip or stat.st_size <= self._size or self._get_digest() != self._digest:
+			self._reset()
+		self._scan()
+		if not self._gzip:
+			self._digest = self._get_digest()
+		self._size, self._mtime = stat.st_size, stat.st_mtime
+		if self._indexname is not None:
+			try:
+				self.save()
+			except (IOError, OSError):
+				pass
+		return True
+
+	def _get_digest(self):
+		# fingerprint of the first and last indexed frame of a plain file to detect rewritten files
+		if len(self._offsets) == 0:
+			return ''
+		ends = np.append(self._offsets[1:], self._end)
+		digest = hashlib.sha1()
+		with open(self._filename, 'rb') as fh:
+			for start, end in sorted(set(((self._offsets[0], ends[0]), (self._offsets[-1], ends[-1])))):
+				fh.seek(int(start))
+				digest.update(fh.read(int(end - start)))
+		return digest.hexdigest()
+
+	def _open_gzip(self):
+		self._close_gzip()
+		self._raw = open(self._filename, 'rb')
+		self._checkpoints = [(0, 0, zlib.decompressobj(16 + zlib.MAX_WBITS))]
+		self._positions = None
+		return _GzipReader(self._raw, checkpoints=self._checkpoints, spacing=self._spacing)
+
+	def _close_gzip(self):
+		if self._raw is not None:
+			self._raw.close()
+		self._raw = None
+		self._reader = None
+
+	def _scan(self):
+		if self._gzip:
+			fh = self._open_gzip()
+		else:
+			fh = open(self._filename, 'rb')
+			fh.seek(self._end)
+
+		offsets = []
+		try:
+			while True:
+				position = fh.tell()
+				frame = _read_xyz_frame(fh, np.float64, skip=True, complete=True)
+				if frame is None:
+					break
+				offsets.append(position)
+				self._end = fh.tell()
+		finally:
+			if self._gzip:
+				self._close_gzip()
+			else:
+				fh.close()
+		self._offsets = np.concatenate((self._offsets, np.array(offsets, dtype=np.int64)))
+
+	def get_offsets(self):
+		"""Byte offsets of the frames in the uncompressed data as numpy array."""
+		return self._offsets
+
+	def __len__(self):
+		return len(self._offsets)
+
+	def seek(self, fh, frame):
+		""" Positions a reader at the start of a frame.
+
+		:param fh: Open file handle of a plain trajectory. Ignored for gzipped files.
+		:param frame: Frame index.
+		:type frame: Integer
+		:return: File handle or reader with a readline method, positioned at the frame.
+		"""
+		offset = self._offsets[frame]
+		if not self._gzip:
+			fh.seek(offset)
+			return fh
+
+		if self._checkpoints is None:
+			# e.g. after loading the index from disk: readers add checkpoints as they get past the last one
+			self._checkpoints = [(0, 0, zlib.decompressobj(16 + zlib.MAX_WBITS))]
+		if self._positions is None or len(self._positions) != len(self._checkpoints):
+			self._positions = np.array([_[0] for _ in self._checkpoints], dtype=np.int64)
+		position, raw_position, decompressor = self._checkpoints[np.searchsorted(self._positions, offset, 'right') - 1]
+
+		# continue reading forward unless a checkpoint is closer
+		reader = self._reader
+		if reader is None or not position <= reader.tell() <= offset:
+			if self._raw is None:
+				self._raw = open(self._filename, 'rb')
+			self._raw.seek(raw_position)
+			reader = _GzipReader(self._raw, decompressor.copy(), position, self._checkpoints, self._spacing)
+			self._reader = reader
+		reader.skip(offset - reader.tell())
+		return reader
+
+	def close(self):
+		"""Closes the file handle used for gzipped trajectories."""
+		self._close_gzip()
+
+
+class XYZTrajectory(FileIO):
+	""" Multi-frame XYZ file, e.g. a CP2K ``-pos-1.xyz`` trajectory, read frame by frame.
+
+	Only one frame is held in memory at a time, so the memory requirements do not depend on the length of the
+	trajectory. Works for gzipped files as well. As for the :class:`FrameIndex`, a last frame whose final line has no line
+	break yet is taken as being written and not read, so a half-flushed coordinate is never parsed.
+
+	With a :class:`FrameIndex`, frames are accessed directly by position, e.g. ``trajectory[90000]`` or
+	``trajectory[::100]``, without reading the frames in between.
+	"""
+
+	def __init__(self, filename=None, filehandle=None, dtype=None, index=False):
+		"""Prepares reading the trajectory.
+
+		:param filename: Optional input filename.
+		:param filehandle: Optional input file handle.
+		:param dtype: Floating point type for coordinates. Defaults to :data:`DEFAULT_DTYPE`.
+		:param index: Whether to use the frame index stored next to the file, creating or extending it as required.
+			Alternatively, a frame index of the file. Requires a file name.
+		:type index: Boolean or :class:`FrameIndex`
+		"""
+		if (isinstance(index, FrameIndex) or index) and filename is None:
+			raise ValueError('A frame index requires a file name.')
+		if isinstance(index, FrameIndex):
+			self._index = index
+		else:
+			self._index = FrameIndex(filename) if index else None
+		super(XYZTrajectory, self).__init__(filename, filehandle, dtype)
+
+	@require_loaded
+	def _parse(self):
+		self._frames = None
+		if self._index is not None:
+			self._index.update()
+		super(XYZTrajectory, self)._parse()
+
+	@require_parsed
+	def refresh(self):
+		""" Picks up frames appended to the file since opening it, e.g. by a running simulation.
+
+		:return: Number of frames.
+		"""
+		if self._index is not None:
+			self._index.update()
+		else:
+			self._frames = None
+		return self.count_frames()
+
+	@require_parsed
+	def iter_frames(self, start=0, stop=None, step=1, reuse=False):
+		""" Reads the frames in order. Frames that are not selected are skipped without parsing the coordinates. With
+		a frame index, they are not read at all.
+
+		:param start: Index of the first frame.
+		:type start: Integer
+		:param stop: Index of the frame to stop before. Reads to the end of the file if not given.
+		:type stop: Integer
+		:param step: Stride between frames.
+		:type step: Integer
+		:param reuse: Whether to return the same coordinate array for every frame. It is overwritten by the next frame,
+			so callers have to copy coordinates they want to keep.
+		:type reuse: Boolean
+		:return: Generator of tuples of labels, coordinates and comment line.
+		"""
+		if start < 0 or step < 1 or (stop is not None and stop < 0):
+			raise ValueError('Only non-negative frame ranges with positive step are supported.')
+		buffer = None
+		if self._index is not None:
+			for index in xrange(*slice(start, stop, step).indices(len(self._index))):
+				frame = _read_xyz_frame(self._index.seek(self._fh, index), self._dtype, out=buffer)
+				if reuse:
+					buffer = frame[1]
+				yield frame
+			return
+
+		self._fh.seek(0)
+		index = 0
+		while stop is None or index < stop:
+			selected = index >= start and (index - start) % step == 0
+			frame = _read_xyz_frame(self._fh, self._dtype, out=buffer, skip=not selected, complete=True)
+			if frame is None:
+				break
+			if selected:
+				if reuse:
+					buffer = frame[1]
+				yield frame
+			index += 1
+
+	@require_parsed
+	def count_frames(self):
+		"""Number of frames. Scans the file once unless there is a frame index."""
+		if self._index is not None:
+			return len(self._index)
+		if self._frames is None:
+			self._fh.seek(0)
+			count = 0
+			while _read_xyz_frame(self._fh, self._dtype, skip=True, complete=True) is not None:
+				count += 1
+			self._frames = count
+		return self._frames
+
+	def __len__(self):
+		return self.count_frames()
+
+	def __getitem__(self, key):
+		""" Reads frames by position.
+
+		:param key: Frame index, negative values count from the end, or slice of frames.
+		:return: Tuple of labels, coordinates and comment line. List of such tuples for slices.
+		"""
+		if isinstance(key, slice):
+			return list(self.iter_frames(*key.indices(len(self))))
+		count = len(self)
+		if key < 0:
+			key += count
+		if key < 0 or key >= count:
+			raise IndexError('Frame index out of range.')
+		return next(self.iter_frames(key, key + 1))
+
+	def close(self):
+		if self._index is not None:
+			self._index.close()
+		super(XYZTrajectory, self).close()
+
+
 class Cp2kLog(FileIO):
 	def get_values_matching(self, regex, count=None, line_numbers=False, transform=(lambda x: x, )):
 		result = []
@@ -281,6 +908,47 @@ class Cp2kLog(FileIO):
 		super(Cp2kLog, self)._parse()
 
 
+class Cp2kCell(FileIO):
+	"""Cell vectors of every MD step as written by CP2K to the ``.cell`` file."""
+
+	@require_parsed
+	def count_frames(self):
+		return len(self._steps)
+
+	@require_parsed
+	def get_steps(self):
+		return self._steps
+
+	@require_parsed
+	def get_h_matrices(self):
+		"""Numpy array of shape (frames, 3, 3), one H matrix with the cell vectors as columns per step."""
+		return self._hmats
+
+	@require_parsed
+	def get_volumes(self):
+		return geo.cell_volume(self._hmats)
+
+	@require_loaded
+	def _parse(self):
+		rows = []
+		for line in self._fh:
+			line = line.strip()
+			if line == '' or line.startswith('#'):
+				continue
+			parts = line.split()
+			if len(parts) < 11:
+				raise ValueError('Invalid cell line: %s' % line)
+			try:
+				rows.append(map(float, parts[:11]))
+			except ValueError:
+				raise ValueError('Invalid cell line: %s' % line)
+		rows = np.array(rows).reshape(-1, 11)
+		self._steps = rows[:, 0].astype(np.int)
+		# stored as A, B, C one after another
+		self._hmats = np.swapaxes(rows[:, 2:11].reshape(-1, 3, 3), 1, 2)
+		super(Cp2kCell, self)._parse()
+
+
 class Cp2kInput(FileIO):
 	def set_lines(self, lines):
 		self._lines = lines
@@ -418,6 +1086,21 @@ class Cp2kInput(FileIO):
 
 	@require_loaded
 	def get_cell_vectors(self):
+		"""Cell vectors of the input file.
+
+		:return: Tuple of the three cell vectors or None if there is no cell information.
+		"""
+		cell = self.get_cell()
+		if cell is None:
+			return None
+		return tuple(cell)
+
+	@require_loaded
+	def get_cell(self):
+		"""Cell of the input file.
+
+		:return: :class:`euston.geometry.Cell` or None if there is no cell information.
+		"""
 		a, b, c = (None, None, None)
 		alpha, beta, gamma = (None, None, None)
 
@@ -431,10 +1114,7 @@ class Cp2kInput(FileIO):
 			alpha, beta, gamma = np.radians(np.array(retval2))
 
 			# convert to vectors
-			hmat = geo.abc_to_hmatrix(a, b, c, alpha, beta, gamma, degrees=False)
-			a = hmat[:, 0]
-			b = hmat[:, 1]
-			c = hmat[:, 2]
+			return geo.Cell.from_abc(a, b, c, alpha, beta, gamma, degrees=False)
 
 		# check whether A, B, C is set
 		if a is None:
@@ -450,10 +1130,92 @@ class Cp2kInput(FileIO):
 			print 'No supported cell information found.'
 			return None
 
-		return (a, b, c)
+		return geo.Cell.from_vectors(a, b, c)
 
 
 class CubeFile(HoldsUnitcell, FileIO):
+	def __init__(self, filename=None, filehandle=None, cache=None, lazy=False, stream=False, region=None, stride=None,
+				 dtype=None):
+		"""Reads a cube file.
+
+		In lazy mode, header and atoms are read as usual, but the voxel data is converted once into a binary file in
+		the cache and exposed as read-only memory-mapped array. Only the parts of the grid that are accessed are read
+		from disk, so grids larger than the main memory can be handled.
+
+		In streaming mode, the voxel data is not stored at all. It can be consumed once with :meth:`iter_voxels` or
+		:meth:`get_projection` while it is read from the input file.
+
+		:param filename: Optional input filename.
+		:param filehandle: Optional input file handle.
+		:param cache: Binary cache for parsed data of input files given by name. True selects the default cache.
+		:type cache: Boolean or :class:`euston.cache.FileCache`
+		:param lazy: Whether to memory-map the voxel data. Requires a filename and uses the default cache if none is
+			given.
+		:type lazy: Boolean
+		:param stream: Whether to read the voxel data only on demand.
+		:type stream: Boolean
+		:param region: Voxel index range (start, stop) to keep for each axis. None keeps the full axis.
+		:type region: List of three tuples or None
+		:param stride: Keep only every n-th voxel along each axis. A single integer applies to all axes. Has to divide
+			the number of voxels of axes without region, so that the cell of the sub-grid is the periodic cell.
+		:type stride: Integer or list of three integers
+		:param dtype: Floating point type for voxel data and coordinates. Defaults to :data:`DEFAULT_DTYPE`.
+		"""
+		if stream and (cache or lazy):
+			raise ValueError('Streaming mode cannot be combined with caching.')
+		if (region is not None or stride is not None) and (cache or lazy or stream):
+			raise ValueError('Partial loading cannot be combined with caching or streaming.')
+		if lazy:
+			if filename is None:
+				raise ValueError('Lazy loading requires a filename.')
+			if not cache:
+				cache = True
+		if cache is True:
+			cache = fcache.FileCache()
+		self._cache = cache if filename is not None else None
+		self._filename = filename
+		self._lazy = lazy
+		self._stream = stream
+		self._region = region
+		self._stride = stride
+		self._dtype = _check_dtype(dtype)
+
+		if self._cache:
+			entry = self._cache.load(filename, mmap_mode='r' if lazy else None)
+			if entry is not None and entry[1].dtype == self._dtype:
+				self._fh = None
+				self._set_state(*entry)
+				self._loaded = True
+				self._parsed = True
+				return
+
+		super(CubeFile, self).__init__(filename=filename, filehandle=filehandle, dtype=dtype)
+
+		if self._cache:
+			if lazy:
+				self._data.flush()
+				self._data = None
+				self._cache.store(filename, self._get_state())
+				self._set_state(*self._cache.load(filename, mmap_mode='r'))
+			else:
+				self._cache.store(filename, self._get_state(), self._data)
+
+	def _get_state(self):
+		return {'header': np.array(self._header), 'origin': self._origin, 'natoms': self._natoms,
+				'vectors': self._vectors, 'nvoxel': self._originalnvoxel,
+				'atomic_numbers': np.array(self._atomic_numbers), 'coordinates': self._coordinates}
+
+	def _set_state(self, meta, data):
+		self._header = [str(_) for _ in meta['header']]
+		self._origin = meta['origin']
+		self._natoms = int(meta['natoms'])
+		self._vectors = meta['vectors']
+		self._originalnvoxel = meta['nvoxel']
+		self._nvoxel = np.abs(self._originalnvoxel)
+		self._atomic_numbers = meta['atomic_numbers']
+		self._coordinates = meta['coordinates']
+		self._data = data
+
 	def count_atoms(self):
 		return self._natoms
 
@@ -469,16 +1231,39 @@ class CubeFile(HoldsUnitcell, FileIO):
 
 		return h
 
+	@require_loaded
+	@require_parsed
+	def get_cell(self):
+		"""Cell spanned by the voxel grid.
+
+		:return: :class:`euston.geometry.Cell`
+		"""
+		return geo.Cell(self.get_h_matrix())
+
 	@require_loaded
 	@require_parsed
 	def get_val(self, x, y, z):
 		return self._data[x, y, z]
 
+	@require_loaded
+	@require_parsed
+	def get_data(self):
+		"""Voxel data without copying. Read-only memory-mapped array in lazy mode.
+
+		:return: Numpy array of shape (xlen, ylen, zlen)
+		"""
+		return self._data
+
 	@require_loaded
 	@require_parsed
 	def get_coordinates(self):
 		return np.copy(self._coordinates)
 
+	@require_loaded
+	@require_parsed
+	def get_atomic_numbers(self):
+		return np.array(self._atomic_numbers, dtype=np.int)
+
 	@require_loaded
 	@require_parsed
 	def set_coordinates(self, coord):
@@ -491,7 +1276,7 @@ class CubeFile(HoldsUnitcell, FileIO):
 		if this_shape != self._coordinates.shape:
 			raise ValueError('Changing coordinate shape not implemented.')
 
-		self._coordinates = np.copy(coord)
+		self._coordinates = np.array(coord, dtype=self._dtype)
 
 	@require_loaded
 	@require_parsed
@@ -510,12 +1295,47 @@ class CubeFile(HoldsUnitcell, FileIO):
 
 	@require_loaded
 	@require_parsed
-	def get_voxel_pos(self, x, y, z, centered=False):
+	def get_origin(self):
+		"""Position of the first voxel corner in Angstrom."""
+		origin = np.array(self._origin, dtype=np.float)
+		for idx, val in enumerate(self._originalnvoxel):
+			if val > 0:
+				origin[idx] /= BOHR2ANGSTROM
+		return origin
+
+	@require_loaded
+	@require_parsed
+	def get_voxel_pos(self, x, y, z, centered=False, origin=False):
+		"""Position of a voxel relative to the first voxel.
+
+		:param centered: Whether to give the voxel center instead of the first corner.
+		:type centered: Boolean
+		:param origin: Whether to add the origin of the grid like :meth:`get_voxel_positions` does.
+		:type origin: Boolean
+		"""
 		if centered:
 			x += .5
 			y += .5
 			z += .5
-		return x * self._vectors[0, :] + y * self._vectors[1, :] + z * self._vectors[2, :]
+		pos = x * self._vectors[0, :] + y * self._vectors[1, :] + z * self._vectors[2, :]
+		if origin:
+			pos = pos + self.get_origin()
+		return pos
+
+	@require_loaded
+	@require_parsed
+	def get_voxel_positions(self, start, stop, centered=False):
+		"""Positions of a range of voxels in the order of :meth:`iter_voxels`.
+
+		:param start: First flat voxel index.
+		:type start: Integer
+		:param stop: Flat voxel index after the last voxel.
+		:type stop: Integer
+		:param centered: Whether to give voxel centers instead of the first corners.
+		:type centered: Boolean
+		:return: Numpy array of shape (stop - start, 3) in Angstrom.
+		"""
+		return grid_positions(self.get_origin(), self._vectors, self._nvoxel, start, stop, centered)
 
 	@require_loaded
 	@require_parsed
@@ -524,13 +1344,89 @@ class CubeFile(HoldsUnitcell, FileIO):
 
 	@require_loaded
 	@require_parsed
-	def get_projection(self, axis_index, absolute):
-		other_axes = set(range(3)) - set([axis_index])
-		if absolute:
-			t = np.sum(np.absolute(self._data), axis=max(other_axes))
-		else:
-			t = np.sum(self._data, axis=max(other_axes))
-		return np.sum(t, axis=min(other_axes))
+	def iter_voxels(self, blocksize=VALUE_BLOCK_SIZE):
+		"""Yields consecutive blocks of the flattened voxel data with the last axis running fastest.
+
+		In streaming mode, the blocks are converted while reading the input file, so this is possible only once. The input
+		file is closed afterwards.
+
+		:param blocksize: Approximate block size in bytes.
+		:type blocksize: Integer
+		"""
+		if self._data is not None:
+			flat = self._data.reshape(-1)
+			step = max(1, blocksize // flat.itemsize)
+			for start in range(0, len(flat), step):
+				yield flat[start:start + step]
+			return
+
+		if self._fh is None:
+			raise AssertionError('Voxel data has been consumed already.')
+		fh, self._fh = self._fh, None
+		count = 0
+		try:
+			for values in iter_values(fh, self._divisor, blocksize):
+				count += len(values)
+				if count > self.count_voxels():
+					raise IndexError('More values than expected.')
+				yield values
+			if count != self.count_voxels():
+				raise ValueError('Truncated voxel data.')
+		finally:
+			# also reached if the consumer stops early and the generator is closed
+			fh.close()
+
+	def _get_flat_axis_index(self, start, stop, axis_index):
+		"""Index along one axis for a range of flat voxel indices."""
+		index = np.arange(start, stop)
+		if axis_index == 0:
+			return index // (self._nvoxel[1] * self._nvoxel[2])
+		if axis_index == 1:
+			return (index // self._nvoxel[2]) % self._nvoxel[1]
+		return index % self._nvoxel[2]
+
+	@require_loaded
+	@require_parsed
+	def get_projection(self, axis_index, absolute, processes=1):
+		"""Sums the voxel data over the planes spanned by the two other axes.
+
+		:param axis_index: Axis to project on. 0 = first, 2 = last.
+		:type axis_index: Integer
+		:param absolute: Whether to sum absolute values.
+		:type absolute: Boolean
+		:param processes: Number of worker processes for slabs of stored voxel data.
+		:type processes: Integer
+		:return: Numpy array of one sum per slice.
+		"""
+		if processes > 1 and self._data is not None:
+			return slabs.reduce_slabs(_project_slab, [self._data], processes,
+									  (axis_index, absolute, self._nvoxel[0]))
+
+		if self._data is None:
+			# single pass over the input, accumulating each block onto its slices
+			result = np.zeros(self._nvoxel[axis_index])
+			offset = 0
+			for block in self.iter_voxels():
+				if absolute:
+					block = np.absolute(block)
+				index = self._get_flat_axis_index(offset, offset + len(block), axis_index)
+				result += np.bincount(index, weights=block, minlength=len(result))
+				offset += len(block)
+			return result
+
+		# work on slabs of the first axis to keep temporary arrays small for memory-mapped data
+		other_axes = tuple(sorted(set(range(3)) - set([axis_index])))
+		result = np.zeros(self._nvoxel[axis_index])
+		step = max(1, VALUE_BLOCK_SIZE // (self._nvoxel[1] * self._nvoxel[2]))
+		for start in range(0, self._nvoxel[0], step):
+			slab = self._data[start:start + step]
+			if absolute:
+				slab = np.absolute(slab)
+			if axis_index == 0:
+				result[start:start + step] = np.sum(slab, axis=other_axes, dtype=np.float64)
+			else:
+				result += np.sum(slab, axis=other_axes, dtype=np.float64)
+		return result
 
 	@require_loaded
 	def _parse(self):
@@ -592,33 +1488,84 @@ class CubeFile(HoldsUnitcell, FileIO):
 		for idx, val in enumerate(self._nvoxel):
 			if val > 0:
 				self._coordinates[:, idx] /= BOHR2ANGSTROM
+		self._coordinates = self._coordinates.astype(self._dtype)
 
-		# voxel
-		self._data = np.zeros(self.count_voxels())
-		count = 0
-		try:
-			for line in self._fh:  # lines[(6 + self._natoms):]:
-				for number in map(float, line.split()):
-					self._data[count] = number
-					count += 1
-		except:
-			raise
-		if count != len(self._data):
-			raise ValueError('Truncated voxel data.')
-
-		# rescaling values in case the axes have been rescaled
-		self._data /= BOHR2ANGSTROM ** (np.sum(self._nvoxel > 0))
+		# voxel, rescaling values in case the axes have been rescaled
 		self._originalnvoxel = np.copy(self._nvoxel)
 		self._nvoxel = np.abs(self._nvoxel)
-		self._data = np.reshape(self._data, tuple(self._nvoxel))
+		self._divisor = BOHR2ANGSTROM ** (np.sum(self._originalnvoxel > 0))
+		if self._region is not None or self._stride is not None:
+			self._read_region()
+			super(CubeFile, self)._parse()
+			return
+		if self._stream:
+			super(CubeFile, self)._parse()
+			return
+		if self._lazy:
+			self._data = self._cache.allocate(self._filename, tuple(self._nvoxel), self._dtype)
+		else:
+			# in shared memory, so worker processes of slab operations do not need a copy
+			self._data = slabs.zeros(tuple(self._nvoxel), dtype=self._dtype)
+		read_values(self._fh, self._data.reshape(-1), divisor=self._divisor)
 
 		# finalise parsing
 		super(CubeFile, self)._parse()
 
-	@require_loaded
-	@require_parsed
-	def to_string(self):
-		lines = self._header
+	def _read_region(self):
+		"""Reads a sub-grid of the voxel data and adjusts origin and voxel vectors accordingly."""
+		region = self._region
+		if region is None:
+			region = [None] * 3
+		stride = self._stride
+		if stride is None:
+			stride = 1
+		if isinstance(stride, numbers.Integral):
+			stride = [stride] * 3
+		if len(region) != 3 or len(stride) != 3:
+			raise ValueError('Region and stride need one entry per axis.')
+
+		starts, steps, counts = np.zeros(3, dtype=np.int), np.array(stride, dtype=np.int), np.zeros(3, dtype=np.int)
+		for axis in range(3):
+			start, stop = (0, self._nvoxel[axis]) if region[axis] is None else region[axis]
+			if not 0 <= start < stop <= self._nvoxel[axis] or steps[axis] < 1:
+				raise ValueError('Invalid region or stride for axis %d.' % axis)
+			if region[axis] is None and self._nvoxel[axis] % steps[axis] != 0:
+				raise ValueError('Stride for axis %d does not divide the periodic cell.' % axis)
+			starts[axis] = start
+			counts[axis] = len(range(start, stop, steps[axis]))
+		lasts = starts + (counts - 1) * steps
+		stop = np.ravel_multi_index(lasts, self._nvoxel) + 1
+
+		# keep only matching voxels of each block, stop reading after the last one needed
+		self._data = np.zeros(counts, dtype=self._dtype)
+		offset = 0
+		for values in iter_values(self._fh, self._divisor):
+			index = np.unravel_index(np.arange(offset, offset + len(values)), self._nvoxel)
+			mask = np.ones(len(values), dtype=np.bool)
+			for axis in range(3):
+				mask &= (index[axis] >= starts[axis]) & (index[axis] <= lasts[axis])
+				mask &= (index[axis] - starts[axis]) % steps[axis] == 0
+			target = tuple((index[axis][mask] - starts[axis]) // steps[axis] for axis in range(3))
+			self._data[target] = values[mask]
+			offset += len(values)
+			if offset >= stop:
+				break
+		if offset < stop:
+			raise ValueError('Truncated voxel data.')
+
+		# sub-grid geometry in the units of the input file
+		scale = np.where(self._originalnvoxel > 0, BOHR2ANGSTROM, 1.)
+		self._origin = self._origin + np.dot(starts, self._vectors * scale[:, np.newaxis])
+		self._vectors = self._vectors * steps[:, np.newaxis]
+		self._originalnvoxel = np.sign(self._originalnvoxel) * counts
+		self._nvoxel = counts
+
+	def _iter_text(self, voxels=None):
+		"""Yields the cube file contents in chunks of text that end with a line break.
+
+		:param voxels: Optional iterable of flat voxel data blocks to use instead of the stored grid.
+		"""
+		lines = list(self._header)
 		lines.append('%d %e %e %e' % (self._natoms, self._origin[0], self._origin[1], self._origin[2]))
 		scale = np.ones(3)
 		for i in range(3):
@@ -630,15 +1577,53 @@ class CubeFile(HoldsUnitcell, FileIO):
 		for i in range(len(self._atomic_numbers)):
 			coord = scale * self._coordinates[i]
 			lines.append('%d 0 %f %f %f' % (self._atomic_numbers[i], coord[0], coord[1], coord[2]))
+		yield ''.join('%s\n' % line for line in lines)
+
+		# voxel data in blocks of full lines of five values each
 		scale = np.prod(scale)
-		segment = []
-		for x in range(self._nvoxel[0]):
-			for y in range(self._nvoxel[1]):
-				for z in range(self._nvoxel[2]):
-					segment.append(self._data[x, y, z] * scale)
-					if len(segment) == 5:
-						lines.append('%e %e %e %e %e' % (segment[0], segment[1], segment[2], segment[3], segment[4]))
-						segment = []
-		lines.append(' '.join(map(lambda _: '%e' % _, segment)))
+		if voxels is None:
+			voxels = self.iter_voxels(blocksize=VALUE_BLOCK_SIZE // 2)
+		rest = np.zeros(0)
+		for block in voxels:
+			block = np.concatenate((rest, block * scale))
+			full = len(block) - len(block) % 5
+			rest = block[full:]
+			yield ('%e %e %e %e %e\n' * (full // 5)) % tuple(block[:full])
+		yield ' '.join('%e' % _ for _ in rest) + '\n'
 
-		return lines
+	@require_loaded
+	@require_parsed
+	def write(self, target, compress=None, voxels=None):
+		"""Writes the cube file incrementally.
+
+		:param target: File name or writable file handle.
+		:type target: String or file
+		:param compress: Whether to write gzipped output. Defaults to compression for file names ending in .gz or
+			.gzip and to plain output for file handles.
+		:type compress: Boolean
+		:param voxels: Optional iterable of flat voxel data blocks in the units of the stored grid, written instead of
+			the stored grid. Allows to write derived data without keeping it in memory.
+		"""
+		if isinstance(target, basestring):
+			if compress is None:
+				compress = target.endswith('.gz') or target.endswith('.gzip')
+			try:
+				fh = gzip.open(target, 'wb') if compress else open(target, 'w')
+			except IOError:
+				raise ValueError('Unable to open file for writing.')
+		elif compress:
+			fh = gzip.GzipFile(fileobj=target, mode='wb')
+		else:
+			fh = target
+
+		try:
+			for chunk in self._iter_text(voxels):
+				fh.write(chunk)
+		finally:
+			if fh is not target:
+				fh.close()
+
+	@require_loaded
+	@require_parsed
+	def to_string(self):
+		return ''.join(self._iter_text()).split('\n')[:-1]
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# system modules
+import hashlib
+
+# third-party modules
+from scipy.spatial import cKDTree
+import numpy as np
+
+# custom modules
+import geometry as geo
+import io
+import slabs
+
+#: Number of voxels assigned at once
+CHUNK_VOXELS = 2 ** 17
+#: Default leaf size of the k-d tree
+LEAFSIZE = 16
+#: Number of decimals of the site coordinates in Angstrom that identify a reusable voxel assignment
+LABEL_DECIMALS = 4
+
+
+def nearest_sites(tree, positions, jobs=-1):
+	""" Finds the closest site for each position.
+
+	:param tree: Search tree of the sites.
+	:type tree: :class:`scipy.spatial.cKDTree` or :class:`euston.geometry.PeriodicKDTree`
+	:param positions: Numpy array of shape (n, 3).
+	:param jobs: Number of threads for the query. -1 uses all cores.
+	:type jobs: Integer
+	:return: Numpy array of site indices.
+	"""
+	distances, index = tree.query(positions, n_jobs=jobs)
+	return index
+
+
+def build_tree(cube, sites, leafsize=LEAFSIZE, periodic=False):
+	""" Search tree for the sites.
+
+	:param cube: Cube file whose cell is used in periodic boundary conditions.
+	:type cube: :class:`euston.io.CubeFile`
+	:param sites: Positions in Angstrom, numpy array of shape (n, 3).
+	:param leafsize: Leaf size of the k-d tree.
+	:type leafsize: Integer
+	:param periodic: Whether to search in periodic boundary conditions of the cube cell.
+	:type periodic: Boolean
+	"""
+	return _build_tree(sites, cube.get_h_matrix() if periodic else None, leafsize)
+
+
+def _build_tree(sites, h_matrix, leafsize):
+	if h_matrix is not None:
+		return geo.PeriodicKDTree(sites, h_matrix, leafsize=leafsize)
+	return cKDTree(sites, leafsize=leafsize)
+
+
+def iter_assignments(cube, sites, nsites=None, chunksize=CHUNK_VOXELS, leafsize=LEAFSIZE, jobs=-1, periodic=False):
+	""" Assigns voxels to their closest site chunk by chunk.
+
+	Voxel centers are built from the cube vectors for each chunk, so the memory requirements do not depend on the grid
+	size. Works in streaming mode as well.
+
+	:param cube: Cube file.
+	:type cube: :class:`euston.io.CubeFile`
+	:param sites: Positions in Angstrom, numpy array of shape (n, 3).
+	:param nsites: If given, site indices are taken modulo this number, e.g. to map periodic images back to the atoms.
+	:type nsites: Integer
+	:param chunksize: Number of voxels per chunk.
+	:type chunksize: Integer
+	:param leafsize: Leaf size of the k-d tree.
+	:type leafsize: Integer
+	:param jobs: Number of threads for the nearest neighbour search. -1 uses all cores.
+	:type jobs: Integer
+	:param periodic: Whether to search in periodic boundary conditions of the cube cell.
+	:type periodic: Boolean
+	:return: Generator of tuples of site indices and voxel values.
+	"""
+	tree = build_tree(cube, sites, leafsize, periodic)
+	offset = 0
+	for block in cube.iter_voxels(blocksize=chunksize * np.dtype(np.float64).itemsize):
+		positions = cube.get_voxel_positions(offset, offset + len(block), centered=True)
+		index = nearest_sites(tree, positions, jobs)
+		if nsites is not None:
+			index %= nsites
+		offset += len(block)
+		yield index, block
+
+
+def label_dtype(nsites):
+	"""Smallest unsigned integer type for site indices."""
+	if nsites <= 2 ** 16:
+		return np.uint16
+	return np.uint32
+
+
+def assignment_key(cube, sites, nsites, decimals=LABEL_DECIMALS, periodic=False):
+	""" Identifies a voxel assignment by grid, cell and rounded site coordinates.
+
+	Geometries that agree to the given number of decimals share the same key, so small coordinate noise along a scan
+	does not trigger a new assignment.
+
+	:param cube: Cube file.
+	:type cube: :class:`euston.io.CubeFile`
+	:param sites: Positions in Angstrom, numpy array of shape (n, 3).
+	:param nsites: Number of distinct sites.
+	:type nsites: Integer
+	:param decimals: Number of decimals of the coordinates to compare.
+	:type decimals: Integer
+	:param periodic: Whether the assignment is in periodic boundary conditions.
+	:type periodic: Boolean
+	:return: String usable as cache entry name.
+	"""
+	digest = hashlib.sha1()
+	digest.update(np.array(cube._nvoxel, dtype=np.int64).tostring())
+	digest.update(np.round(np.array(cube._vectors, dtype=np.float64), 10).tostring())
+	digest.update(np.round(cube.get_origin(), 10).tostring())
+	# adding zero avoids distinct keys for -0.0 and 0.0
+	digest.update((np.round(np.array(sites, dtype=np.float64), decimals) + 0.).tostring())
+	digest.update('%d %d' % (nsites, periodic))
+	return 'labels-%s' % digest.hexdigest()[:24]
+
+
+def compute_labels(cube, sites, nsites=None, chunksize=CHUNK_VOXELS, leafsize=LEAFSIZE, jobs=-1, periodic=False):
+	""" Closest site for each voxel. Only the grid of the cube file is used, the voxel data is not touched.
+
+	:param cube: Cube file.
+	:type cube: :class:`euston.io.CubeFile`
+	:param sites: Positions in Angstrom, numpy array of shape (n, 3).
+	:param nsites: Number of distinct sites. See :func:`iter_assignments`.
+	:type nsites: Integer
+	:param chunksize: Number of voxels per chunk.
+	:type chunksize: Integer
+	:param leafsize: Leaf size of the k-d tree.
+	:type leafsize: Integer
+	:param jobs: Number of threads for the nearest neighbour search. -1 uses all cores.
+	:type jobs: Integer
+	:param periodic: Whether to search in periodic boundary conditions of the cube cell.
+	:type periodic: Boolean
+	:return: Flat numpy array of site indices in the order of :meth:`euston.io.CubeFile.iter_voxels`.
+	"""
+	if nsites is None:
+		nsites = len(sites)
+	tree = build_tree(cube, sites, leafsize, periodic)
+	labels = np.empty(cube.count_voxels(), dtype=label_dtype(nsites))
+	for start in range(0, len(labels), chunksize):
+		stop = min(start + chunksize, len(labels))
+		index = nearest_sites(tree, cube.get_voxel_positions(start, stop, centered=True), jobs)
+		labels[start:stop] = index % nsites
+	return labels
+
+
+def cached_labels(cache, cube, sites, nsites=None, decimals=LABEL_DECIMALS, periodic=False, **kwargs):
+	""" Voxel assignment from the cache or newly computed and stored in the cache.
+
+	:param cache: Cache for the label grids.
+	:type cache: :class:`euston.cache.FileCache`
+	:param cube: Cube file.
+	:type cube: :class:`euston.io.CubeFile`
+	:param sites: Positions in Angstrom, numpy array of shape (n, 3).
+	:param nsites: Number of distinct sites. See :func:`iter_assignments`.
+	:type nsites: Integer
+	:param decimals: Number of decimals of the coordinates that identify the assignment. See :func:`assignment_key`.
+	:type decimals: Integer
+	:param periodic: Whether to search in periodic boundary conditions of the cube cell.
+	:type periodic: Boolean
+	:param kwargs: Passed on to :func:`compute_labels`.
+	:return: Flat numpy array of site indices. Memory-mapped if taken from the cache.
+	"""
+	if nsites is None:
+		nsites = len(sites)
+	key = assignment_key(cube, sites, nsites, decimals, periodic)
+	entry = cache.load_keyed(key, mmap_mode='r')
+	if entry is not None:
+		meta, labels = entry
+		if len(labels) == cube.count_voxels() and int(meta['nsites']) == nsites:
+			return labels
+	labels = compute_labels(cube, sites, nsites, periodic=periodic, **kwargs)
+	cache.store_keyed(key, {'nsites': np.array(nsites)}, labels)
+	return labels
+
+
+def _slab_label_sums(parts, start, nsites):
+	data, labels = parts
+	return np.bincount(labels.reshape(-1), weights=data.reshape(-1), minlength=nsites)
+
+
+def apply_labels(cube, labels, nsites, processes=1):
+	""" Sums the voxel data per site for a precomputed assignment in a single pass over the data.
+
+	Works for any integer mask of the grid, e.g. to integrate regions.
+
+	:param cube: Cube file, may be in streaming mode.
+	:type cube: :class:`euston.io.CubeFile`
+	:param labels: Flat site indices as from :func:`compute_labels`.
+	:param nsites: Number of distinct sites.
+	:type nsites: Integer
+	:param processes: Number of worker processes for slabs of the grid. Requires stored voxel data.
+	:type processes: Integer
+	:return: Numpy array of voxel value sums, one entry per site.
+	"""
+	if len(labels) != cube.count_voxels():
+		raise ValueError('Assignment does not match the grid.')
+	data = cube.get_data()
+	if processes > 1 and data is not None:
+		return slabs.reduce_slabs(_slab_label_sums, [data, labels.reshape(data.shape)], processes, (nsites, ))
+
+	result = np.zeros(nsites)
+	offset = 0
+	for block in cube.iter_voxels():
+		result += np.bincount(labels[offset:offset + len(block)], weights=block, minlength=nsites)
+		offset += len(block)
+	return result
+
+
+def _prepare_site_sums(grid, sites, nsites, chunksize, leafsize, h_matrix):
+	return grid, _build_tree(sites, h_matrix, leafsize), nsites, chunksize
+
+
+def _slab_site_sums(parts, start, grid, tree, nsites, chunksize):
+	origin, vectors, nvoxel = grid
+	data = parts[0].reshape(-1)
+	offset = start * nvoxel[1] * nvoxel[2]
+	result = np.zeros(nsites)
+	for first in range(0, len(data), chunksize):
+		block = data[first:first + chunksize]
+		positions = io.grid_positions(origin, vectors, nvoxel, offset + first, offset + first + len(block), True)
+		index = nearest_sites(tree, positions, 1) % nsites
+		result += np.bincount(index, weights=block, minlength=nsites)
+	return result
+
+
+def wigner_seitz_sums(cube, sites=None, nsites=None, chunksize=CHUNK_VOXELS, leafsize=LEAFSIZE, jobs=-1,
+					  periodic=False, processes=1):
+	""" Sums the voxel data over the Wigner-Seitz cell of each site.
+
+	:param cube: Cube file.
+	:type cube: :class:`euston.io.CubeFile`
+	:param sites: Positions in Angstrom, numpy array of shape (n, 3). Defaults to the atom positions of the cube file.
+	:param nsites: Number of distinct sites. See :func:`iter_assignments`.
+	:type nsites: Integer
+	:param chunksize: Number of voxels per chunk.
+	:type chunksize: Integer
+	:param leafsize: Leaf size of the k-d tree.
+	:type leafsize: Integer
+	:param jobs: Number of threads for the nearest neighbour search. -1 uses all cores.
+	:type jobs: Integer
+	:param periodic: Whether to search in periodic boundary conditions of the cube cell.
+	:type periodic: Boolean
+	:param processes: Number of worker processes for slabs of the grid. Requires stored voxel data. Each process
+		queries single-threaded, so `jobs` is ignored.
+	:type processes: Integer
+	:return: Numpy array of voxel value sums, one entry per site. Not multiplied by the voxel volume.
+	"""
+	if sites is None:
+		sites = cube.get_coordinates()
+	if nsites is None:
+		nsites = len(sites)
+	data = cube.get_data()
+	if processes > 1 and data is not None:
+		grid = (cube.get_origin(), np.array(cube._vectors), tuple(cube._nvoxel))
+		h_matrix = cube.get_h_matrix() if periodic else None
+		args = (grid, np.array(sites), nsites, chunksize, leafsize, h_matrix)
+		# the search tree is built once per worker process
+		return slabs.reduce_slabs(_slab_site_sums, [data], processes, args, _prepare_site_sums)
+
+	result = np.zeros(nsites)
+	for index, block in iter_assignments(cube, sites, nsites, chunksize, leafsize, jobs, periodic):
+		result += np.bincount(index, weights=block, minlength=nsites)
+	return result
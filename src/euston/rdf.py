@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+
+# system modules
+import multiprocessing
+import re
+
+# third-party modules
+import numpy as np
+
+# custom modules
+import geometry as geo
+import io
+import slabs
+
+#: Default number of histogram bins
+RDF_BINS = 1000
+#: Number of frame blocks per worker process, more blocks balance the load better
+TASKS_PER_PROCESS = 4
+#: Distances below this value in Angstrom are taken as an atom and itself
+SELF_DISTANCE = 1e-6
+
+
+def unique_scaled_positions(scaled, decimals=6):
+	""" Wraps scaled positions into the unit cell and removes duplicates, e.g. atoms listed on every cell corner.
+
+	:param scaled: Scaled positions.
+	:type scaled: Numpy array of shape (n, 3)
+	:param decimals: Number of decimals that identify a position.
+	:type decimals: Integer
+	:return: Numpy array of the unique positions in [0, 1) in order of first occurrence.
+	"""
+	wrapped = np.asarray(scaled, dtype=np.float64).reshape(-1, 3)
+	wrapped = np.round(wrapped - np.floor(wrapped), decimals)
+	wrapped[wrapped >= 1.] -= 1.
+	# adding zero avoids distinct keys for -0.0 and 0.0
+	keys = [_.tostring() for _ in wrapped + 0.]
+	first = sorted(dict((key, index) for index, key in reversed(list(enumerate(keys)))).values())
+	return wrapped[first]
+
+
+def lattice_translations(h_matrix, maxr):
+	""" All lattice translations up to a given length.
+
+	The integer coefficient of each cell vector is bounded by the length of the corresponding reciprocal vector, so
+	only a box of candidates that is just large enough is enumerated.
+
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+	:type h_matrix: Numpy array of shape (3, 3) or :class:`euston.geometry.Cell`
+	:param maxr: Maximum length in Angstrom.
+	:type maxr: Float
+	:return: Numpy array of shape (k, 3) with the cartesian translations, including the zero translation.
+	"""
+	cell = geo.Cell(h_matrix) if not isinstance(h_matrix, geo.Cell) else h_matrix
+	limits = np.ceil(maxr * np.linalg.norm(cell.get_inverse(), axis=1)).astype(np.int)
+	coefficients = np.indices(2 * limits + 1).reshape(3, -1).T - limits
+	translations = np.dot(coefficients, cell.get_h_matrix().T)
+	return translations[(translations ** 2).sum(axis=1) <= maxr ** 2]
+
+
+def shell_volumes(edges):
+	""" Volumes of the spherical shells between histogram bin edges.
+
+	:param edges: Bin edges in Angstrom.
+	:type edges: Numpy array
+	:return: Numpy array with one entry less than the edges.
+	"""
+	return 4. / 3 * np.pi * np.diff(np.asarray(edges, dtype=np.float64) ** 3)
+
+
+def normalize_rdf(counts, edges, nreference, density):
+	""" Pair distribution g(r) from a distance histogram.
+
+	:param counts: Number of pairs per bin, counted from each reference atom.
+	:type counts: Numpy array
+	:param edges: Bin edges in Angstrom.
+	:type edges: Numpy array
+	:param nreference: Number of reference atoms the counts are summed over.
+	:type nreference: Integer or Float
+	:param density: Number density of the counted atoms in atoms per cubic Angstrom.
+	:type density: Float
+	:return: Numpy array, approaching one for uncorrelated atoms.
+	"""
+	return np.asarray(counts, dtype=np.float64) / (nreference * density * shell_volumes(edges))
+
+
+def histogram_distances(distances, maxr, bins, counts=None):
+	""" Adds distances to a histogram of equally sized bins from zero to maxr. Self distances are skipped.
+
+	:param distances: Distances in Angstrom.
+	:type distances: Numpy array
+	:param maxr: Upper limit of the histogram in Angstrom.
+	:type maxr: Float
+	:param bins: Number of bins.
+	:type bins: Integer
+	:param counts: Histogram to add to. A new one is created if not given.
+	:type counts: Numpy array of length bins
+	:return: The updated histogram.
+	"""
+	if counts is None:
+		counts = np.zeros(bins, dtype=np.int64)
+	distances = np.asarray(distances).reshape(-1)
+	distances = distances[(distances > SELF_DISTANCE) & (distances < maxr)]
+	counts += np.bincount((distances * (bins / float(maxr))).astype(np.int), minlength=bins)[:bins]
+	return counts
+
+
+def lattice_rdf(h_matrix, scaled, maxr, bins=RDF_BINS, blocksize=geo.PAIR_BLOCK_SIZE):
+	""" Radial distribution function of an infinite periodic crystal.
+
+	Every atom of the unit cell is taken as reference and all its neighbours within maxr are counted exactly, using
+	only the lattice translations that can give such a neighbour. Distances are evaluated in blocks of translations and
+	added to the histogram directly.
+
+	:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+	:type h_matrix: Numpy array of shape (3, 3) or :class:`euston.geometry.Cell`
+	:param scaled: Scaled positions of the atoms in the unit cell. Duplicates modulo the cell are removed.
+	:type scaled: Numpy array of shape (n, 3)
+	:param maxr: Maximum distance in Angstrom.
+	:type maxr: Float
+	:param bins: Number of histogram bins.
+	:type bins: Integer
+	:param blocksize: Approximate number of distances evaluated at once.
+	:type blocksize: Integer
+	:return: Tuple of bin edges, pair counts per unit cell and g(r).
+	"""
+	cell = geo.Cell(h_matrix) if not isinstance(h_matrix, geo.Cell) else h_matrix
+	basis = geo.scaled_to_cartesian_coordinates(unique_scaled_positions(scaled), cell)
+	differences = (basis[np.newaxis, :, :] - basis[:, np.newaxis, :]).reshape(-1, 3)
+	extent = np.sqrt((differences ** 2).sum(axis=1)).max()
+	translations = lattice_translations(cell, maxr + extent)
+
+	counts = np.zeros(bins, dtype=np.int64)
+	step = max(1, blocksize // len(differences))
+	for start in range(0, len(translations), step):
+		vectors = differences[np.newaxis, :, :] + translations[start:start + step, np.newaxis, :]
+		histogram_distances(np.sqrt((vectors ** 2).sum(axis=2)), maxr, bins, counts)
+
+	edges = np.linspace(0, maxr, bins + 1)
+	density = len(basis) / cell.get_volume()
+	return edges, counts, normalize_rdf(counts, edges, len(basis), density)
+
+
+class RdfAccumulator(object):
+	""" Histograms of pair distances summed over frames, separately for each pair of atom labels.
+
+	Each frame is weighted by its cell volume, so cells that change along the trajectory are normalized correctly. Only
+	pairs of distinct atoms are counted, including all their periodic images within the maximum distance, but not the
+	images of an atom itself. Accumulators hold plain arrays only and can be sent between processes and merged. The
+	neighbour list that is kept between frames is not sent along.
+	"""
+
+	def __init__(self, labels, maxr, bins=RDF_BINS, skin=0.):
+		"""Prepares the histograms.
+
+		:param labels: Atom labels, identical for all frames.
+		:type labels: List of strings
+		:param maxr: Maximum distance in Angstrom.
+		:type maxr: Float
+		:param bins: Number of histogram bins.
+		:type bins: Integer
+		:param skin: Skin of the neighbour list in Angstrom, see :class:`euston.geometry.NeighborList`. Only helps for
+			trajectories that are not wrapped into the cell.
+		:type skin: Float
+		"""
+		self._labels = list(labels)
+		self._species = sorted(set(self._labels))
+		self._index = np.array([self._species.index(_) for _ in self._labels], dtype=np.int)
+		self._maxr = float(maxr)
+		self._bins = bins
+		self._skin = skin
+		self._weighted = np.zeros((len(self._species), len(self._species), bins))
+		self._frames = 0
+		self._neighbors = None
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['_neighbors'] = None
+		return state
+
+	def count_frames(self):
+		return self._frames
+
+	def get_species(self):
+		"""Sorted unique labels."""
+		return self._species
+
+	def get_edges(self):
+		return np.linspace(0, self._maxr, self._bins + 1)
+
+	def add_frame(self, coordinates, h_matrix, labels=None):
+		""" Adds all pairs of one frame.
+
+		:param coordinates: Atom positions. Unit of length: Angstrom.
+		:type coordinates: Numpy array of shape (n, 3)
+		:param h_matrix: H matrix with the cell vectors as columns. Unit of length: Angstrom.
+		:type h_matrix: Numpy array of shape (3, 3) or :class:`euston.geometry.Cell`
+		:param labels: Atom labels of the frame, only checked for consistency if given.
+		:type labels: List of strings
+		"""
+		if labels is not None and list(labels) != self._labels:
+			raise ValueError('Atom labels differ between frames.')
+		if len(coordinates) != len(self._labels):
+			raise ValueError('Number of atoms differs between frames.')
+		cell = geo.Cell(h_matrix) if not isinstance(h_matrix, geo.Cell) else h_matrix
+		if self._neighbors is None:
+			self._neighbors = geo.NeighborList(self._maxr, self._skin)
+		self._neighbors.update(coordinates, cell)
+		first, second, distances, vectors = self._neighbors.get_pairs()
+		distinct = first != second
+		first, second, distances = first[distinct], second[distinct], distances[distinct]
+
+		nspecies = len(self._species)
+		a = self._index[first]
+		b = self._index[second]
+		pairs = np.minimum(a, b) * nspecies + np.maximum(a, b)
+		index = np.minimum((distances * (self._bins / self._maxr)).astype(np.int), self._bins - 1)
+		counts = np.bincount(pairs * self._bins + index, minlength=nspecies * nspecies * self._bins)
+		self._weighted += counts.reshape(self._weighted.shape) * cell.get_volume()
+		self._frames += 1
+
+	def merge(self, other):
+		""" Adds the frames of another accumulator.
+
+		:param other: Accumulator of the same atoms and histogram settings.
+		:type other: :class:`RdfAccumulator`
+		"""
+		if other._labels != self._labels or other._bins != self._bins or other._maxr != self._maxr:
+			raise ValueError('Incompatible accumulators.')
+		self._weighted += other._weighted
+		self._frames += other._frames
+
+	def get_rdf(self, first=None, second=None):
+		""" Normalized g(r) averaged over all frames.
+
+		:param first: Label of the reference atoms. All atoms if not given.
+		:type first: String
+		:param second: Label of the counted atoms. All atoms if not given.
+		:type second: String
+		:return: Numpy array of length bins. Zero for equal labels of a single atom, which has no partner.
+		"""
+		if self._frames == 0:
+			raise ValueError('No frames added.')
+		if (first is None) != (second is None):
+			raise ValueError('Need both labels for partial RDFs.')
+		if first is None:
+			weighted = self._weighted.sum(axis=(0, 1))
+			nfirst = nsecond = len(self._labels)
+		else:
+			i, j = sorted((self._species.index(first), self._species.index(second)))
+			weighted = self._weighted[i, j]
+			nfirst = self._labels.count(first)
+			nsecond = self._labels.count(second)
+		# pairs are stored once, but each atom of a pair of equal labels is a reference and has one partner less
+		if first == second:
+			weighted = 2 * weighted
+			nsecond -= 1
+		if nsecond == 0:
+			return np.zeros(self._bins)
+		# g(r) of a frame is counts / (nfirst * nsecond / V * shell volume). The stored counts already carry the factor V
+		# of their frame, so the average over frames only needs the remaining constant factors.
+		return weighted / (self._frames * nfirst * nsecond * shell_volumes(self.get_edges()))
+
+
+def iter_file_frames(filename, start=0, stop=None, step=1, index=False):
+	""" Frames of a coordinate file. XYZ files may hold any number of frames and are read one frame at a time.
+
+	:param filename: Coordinate file readable with :func:`euston.io.anyopen`.
+	:type filename: String
+	:param start: Index of the first frame.
+	:type start: Integer
+	:param stop: Index of the frame to stop before.
+	:type stop: Integer
+	:param step: Stride between frames.
+	:type step: Integer
+	:param index: Whether to use the frame index stored next to XYZ files or a frame index of the file, see
+		:class:`euston.io.FrameIndex`.
+	:type index: Boolean or :class:`euston.io.FrameIndex`
+	:return: Generator of tuples of labels, coordinates and H matrix. Labels are None for formats without them and the
+		H matrix is None for formats without cell information. Coordinates may be overwritten by the next frame.
+	"""
+	if _is_xyz(filename):
+		trajectory = io.XYZTrajectory(filename=filename, index=index)
+		try:
+			for labels, coordinates, comment in trajectory.iter_frames(start, stop, step, reuse=True):
+				yield labels, coordinates, None
+		finally:
+			trajectory.close()
+		return
+
+	# other formats hold a single frame
+	if start > 0 or (stop is not None and stop < 1):
+		return
+	coordfile = io.anyopen(filename)
+	if not isinstance(coordfile, io.HoldsCoordinates):
+		raise ValueError('No coordinates in %s.' % filename)
+	h_matrix = coordfile.get_h_matrix() if isinstance(coordfile, io.HoldsUnitcell) else None
+	yield None, coordfile.get_coordinates(), h_matrix
+	coordfile.close()
+
+
+def count_file_frames(filename, index=False):
+	""" Number of frames of a coordinate file.
+
+	:param filename: Coordinate file, see :func:`iter_file_frames`.
+	:type filename: String
+	:param index: Whether to use a frame index for XYZ files, creating or extending it as required.
+	:type index: Boolean
+	:return: Integer
+	"""
+	if _is_xyz(filename):
+		trajectory = io.XYZTrajectory(filename=filename, index=index)
+		count = trajectory.count_frames()
+		trajectory.close()
+		return count
+	return 1
+
+
+def _is_xyz(filename):
+	return re.sub('\\.(gz|gzip)$', '', filename).endswith('.xyz')
+
+
+def _frame_source(filename, index):
+	# number of frames, frame index handed to the tasks and whether the frames may be split between tasks
+	if not _is_xyz(filename):
+		return 1, False, True
+	if re.search('\\.(gz|gzip)$', filename):
+		# gzipped streams cannot seek, so the whole file is read by one task
+		return count_file_frames(filename, index), False, False
+	frames = io.FrameIndex(filename, persistent=index)
+	frames.update()
+	return len(frames), frames, True
+
+
+def _rdf_frames(task):
+	parts, maxr, bins, skin = task
+	accumulator = None
+	for filename, start, stop, step, cells, index in parts:
+		# cells are either a list with one entry per frame or shared by all frames
+		shared = not isinstance(cells, list)
+		count = 0
+		frames = iter_file_frames(filename, start, stop, step, index)
+		try:
+			for labels, coordinates, frame_h in frames:
+				if shared:
+					h_matrix = cells
+				elif count < len(cells):
+					h_matrix = cells[count]
+				else:
+					raise ValueError('More frames than H matrices in %s.' % filename)
+				count += 1
+				cell = h_matrix if h_matrix is not None else frame_h
+				if cell is None:
+					raise ValueError('No cell information for %s.' % filename)
+				if accumulator is None:
+					accumulator = RdfAccumulator(labels or ['X'] * len(coordinates), maxr, bins, skin)
+				accumulator.add_frame(coordinates, cell, labels)
+		finally:
+			frames.close()
+		if not shared and count != len(cells):
+			raise ValueError('Fewer frames than H matrices in %s.' % filename)
+	return accumulator
+
+
+def trajectory_rdf(filenames, maxr, bins=RDF_BINS, h_matrices=None, processes=1, start=0, stop=None, step=1,
+				   index=False, skin=0.):
+	""" RDF over the frames of coordinate files, e.g. an MD trajectory or snapshots of it.
+
+	Frames are read one at a time, so memory does not depend on the number of frames. A single process reads all frames
+	in one pass. Frame selections, per-frame cells and worker processes require the number of frames beforehand. Then
+	plain XYZ files are scanned once for a :class:`euston.io.FrameIndex` and the selected frames are split into
+	contiguous blocks, so that each worker process seeks to its first frame directly. Gzipped XYZ files cannot seek and
+	are read by a single task each. The histograms of all blocks are merged at the end.
+
+	:param filenames: Coordinate files, see :func:`iter_file_frames`. Their frames are taken one after another.
+	:type filenames: List of strings
+	:param maxr: Maximum distance in Angstrom.
+	:type maxr: Float
+	:param bins: Number of histogram bins.
+	:type bins: Integer
+	:param h_matrices: Either one H matrix for all frames or one per frame of all files. Entries that are None are
+		taken from the file.
+	:type h_matrices: Numpy array of shape (3, 3), :class:`euston.geometry.Cell` or list of them
+	:param processes: Number of worker processes.
+	:type processes: Integer
+	:param start: Index of the first frame.
+	:type start: Integer
+	:param stop: Index of the frame to stop before.
+	:type stop: Integer
+	:param step: Stride between frames.
+	:type step: Integer
+	:param index: Whether to keep the frame indices of XYZ files next to them, so that later calls need not scan the
+		files again.
+	:type index: Boolean
+	:param skin: Skin of the neighbour list kept between the frames of each task, see :class:`RdfAccumulator`.
+	:type skin: Float
+	:return: :class:`RdfAccumulator`
+	"""
+	shared = h_matrices is None or isinstance(h_matrices, geo.Cell) or np.ndim(h_matrices) == 2
+	if processes < 2 and shared and (start, stop, step) == (0, None, 1):
+		# all frames in order, no need to count them first
+		if h_matrices is not None and not isinstance(h_matrices, geo.Cell):
+			h_matrices = np.asarray(h_matrices)
+		parts = [(_, 0, None, 1, h_matrices, False) for _ in filenames]
+		accumulator = _rdf_frames((parts, maxr, bins, skin))
+		if accumulator is None:
+			raise ValueError('No frames selected.')
+		return accumulator
+
+	sources = [_frame_source(_, index) for _ in filenames]
+	offsets = np.cumsum([0] + [_[0] for _ in sources])
+	selected = np.arange(offsets[-1])[start:stop:step]
+	if len(selected) == 0:
+		raise ValueError('No frames selected.')
+	if shared:
+		h_matrices = [h_matrices] * offsets[-1]
+	if len(h_matrices) != offsets[-1]:
+		raise ValueError('Need one H matrix per frame.')
+
+	# blocks of about the same number of frames, files that cannot seek are not split
+	blocks = processes * TASKS_PER_PROCESS if processes > 1 else 1
+	target = -(-len(selected) // blocks)
+	tasks, parts, size = [], [], 0
+	for i, filename in enumerate(filenames):
+		count, frame_index, splittable = sources[i]
+		first, last = np.searchsorted(selected, offsets[i:i + 2])
+		local = selected[first:last] - offsets[i]
+		while len(local) > 0:
+			chunk = local[:target - size] if splittable else local
+			local = local[len(chunk):]
+			cells = [h_matrices[_ + offsets[i]] for _ in chunk]
+			parts.append((filename, int(chunk[0]), int(chunk[-1]) + 1, step, cells, frame_index))
+			size += len(chunk)
+			if size >= target:
+				tasks.append((parts, maxr, bins, skin))
+				parts, size = [], 0
+	if len(parts) > 0:
+		tasks.append((parts, maxr, bins, skin))
+
+	if processes < 2:
+		results = map(_rdf_frames, tasks)
+	else:
+		pool = multiprocessing.Pool(processes)
+		try:
+			results = pool.map(_rdf_frames, tasks, chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+
+	accumulator = results[0]
+	for result in results[1:]:
+		accumulator.merge(result)
+	return accumulator
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# system modules
+import mmap
+import multiprocessing
+import multiprocessing.sharedctypes
+
+# third-party modules
+import numpy as np
+
+#: Number of slabs per worker process, more slabs balance the load better
+SLABS_PER_PROCESS = 4
+
+# grids shared with the worker processes and slab function arguments, set by the pool initializer
+_shared = None
+_args = None
+
+
+class SharedArray(object):
+	""" Numpy array in shared memory that worker processes inherit without pickling.
+
+	The Python 2 standard library has no ``multiprocessing.shared_memory``, so the buffer is a
+	:func:`multiprocessing.sharedctypes.RawArray` that is handed to the workers when the pool is created. Arrays from
+	:func:`zeros` already live in shared memory and memory-mapped files are mapped again by the workers, so only other
+	arrays need to be copied.
+	"""
+
+	def __init__(self, array):
+		"""Shares an array, copying it into shared memory if it is neither from :func:`zeros` nor memory-mapped.
+
+		:param array: Array to share.
+		:type array: Numpy array
+		"""
+		array = np.asarray(array)
+		self._shape = array.shape
+		self._dtype = array.dtype
+		self._buffer = None
+		self._filename = None
+		self._offset = 0
+
+		# numpy keeps the array owning the memory as base of all views
+		owner = array
+		while isinstance(owner.base, np.ndarray):
+			owner = owner.base
+		if array.flags.c_contiguous and array.size > 0 and isinstance(owner.base, mmap.mmap):
+			if not isinstance(owner, np.memmap):
+				# anonymous mapping from zeros, the owner starts at the beginning of the mapping
+				self._buffer = owner.base
+				self._offset = array.ctypes.data - owner.ctypes.data
+				return
+			if owner.filename is not None:
+				self._filename = owner.filename
+				self._offset = owner.offset + array.ctypes.data - owner.ctypes.data
+				return
+
+		self._buffer = multiprocessing.sharedctypes.RawArray('b', max(1, array.nbytes))
+		target = self.get_array()
+		# copy in slabs to avoid temporary copies of memory-mapped input
+		step = max(1, len(array) // 64) if array.ndim > 0 else 1
+		for start in range(0, len(target), step):
+			target[start:start + step] = array[start:start + step]
+
+	def get_array(self):
+		"""Numpy view of the shared buffer or read-only map of the file."""
+		if self._filename is not None:
+			return np.memmap(self._filename, dtype=self._dtype, mode='r', offset=self._offset, shape=self._shape)
+		count = int(np.prod(self._shape))
+		return np.frombuffer(self._buffer, dtype=self._dtype, count=count, offset=self._offset).reshape(self._shape)
+
+
+def zeros(shape, dtype=np.float64):
+	""" Zero-initialised array in shared memory, which :func:`map_slabs` hands to worker processes without a copy.
+
+	The memory is an anonymous shared mapping that forked workers inherit. Unlike the heap behind
+	:func:`multiprocessing.sharedctypes.RawArray`, it is returned to the system once the array is no longer used.
+
+	:param shape: Array shape.
+	:type shape: Tuple
+	:param dtype: Data type.
+	:return: Numpy array.
+	"""
+	dtype = np.dtype(dtype)
+	count = int(np.prod(shape))
+	buffer = mmap.mmap(-1, max(1, count * dtype.itemsize))
+	return np.frombuffer(buffer, dtype=dtype, count=count).reshape(shape)
+
+
+def split_slabs(length, count):
+	""" Splits an axis into contiguous ranges of similar size.
+
+	:param length: Number of entries along the axis.
+	:type length: Integer
+	:param count: Number of ranges. Reduced if there are fewer entries.
+	:type count: Integer
+	:return: List of (start, stop) tuples.
+	"""
+	count = max(1, min(count, length))
+	bounds = np.linspace(0, length, count + 1).astype(np.int)
+	return [(bounds[i], bounds[i + 1]) for i in range(count) if bounds[i + 1] > bounds[i]]
+
+
+def _init_worker(shared, prepare, args):
+	global _shared, _args
+	if shared is None:
+		_shared, _args = None, None
+		return
+	_shared = [_.get_array() for _ in shared]
+	_args = args if prepare is None else prepare(*args)
+
+
+def _run_slab(task):
+	function, start, stop = task
+	return function([array[start:stop] for array in _shared], start, *_args)
+
+
+def map_slabs(function, arrays, processes, args=(), prepare=None):
+	""" Applies a function to slabs along the first axis of one or more arrays in a process pool.
+
+	The arrays are shared with the workers once, see :class:`SharedArray`, so only the slab boundaries are sent to the
+	workers.
+
+	:param function: Module-level function called as ``function(parts, start, *args)`` where `parts` is the list of
+		array slabs and `start` the index of the first slab entry along the first axis.
+	:param arrays: Arrays of identical length along the first axis.
+	:type arrays: List of numpy arrays
+	:param processes: Number of worker processes.
+	:type processes: Integer
+	:param args: Additional arguments for the function. Need to be picklable.
+	:type args: Tuple
+	:param prepare: Module-level function called once per worker process as ``prepare(*args)``, e.g. to build search
+		trees. Its return value is a tuple that replaces `args` for all slabs of that worker.
+	:return: List of the function results in slab order.
+	"""
+	if len(set(len(_) for _ in arrays)) != 1:
+		raise ValueError('Arrays need to share the first dimension.')
+	tasks = [(function, start, stop) for start, stop in split_slabs(len(arrays[0]), processes * SLABS_PER_PROCESS)]
+	if processes < 2:
+		_init_worker([_DirectArray(array) for array in arrays], prepare, args)
+		try:
+			return map(_run_slab, tasks)
+		finally:
+			_init_worker(None, None, None)
+
+	shared = [SharedArray(array) for array in arrays]
+	pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(shared, prepare, args))
+	try:
+		return pool.map(_run_slab, tasks, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+
+
+def reduce_slabs(function, arrays, processes, args=(), prepare=None):
+	""" Sums the results of :func:`map_slabs`.
+
+	:return: Sum of the partial results of all slabs.
+	"""
+	return reduce(lambda x, y: x + y, map_slabs(function, arrays, processes, args, prepare))
+
+
+class _DirectArray(object):
+	"""Stands in for :class:`SharedArray` when running in the current process."""
+
+	def __init__(self, array):
+		self._array = array
+
+	def get_array(self):
+		return self._array
@@ -107,22 +107,17 @@ def main(args):
 
 		if args.hmat is not None:
 			try:
-				hmat = map(float, args.hmat.split(','))
-			except:
-				print 'Invalid H matrix entries.'
+				hmat = geo.Cell.from_string(args.hmat)
+			except ValueError as e:
+				print e
 				exit(2)
-			hmat = np.array(hmat).reshape((3, 3)).T
 
 		if args.abc is not None:
 			try:
-				abc = map(float, args.abc.split(','))
-			except:
-				print 'Invalid abc entries.'
-				exit(3)
-			if len(abc) != 6:
-				print 'Not enough entries for cell lengths.'
-				exit(5)
-			hmat = geo.abc_to_hmatrix(*abc, degrees=(not args.radians))
+				hmat = geo.Cell.from_string(args.abc, abc=True, degrees=(not args.radians))
+			except ValueError as e:
+				print e
+				exit(5 if len(args.abc.split(',')) != 6 else 3)
 
 	for images in (args.X, args.Y, args.Z):
 		if images < 1:
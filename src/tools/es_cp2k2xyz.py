@@ -46,11 +46,11 @@ def main(parser):
 	args = parser.parse_args()
 	cp2k = io.Cp2kInput(args.input)
 
-	retval = cp2k.get_cell_vectors()
-	if retval is None:
+	cell = cp2k.get_cell()
+	if cell is None:
 		print 'Unable to find cell information. Aborting.'
 		return
-	a, b, c = retval
+	a, b, c = cell
 
 	scaled = cp2k.boolean(cp2k.get_path('FORCE_EVAL / SUBSYS / COORD / SCALED'), False)
 
@@ -72,14 +72,10 @@ def main(parser):
 	coordinates = np.array(coordinates)
 
 	if scaled != args.scaled:
-		h = np.zeros((3, 3))
-		h[0, :] = a
-		h[1, :] = b
-		h[2, :] = c
 		if args.scaled == True:
-			coordinates = geo.cartesian_to_scaled_coordinates(coordinates, h)
+			coordinates = geo.cartesian_to_scaled_coordinates(coordinates, cell)
 		else:
-			coordinates = geo.scaled_to_cartesian_coordinates(coordinates, h)
+			coordinates = geo.scaled_to_cartesian_coordinates(coordinates, cell)
 
 	# XYZ output
 	lines = []
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Builds or updates an index of the cube files in a directory tree.
+
+Only the headers of the files are read, so scanning large collections is fast. The index is a JSON file holding atom
+count, voxel counts, voxel vectors, origin and cell of each file. Files that did not change since the last run are not
+read again.
+
+.. autofunction:: main
+
+Command Line Interface
+----------------------
+
+.. program:: es_cubecatalog.py
+
+.. option:: directory
+
+   Root directory to scan recursively.
+
+.. option:: index
+
+   The JSON index file. Updated if it exists.
+
+.. option:: --pattern
+
+   Shell pattern for the cube file names. Default: *.cube*
+
+.. option:: --jobs
+
+   Number of processes reading file headers in parallel. Default: 1.
+
+.. option:: --groups
+
+   Whether to list groups of files sharing the same grid, e.g. to find inputs for es_cubemath.py or es_projectcube.py.
+
+Implementation
+--------------
+"""
+
+# system modules
+import argparse
+
+# custom modules
+import euston.catalog as catalog
+
+parser = argparse.ArgumentParser(description='Builds or updates an index of the cube files in a directory tree.')
+parser.add_argument('directory', type=str, help='The root directory.')
+parser.add_argument('index', type=str, help='The JSON index file.')
+parser.add_argument('--pattern', type=str, default=catalog.CUBE_PATTERN, help='Shell pattern for cube file names.')
+parser.add_argument('--jobs', type=int, default=1, help='Number of parallel processes.')
+parser.add_argument('--groups', action='store_true', help='List groups of files sharing the same grid.')
+
+
+def main(args):
+	"""
+	Main routine wrapper.
+
+	:param args: Arguments as from argparse.ArgumentParser.parse_args
+	"""
+	if args.jobs < 1:
+		raise ValueError('At least one job required.')
+
+	index = catalog.CubeCatalog(args.index)
+	print 'Scanning directory...               ',
+	errors = index.update(args.directory, pattern=args.pattern, jobs=args.jobs)
+	index.save()
+	print 'Completed, %d files indexed.' % len(index)
+	for filename in sorted(errors):
+		print 'Skipped %s: %s' % (filename, errors[filename])
+
+	if args.groups:
+		for group in index.group_compatible():
+			entry = index.get(group[0])
+			print '# %d files, grid %s' % (len(group), 'x'.join(str(_) for _ in entry['nvoxel']))
+			for filename in group:
+				print filename
+
+
+if __name__ == '__main__':
+	main(parser.parse_args())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Calculates linear combinations of cube files, e.g. density differences or averages.
+
+The input files are read in parallel chunk by chunk, so memory requirements do not depend on the grid size. All input
+files need to share the same grid and origin. Header and atoms of the output are taken from the first input file.
+
+.. autofunction:: main
+
+Command Line Interface
+----------------------
+
+.. program:: es_cubemath.py
+
+.. option:: output
+
+   The cubefile to save to. Written gzipped if the name ends in .gz or .gzip.
+
+.. option:: input
+
+   The cubefiles to read from. May be gzipped.
+
+.. option:: --weights
+
+   One coefficient for each input file. Default: 1 for each file. For the density difference of a system AB with its fragments A and B, give the files in the order AB A B with weights 1 -1 -1.
+
+.. option:: --average
+
+   Whether to divide the result by the number of input files.
+
+.. option:: --constant
+
+   Value to add to every voxel. Default: 0.
+
+Implementation
+--------------
+"""
+
+# system modules
+import argparse
+
+# custom modules
+import euston.cubemath as cubemath
+
+parser = argparse.ArgumentParser(description='Calculates linear combinations of cube files.')
+parser.add_argument('output', type=str, help='The output file name.')
+parser.add_argument('input', type=str, nargs='+', help='The input cube files.')
+parser.add_argument('--weights', type=float, nargs='+', help='One coefficient for each input file.')
+parser.add_argument('--average', action='store_true', help='Whether to divide the result by the number of files.')
+parser.add_argument('--constant', type=float, default=0., help='Value to add to every voxel.')
+
+
+def main(args):
+	"""
+	Main routine wrapper.
+
+	:param args: Arguments as from argparse.ArgumentParser.parse_args
+	"""
+	weights = args.weights
+	if weights is None:
+		weights = [1.] * len(args.input)
+	if len(weights) != len(args.input):
+		print 'Please give one weight for each input file.'
+		exit(1)
+	if args.average:
+		weights = [_ / len(args.input) for _ in weights]
+
+	print 'Combining %d cubefiles...           ' % len(args.input),
+	try:
+		cubemath.linear_combination(args.input, weights, args.output, constant=args.constant)
+	except ValueError as e:
+		print 'Failed: %s' % e
+		exit(2)
+	print 'Completed.'
+
+
+if __name__ == '__main__':
+	main(parser.parse_args())
@@ -16,11 +16,39 @@ Command Line Interface
 
 .. option:: --periodic
 
-   Whether to treat input file in periodic boundary conditions. In the current implementation, this requires copying all atom positions for the 26 direct neighbouring cubes and therefore carries substantial cost in terms of memory requirements. The runtime scales O(log n) with the number of atoms.
+   Whether to treat input file in periodic boundary conditions. Works for any triclinic cell. Only the atom images close to the cell faces are considered, so the memory requirements hardly grow compared to the non-periodic case. The runtime scales O(log n) with the number of atoms.
 
 .. option:: --leafsize
 
-   Number of points at which brute-force nearest neighbour search is employed. Increasing this number introduces higher memory requirements, but may speed up processing. Default: 5000.
+   Number of points at which brute-force nearest neighbour search is employed. Default: 16.
+
+.. option:: --jobs
+
+   Number of threads for the nearest neighbour search. Default: -1, i.e. all cores.
+
+.. option:: --cache
+
+   Whether to reuse parsed cube data from the binary cache. See :option:`es_projectcube.py --cache`.
+
+.. option:: --hirshfeld
+
+   Whether to use smooth Hirshfeld weights from spherical reference densities instead of the Wigner-Seitz cells of the atoms. Works with --periodic and --processes.
+
+.. option:: --cutoff
+
+   Distance in Angstrom beyond which the reference densities for --hirshfeld vanish. Default: 5.
+
+.. option:: --processes
+
+   Number of processes working on slabs of the voxel grid. The voxel data is shared with the processes instead of being copied for each of them. Default: 1.
+
+.. option:: --partitioncache
+
+   Whether to keep the voxel assignment in the binary cache, see :option:`es_projectcube.py --cache`. Cube files of the same grid and geometry, e.g. along a scan with fixed ions, then reuse the assignment and only need a single pass over the voxel data. Coordinates are compared to 1e-4 Angstrom.
+
+.. option:: --float32
+
+   Whether to store the voxel data in single precision which halves the memory requirements. Sums are accumulated in double precision.
 
 Implementation
 --------------
@@ -30,19 +58,29 @@ Implementation
 import argparse
 
 # third-party modules
-from scipy.spatial import KDTree
 import numpy as np
 
 # custom modules
+import euston.cache as fcache
+import euston.hirshfeld as hirshfeld
 import euston.io as io
 import euston.geometry as geom
+import euston.partition as partition
 
 parser = argparse.ArgumentParser(
 	description='Calculates the Wigner-Seitz projection of cube file data of periodic data.')
 parser.add_argument('filename', type=str, help='The cube file.')
 parser.add_argument('--periodic', action='store_true', help='Treats cube data periodically.')
 parser.add_argument('--leafsize', type=int,
-					help='Number of points at which brute-force nearest neighbour search is employed.', default=5000)
+					help='Number of points at which brute-force nearest neighbour search is employed.',
+					default=partition.LEAFSIZE)
+parser.add_argument('--jobs', type=int, default=-1, help='Number of threads for the nearest neighbour search.')
+parser.add_argument('--cache', action='store_true', help='Reuse parsed cube data from the binary cache.')
+parser.add_argument('--hirshfeld', action='store_true', help='Use Hirshfeld weights instead of Wigner-Seitz cells.')
+parser.add_argument('--cutoff', type=float, default=hirshfeld.CUTOFF, help='Reference density cutoff for --hirshfeld.')
+parser.add_argument('--processes', type=int, default=1, help='Number of processes working on slabs of the grid.')
+parser.add_argument('--partitioncache', action='store_true', help='Reuse the voxel assignment from the binary cache.')
+parser.add_argument('--float32', action='store_true', help='Store voxel data in single precision.')
 
 
 def main(parser):
@@ -54,44 +92,25 @@ def main(parser):
 	args = parser.parse_args()
 
 	print 'Reading cubefile...                 ',
-	cube = io.CubeFile(args.filename)
+	cube = io.CubeFile(args.filename, cache=args.cache, dtype=(np.float32 if args.float32 else None))
 	print 'Completed, %d atoms %d voxels.' % (cube.count_atoms(), cube.count_voxels())
 
-	print 'Calculating cell dimensions...      ',
-	h_mat = cube.get_h_matrix()
-	print 'Completed.'
-
-	print 'Adding image atoms...               ',
+	print 'Assigning voxels...                 ',
 	coord = cube.get_coordinates()
-	images = np.zeros(((len(coord) * 27), 3))
-	counter = 0
-	for x in range(-1, 2):
-		for y in range(-1, 2):
-			for z in range(-1, 2):
-				if x * y * z == 0:
-					continue
-				shift = (h_mat.transpose() * np.array([x, y, z])).sum(axis=0)
-				images[counter * cube.count_atoms():(counter + 1) * cube.count_atoms(), :] = coord + shift
-				counter += 1
-	print 'Completed, %d atoms added.' % (cube.count_atoms() * 26)
-
-	images[-cube.count_atoms():] = coord
-
-	if args.periodic:
-		kdt = KDTree(images, leafsize=args.leafsize)
+	if args.hirshfeld:
+		vals = hirshfeld.hirshfeld_charges(cube, cutoff=args.cutoff, periodic=args.periodic, processes=args.processes)
+	elif args.partitioncache:
+		labels = partition.cached_labels(fcache.FileCache(), cube, coord, leafsize=args.leafsize, jobs=args.jobs,
+										 periodic=args.periodic)
+		vals = partition.apply_labels(cube, labels, cube.count_atoms(), processes=args.processes)
+		vals *= cube.get_voxel_volume()
 	else:
-		kdt = KDTree(coord, leafsize=args.leafsize)
-	vals = np.zeros(cube.count_atoms())
-	for x in range(cube.get_xlen()):
-		print x
-		for y in range(cube.get_ylen()):
-			for z in range(cube.get_zlen()):
-				d, i = kdt.query(cube.get_voxel_pos(x, y, z, centered=True))
-				i = i % cube.count_atoms()
-				vals[i] += cube.get_val(x, y, z)
+		vals = partition.wigner_seitz_sums(cube, coord, leafsize=args.leafsize, jobs=args.jobs, periodic=args.periodic,
+										   processes=args.processes)
+		vals *= cube.get_voxel_volume()
+	print 'Completed.'
 
 	print 'Results (atom - value)'
-	vals *= cube.get_voxel_volume()
 	for idx, val in enumerate(vals):
 		print idx, val
 
@@ -12,7 +12,7 @@ Command Line Interface
 
 .. option:: filename
 
-   The cubefile to read from. Both Bohr and Angstrom units are supported. May be gzipped.
+   The cubefile(s) to read from. Wildcards are expanded, so quoted patterns are possible for long file lists. Each file gives one column in the output. All files need to share the same grid. Both Bohr and Angstrom units are supported. May be gzipped. Unless --cache is given, the voxel data is summed while reading the file, so the memory requirements only depend on the number of slices.
 
 .. option:: index
 
@@ -30,24 +30,73 @@ Command Line Interface
 
    Whether to normalise the sum of the data points per number of points.
 
+.. option:: --cache
+
+   Whether to keep the parsed cube data in a binary cache and to reuse it on later runs. The cache directory defaults to ~/.cache/euston and may be set with the EUSTON_CACHE environment variable. EUSTON_CACHE_SIZE limits the total cache size in bytes (default: 4 GiB), least recently used entries are removed first.
+
+.. option:: --jobs
+
+   Number of processes to work on multiple files in parallel. Default: 1.
+
+.. option:: --statistics
+
+   Whether to add two columns with the mean and the standard deviation over all files.
+
 Implementation
 --------------
 """
 
 # system modules
 import argparse
+import glob
+import multiprocessing
+
+# third-party modules
+import numpy as np
 
 # custom modules
 import euston.io as io
 import euston.geometry as geom
 
 parser = argparse.ArgumentParser(description='Calculates the projection of the cube file contents on a lattice vector.')
-parser.add_argument('filename', type=str, help='The cube file.')
+parser.add_argument('filename', type=str, nargs='+', help='The cube file(s). Wildcards are expanded.')
 parser.add_argument('output', type=str, help='The output file name.')
 parser.add_argument('index', type=int, help='The axis index.')
 parser.add_argument('--absolute', action='store_true', help='Whether to sum absolute values or raw values.')
 parser.add_argument('--pervolume', action='store_true', help='Give projected value per slice volume.')
 parser.add_argument('--perpoint', action='store_true', help='Give projected value per data point in slice.')
+parser.add_argument('--cache', action='store_true', help='Reuse parsed cube data from the binary cache.')
+parser.add_argument('--jobs', type=int, default=1, help='Number of parallel processes for multiple files.')
+parser.add_argument('--statistics', action='store_true', help='Add mean and standard deviation over all files.')
+
+
+def expand_filenames(patterns):
+	"""
+	Expands wildcards in file names while keeping the order of the arguments.
+
+	:param patterns: File names or glob patterns.
+	:type patterns: List of strings
+	:return: List of file names.
+	"""
+	filenames = []
+	for pattern in patterns:
+		matches = sorted(glob.glob(pattern))
+		if len(matches) == 0:
+			matches = [pattern]
+		filenames += matches
+	return filenames
+
+
+def project_file(task):
+	"""
+	Projects a single cube file. Runs in worker processes for multiple files.
+
+	:param task: Tuple of file name, axis index, whether to use absolute values, whether to use the cache.
+	:return: Tuple of voxel count, H matrix and projection.
+	"""
+	filename, index, absolute, cache = task
+	cube = io.CubeFile(filename, cache=cache, stream=not cache)
+	return cube.count_voxels(), cube.get_h_matrix(), cube.get_projection(index, absolute)
 
 
 def main(parser):
@@ -60,37 +109,53 @@ def main(parser):
 
 	if args.index not in range(3):
 		raise ValueError('Axes index invalid.')
-
-	print 'Reading cubefile...                 ',
-	cube = io.CubeFile(args.filename)
-	print 'Completed, %d atoms %d voxels.      ' % (cube.count_atoms(), cube.count_voxels())
+	if args.jobs < 1:
+		raise ValueError('At least one job required.')
+
+	filenames = expand_filenames(args.filename)
+	tasks = [(filename, args.index, args.absolute, args.cache) for filename in filenames]
+	print 'Projecting %d cubefile(s)...         ' % len(filenames),
+	if args.jobs > 1 and len(tasks) > 1:
+		pool = multiprocessing.Pool(min(args.jobs, len(tasks)))
+		results = pool.map(project_file, tasks, chunksize=1)
+		pool.close()
+		pool.join()
+	else:
+		results = map(project_file, tasks)
+	voxelcount, h_mat, proj = results[0]
+	for filename, result in zip(filenames, results):
+		if result[0] != voxelcount or len(result[2]) != len(proj) or not np.allclose(result[1], h_mat):
+			raise ValueError('Incompatible grid in %s.' % filename)
+	print 'Completed, %d voxels each.' % voxelcount
 
 	print 'Calculating slice volume...         ',
-	h_mat = cube.get_h_matrix()
 	abc = geom.hmatrix_to_abc(h_mat)
-	if args.index == 0:
-		slicecount = cube.get_xlen()
-	elif args.index == 1:
-		slicecount = cube.get_ylen()
-	else:
-		slicecount = cube.get_zlen()
+	slicecount = len(proj)
 	slicevolume = geom.cell_volume(h_mat) / slicecount
 	print 'Completed, %d slices of %f Angstrom^3 each.' % (slicecount, slicevolume)
 
 	fh = open(args.output, 'w')
-	print 'Summing voxel along axis...         ',
-	proj = cube.get_projection(args.index, args.absolute)
+	print 'Normalising...                      ',
+	projs = np.array([_[2] for _ in results])
 	if args.pervolume:
 		fh.write('# Normalised by slice volume.\n')
-		proj /= slicevolume
+		projs /= slicevolume
 	if args.perpoint:
 		fh.write('# Normalised by data point count per slice.\n')
-		proj /= (cube.count_voxels() / len(proj))
+		projs /= (voxelcount / slicecount)
 	print 'Completed.'
 
-	fh.write('# index, centered bin position along cell vector, cube data unit per aforementioned units\n')
-	for idx, e in enumerate(proj):
-		fh.write('%d %f %f\n' % (idx, abc[args.index] / slicecount * (idx + 0.5), e))
+	columns = 'cube data unit per aforementioned units'
+	if len(filenames) > 1:
+		fh.write('# files: %s\n' % ' '.join(filenames))
+		columns = 'one column per file in %s' % columns
+	if args.statistics:
+		projs = np.vstack((projs, np.mean(projs, axis=0), np.std(projs, axis=0)))
+		columns += ', mean, standard deviation'
+	fh.write('# index, centered bin position along cell vector, %s\n' % columns)
+	for idx in range(slicecount):
+		values = ' '.join('%f' % _ for _ in projs[:, idx])
+		fh.write('%d %f %s\n' % (idx, abc[args.index] / slicecount * (idx + 0.5), values))
 	fh.close()
 
 
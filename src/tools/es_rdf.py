@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Calculates the RDF / g(r) averaged over frames, e.g. snapshots of an MD run, in periodic boundary conditions.
+
+Frames are read one at a time and only the distance histograms are kept. Each frame is normalized with its own cell
+volume, so NPT runs are supported. The cell is taken from a CP2K cell file with one line per frame or from a fixed H
+matrix or box specification. If none of them is given, the cell stored in the input file is used, if the format holds
+one.
+
+Command Line Interface
+----------------------
+
+.. program:: es_rdf.py
+
+.. option:: maxr
+
+   The maximum distance for the RDF.
+
+.. option:: input
+
+   Coordinate files, e.g. XYZ trajectories, plain or gzipped. Their frames are taken one after another.
+
+.. option:: --cell
+
+   CP2K cell file with one line per frame of all inputs.
+
+.. option:: --hmat
+
+   H matrix (cell vectors in columns) for all frames. Comma-separated in row-first notation without spaces.
+
+.. option:: --abc
+
+   a, b, c, alpha, beta, gamma for all frames. Comma-separated without spaces.
+
+.. option:: --radians
+
+   Whether angles in --abc are given in radians.
+
+.. option:: --bins
+
+   Number of histogram bins. Default: 1000.
+
+.. option:: --partials
+
+   Whether to print the partial RDF of every pair of atom labels after the total RDF.
+
+.. option:: --processes
+
+   Number of worker processes. Default: 1.
+
+.. option:: --start
+
+   Index of the first frame. Default: 0.
+
+.. option:: --stop
+
+   Index of the frame to stop before. Default: all frames.
+
+.. option:: --step
+
+   Stride between frames. Default: 1.
+
+.. option:: --index
+
+   Whether to keep a frame index next to XYZ trajectories. Frame selections and worker processes require the number of
+   frames, which takes one pass over the trajectories. With this option, the pass is only done once and later runs only
+   scan frames appended in the meantime. Gzipped trajectories are still decompressed in full by a single worker, the
+   index only saves counting their frames.
+
+Prints the bin centers and g(r), preceded by a comment line naming the columns.
+
+Implementation
+--------------
+"""
+
+# system modules
+import argparse
+
+# custom modules
+import euston.io as io
+import euston.geometry as geo
+import euston.rdf as rdf
+
+parser = argparse.ArgumentParser(description='Calculates the RDF / g(r) averaged over frames.')
+parser.add_argument('maxr', type=float, help='The maximum distance for the RDF.')
+parser.add_argument('input', type=str, nargs='+', help='Coordinate files, e.g. XYZ trajectories.')
+parser.add_argument('--cell', type=str, help='CP2K cell file with one line per frame of all inputs.')
+parser.add_argument('--hmat', type=str,
+					help='H matrix (cell vectors in columns). Comma-separated in row-first notation without spaces.')
+parser.add_argument('--abc', type=str, help='a, b, c, alpha, beta, gamma. Comma-separated without spaces.')
+parser.add_argument('--radians', action='store_true', help='Whether angles in --abc are given in radians.')
+parser.add_argument('--bins', type=int, default=rdf.RDF_BINS, help='Number of histogram bins.')
+parser.add_argument('--partials', action='store_true', help='Whether to print partial RDFs per pair of labels.')
+parser.add_argument('--processes', type=int, default=1, help='Number of worker processes.')
+parser.add_argument('--start', type=int, default=0, help='Index of the first frame.')
+parser.add_argument('--stop', type=int, help='Index of the frame to stop before.')
+parser.add_argument('--step', type=int, default=1, help='Stride between frames.')
+parser.add_argument('--index', action='store_true', help='Whether to keep a frame index next to XYZ trajectories.')
+parser.add_argument('--skin', type=float, default=0.,
+					help='Neighbour list skin in Angstrom. Speeds up unwrapped trajectories only.')
+
+
+def main(parser):
+	"""
+	Main routine wrapper.
+
+	:param argparse.ArgumentParser parser: Argument parser
+	"""
+	args = parser.parse_args()
+
+	if len([_ for _ in (args.cell, args.hmat, args.abc) if _ is not None]) > 1:
+		print 'Please specify at most one of --cell, --hmat and --abc.'
+		exit(1)
+
+	# cell for every frame, None if taken from the input file
+	h_matrices = None
+	if args.cell is not None:
+		h_matrices = list(io.Cp2kCell(args.cell).get_h_matrices())
+
+	if args.hmat is not None:
+		try:
+			h_matrices = geo.Cell.from_string(args.hmat)
+		except ValueError as e:
+			print e
+			exit(2)
+
+	if args.abc is not None:
+		try:
+			h_matrices = geo.Cell.from_string(args.abc, abc=True, degrees=(not args.radians))
+		except ValueError as e:
+			print e
+			exit(5 if len(args.abc.split(',')) != 6 else 3)
+
+	if args.processes < 1 or args.start < 0 or args.step < 1 or (args.stop is not None and args.stop < 0):
+		print 'Invalid number of processes or frame selection.'
+		exit(4)
+
+	try:
+		accumulator = rdf.trajectory_rdf(args.input, args.maxr, bins=args.bins, h_matrices=h_matrices,
+										 processes=args.processes, start=args.start, stop=args.stop, step=args.step,
+										 index=args.index, skin=args.skin)
+	except ValueError as e:
+		print e
+		exit(7)
+
+	columns = [('total', accumulator.get_rdf())]
+	if args.partials:
+		species = accumulator.get_species()
+		for i, first in enumerate(species):
+			for second in species[i:]:
+				columns.append(('%s-%s' % (first, second), accumulator.get_rdf(first, second)))
+
+	edges = accumulator.get_edges()
+	bins = (edges[1:] + edges[:-1]) / 2
+	print '# r %s' % ' '.join([_[0] for _ in columns])
+	for i, b in enumerate(bins):
+		print b, ' '.join(['%g' % _[1][i] for _ in columns])
+
+if __name__ == '__main__':
+	main(parser)
@@ -16,8 +16,11 @@ Command Line Interface
 
 .. option:: output
 
-   The cubefile to save to.
+   The cubefile to save to. Written gzipped if the name ends in .gz or .gzip.
 
+.. option:: --cache
+
+   Whether to reuse parsed cube data from the binary cache. See :option:`es_projectcube.py --cache`.
 
 Implementation
 --------------
@@ -34,6 +37,7 @@ import euston.geometry as geom
 parser = argparse.ArgumentParser(description='Wraps all coordinates in a cube file back into the system cell.')
 parser.add_argument('filename', type=str, help='The cube file.')
 parser.add_argument('output', type=str, help='The output file name.')
+parser.add_argument('--cache', action='store_true', help='Reuse parsed cube data from the binary cache.')
 
 
 def main(parser):
@@ -45,19 +49,19 @@ def main(parser):
 	args = parser.parse_args()
 
 	print 'Reading cubefile...                 ',
-	cube = io.CubeFile(args.filename)
+	cube = io.CubeFile(args.filename, cache=args.cache)
 	print 'Completed, %d atoms %d voxels.      ' % (cube.count_atoms(), cube.count_voxels())
 
 	print 'Wrapping atom coordinates..         ',
 	h_mat = cube.get_h_matrix()
 	scaled = geom.cartesian_to_scaled_coordinates(cube.get_coordinates(), h_mat)
-	scaled = np.mod(scaled, 1)
-	coord = geom.scaled_to_cartesian_coordinates(scaled, h_mat)
+	np.mod(scaled, 1, out=scaled)
+	coord = geom.scaled_to_cartesian_coordinates(scaled, h_mat, inplace=True)
 	cube.set_coordinates(coord)
 	print 'Completed.'
 
 	print 'Writing data to new cube file...    ',
-	io.write_lines(args.output, cube.to_string())
+	cube.write(args.output)
 	print 'Completed.'
 
 
@@ -0,0 +1,16 @@
+import numpy as np
+
+
+def grid_cube(nvoxel=(6, 5, 4), skew=0., offset=0.):
+	"""Cube file content of a small triclinic grid with three atoms and smoothly varying voxel values.
+
+	:param nvoxel: Number of voxels along each axis.
+	:param skew: Component of the second voxel vector along the first axis.
+	:param offset: Value added to all voxel values.
+	"""
+	count = np.prod(nvoxel)
+	lines = ['HEADER 1', 'HEADER 2', '3 0.5 0 0', '%d 1 0 0' % nvoxel[0], '%d %r 1.2 0' % (nvoxel[1], skew)]
+	lines += ['%d 0 0.3 1' % nvoxel[2], '1 0 1 2 3', '8 0 4 1 1', '6 0 2 5 3']
+	values = ['%f' % (offset + np.sin(_)) for _ in range(count)]
+	lines += [' '.join(values[start:start + 6]) for start in range(0, count, 6)]
+	return '\n'.join(lines)
@@ -1,8 +1,13 @@
 import unittest
 
 import StringIO
+import gzip
+import os
+import shutil
+import tempfile
 import numpy as np
-from euston.io import XYZ
+import euston.io as io
+from euston.io import XYZ, XYZTrajectory
 
 simple1 = '''2
 COMMENT
@@ -10,6 +15,14 @@ C 1 2 3
 H 4 5 6'''
 
 
+def _frames(first, last):
+	frames = []
+	for i in range(first, last):
+		lines = [str(i % 3 + 1), 'frame %d' % i] + ['C %d %d %d' % (i, j, j) for j in range(i % 3 + 1)]
+		frames.append('\n'.join(lines) + '\n')
+	return frames
+
+
 class TestXYZ(unittest.TestCase):
 	def test_create(self):
 		fh = StringIO.StringIO(simple1)
@@ -76,4 +89,140 @@ class TestXYZ(unittest.TestCase):
 
 		ref = np.linspace(1, 6, 6).reshape((2, 3))
 		xyz.set_data(['C', 'C'], ref)
-		self.assertRaises(ValueError, xyz.set_data, ['C', ], ref)
\ No newline at end of file
+		self.assertRaises(ValueError, xyz.set_data, ['C', ], ref)
+
+	def test_dtype(self):
+		xyz = XYZ(filehandle=StringIO.StringIO(simple1), dtype=np.float32)
+		self.assertEqual(np.float32, xyz.get_coordinates().dtype)
+		ref = np.linspace(1, 6, 6).reshape((2, 3))
+		self.assertTrue(np.all(xyz.get_coordinates() == ref))
+
+	def test_trajectory(self):
+		frames = [simple1.replace('COMMENT', 'frame %d' % i).replace('C 1', 'C %d' % i) for i in range(7)]
+		trajectory = XYZTrajectory(filehandle=StringIO.StringIO('\n'.join(frames) + '\n\n'))
+		self.assertEqual(7, trajectory.count_frames())
+		comments = [_[2] for _ in trajectory.iter_frames()]
+		self.assertEqual(['frame %d' % i for i in range(7)], comments)
+
+		selected = [(_[0], _[1].copy(), _[2]) for _ in trajectory.iter_frames(start=1, stop=6, step=2)]
+		self.assertEqual(['frame 1', 'frame 3', 'frame 5'], [_[2] for _ in selected])
+		self.assertEqual(['C', 'H'], selected[0][0])
+		self.assertTrue(np.allclose([[3, 2, 3], [4, 5, 6]], selected[1][1]))
+
+		buffers = [id(_[1]) for _ in trajectory.iter_frames(reuse=True)]
+		self.assertEqual(1, len(set(buffers)))
+		self.assertRaises(ValueError, list, trajectory.iter_frames(step=0))
+
+	def test_trajectoryerrors(self):
+		trajectory = XYZTrajectory(filehandle=StringIO.StringIO(simple1 + '\nx\ncorrupt\nC 1 2 3\n'))
+		self.assertRaises(ValueError, list, trajectory.iter_frames())
+		# frames are only checked when read
+		self.assertEqual(1, len(list(trajectory.iter_frames(stop=1))))
+		trajectory = XYZTrajectory(filehandle=StringIO.StringIO(simple1 + '\n2\ncorrupt\nC 1 2 3\nC 1 2 a\n'))
+		self.assertRaises(ValueError, list, trajectory.iter_frames())
+		trajectory = XYZTrajectory(filehandle=StringIO.StringIO(simple1.replace('C 1 2 3', 'C 1 2') + '\n'))
+		self.assertRaises(ValueError, list, trajectory.iter_frames())
+		trajectory = XYZTrajectory(filehandle=StringIO.StringIO(simple1.replace('C 1 2 3', 'C 1 2 a') + '\n'))
+		self.assertRaises(ValueError, list, trajectory.iter_frames())
+
+		# last line flushed in the middle of a number while the file is being written
+		trajectory = XYZTrajectory(filehandle=StringIO.StringIO(''.join(_frames(0, 3)) + '2\nframe 3\nC 0 0 0\nH 1 1 0.5'))
+		self.assertEqual(['frame 0', 'frame 1', 'frame 2'], [_[2] for _ in trajectory.iter_frames()])
+		self.assertEqual(3, trajectory.count_frames())
+		# atom lines not written yet
+		trajectory = XYZTrajectory(filehandle=StringIO.StringIO(''.join(_frames(0, 3)) + '2\nframe 3\nC 0 0 0\n'))
+		self.assertEqual(3, trajectory.count_frames())
+
+	def test_frameindex(self):
+		directory = tempfile.mkdtemp()
+		try:
+			filename = os.path.join(directory, 'pos.xyz')
+			with open(filename, 'w') as fh:
+				fh.write(''.join(_frames(0, 50)))
+			trajectory = XYZTrajectory(filename, index=True)
+			self.assertTrue(os.path.exists(filename + io.FRAME_INDEX_SUFFIX))
+			self.assertEqual(50, len(trajectory))
+			self.assertEqual('frame 42', trajectory[42][2])
+			self.assertEqual('frame 49', trajectory[-1][2])
+			self.assertTrue(np.allclose([[17, 0, 0], [17, 1, 1], [17, 2, 2]], trajectory[17][1]))
+			self.assertEqual(['frame %d' % i for i in range(10, 40, 7)], [_[2] for _ in trajectory[10:40:7]])
+			self.assertRaises(IndexError, trajectory.__getitem__, 50)
+			trajectory.close()
+
+			# reused as long as the file is unchanged
+			self.assertFalse(io.FrameIndex(filename).update())
+
+			# growing file with a partially written last frame
+			with open(filename, 'a') as fh:
+				fh.write(''.join(_frames(50, 60)) + '3\nframe 60\nC 1 2 3\n')
+			trajectory = XYZTrajectory(filename, index=True)
+			self.assertEqual(60, len(trajectory))
+			with open(filename, 'a') as fh:
+				fh.write('C 1 2 3\nC 1 2 3\n')
+			self.assertEqual(61, trajectory.refresh())
+			self.assertEqual('frame 60', trajectory[60][2])
+			rebuilt = io.FrameIndex(filename, persistent=False)
+			rebuilt.update()
+			self.assertEqual(rebuilt.get_offsets().tolist(), io.FrameIndex(filename).get_offsets().tolist())
+
+			# rewritten file
+			with open(filename, 'w') as fh:
+				fh.write(''.join(_frames(5, 8)))
+			trajectory = XYZTrajectory(filename, index=True)
+			self.assertEqual(['frame 5', 'frame 6', 'frame 7'], [_[2] for _ in trajectory.iter_frames()])
+			self.assertRaises(ValueError, XYZTrajectory, filehandle=StringIO.StringIO(simple1), index=True)
+
+			# rewritten file that is larger than before is not extended from the stale offsets
+			with open(filename, 'w') as fh:
+				fh.write(''.join(_frames(0, 3)) + ''.join(_frames(10, 12)))
+			trajectory = XYZTrajectory(filename, index=True)
+			self.assertEqual(['frame 0', 'frame 1', 'frame 2', 'frame 10', 'frame 11'], [_[2] for _ in trajectory[:]])
+
+			# corrupt frames raise instead of ending the index
+			with open(filename, 'a') as fh:
+				fh.write('x\nframe 12\nC 1 2 3\n' + ''.join(_frames(13, 15)))
+			self.assertRaises(ValueError, XYZTrajectory, filename, index=True)
+			self.assertRaises(ValueError, io.FrameIndex(filename, persistent=False).update)
+
+			# frame flushed in the middle of a line
+			filename = os.path.join(directory, 'flushed.xyz')
+			with open(filename, 'w') as fh:
+				fh.write(''.join(_frames(0, 5)) + '2\nframe 5\nC 5 0 0\nH 1 1')
+			trajectory = XYZTrajectory(filename, index=True)
+			self.assertEqual(5, len(trajectory))
+			with open(filename, 'a') as fh:
+				fh.write(' 1\n' + ''.join(_frames(6, 10)))
+			self.assertEqual(10, trajectory.refresh())
+			self.assertEqual(['frame %d' % i for i in range(10)], [_[2] for _ in trajectory.iter_frames()])
+			self.assertTrue(np.allclose([[1, 1, 1]], trajectory[5][1][1:]))
+		finally:
+			shutil.rmtree(directory)
+
+	def test_frameindexgzip(self):
+		directory = tempfile.mkdtemp()
+		spacing, chunk = io.GZIP_CHECKPOINT_BYTES, io.GZIP_CHUNK_BYTES
+		io.GZIP_CHECKPOINT_BYTES, io.GZIP_CHUNK_BYTES = 300, 64
+		try:
+			# multi-member file as written by appending to gzip files
+			filename = os.path.join(directory, 'pos.xyz.gz')
+			for first, last in ((0, 100), (100, 200)):
+				with gzip.open(filename, 'ab') as fh:
+					fh.write(''.join(_frames(first, last)))
+			trajectory = XYZTrajectory(filename, index=True)
+			self.assertEqual(200, len(trajectory))
+			for i in (150, 3, 199, 4, 5, 100, 99):
+				self.assertEqual('frame %d' % i, trajectory[i][2])
+			self.assertEqual(['frame %d' % i for i in range(1, 200, 33)], [_[2] for _ in trajectory[1::33]])
+			trajectory.close()
+
+			# checkpoints are rebuilt after loading the index, only up to the frames accessed
+			trajectory = XYZTrajectory(filename, index=True)
+			self.assertEqual('frame 0', trajectory[0][2])
+			self.assertEqual(1, len(trajectory._index._checkpoints))
+			self.assertTrue(np.allclose([[120, 0, 0]], trajectory[120][1]))
+			self.assertEqual('frame 7', trajectory[7][2])
+			self.assertEqual(['frame %d' % i for i in range(199, 0, -19)], [trajectory[i][2] for i in range(199, 0, -19)])
+			trajectory.close()
+		finally:
+			io.GZIP_CHECKPOINT_BYTES, io.GZIP_CHUNK_BYTES = spacing, chunk
+			shutil.rmtree(directory)
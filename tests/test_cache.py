@@ -0,0 +1,136 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from euston.cache import FileCache
+from euston.io import CubeFile
+
+simple5 = '''HEADER 1
+HEADER 2
+1 0 0 0
+-2 1 0 0
+-2 0 1 0
+-1 0 0 1
+12 0 1 2 3
+1 -2 3 -4
+'''
+
+
+class TestFileCache(unittest.TestCase):
+	def setUp(self):
+		self._directory = tempfile.mkdtemp()
+		self._cachedir = os.path.join(self._directory, 'cache')
+		self._source = os.path.join(self._directory, 'simple.cube')
+		self._write_source(simple5)
+
+	def tearDown(self):
+		shutil.rmtree(self._directory)
+
+	def _write_source(self, content):
+		fh = open(self._source, 'w')
+		fh.write(content)
+		fh.close()
+
+	def test_roundtrip(self):
+		cache = FileCache(self._cachedir)
+		self.assertEqual(None, cache.load(self._source))
+		cache.store(self._source, {'value': np.array([1, 2])}, np.arange(4.))
+		meta, data = cache.load(self._source)
+		self.assertTrue(np.all(meta['value'] == np.array([1, 2])))
+		self.assertTrue(np.all(data == np.arange(4.)))
+
+	def test_stale(self):
+		cache = FileCache(self._cachedir)
+		cache.store(self._source, {}, np.arange(4.))
+		self._write_source(simple5 + ' ')
+		self.assertEqual(None, cache.load(self._source))
+		self.assertEqual([], os.listdir(self._cachedir))
+
+	def test_eviction(self):
+		other = os.path.join(self._directory, 'other.cube')
+		shutil.copy(self._source, other)
+
+		cache = FileCache(self._cachedir, max_size=0)
+		cache.store(self._source, {}, np.arange(4.))
+		self.assertNotEqual(None, cache.load(self._source))
+		cache.store(other, {}, np.arange(4.))
+		self.assertEqual(None, cache.load(self._source))
+		self.assertNotEqual(None, cache.load(other))
+
+	def test_leastrecentlyused(self):
+		other = os.path.join(self._directory, 'other.cube')
+		shutil.copy(self._source, other)
+
+		cache = FileCache(self._cachedir)
+		cache.store(self._source, {}, np.arange(1000.))
+		cache.store(other, {}, np.arange(1000.))
+		for name in os.listdir(self._cachedir):
+			os.utime(os.path.join(self._cachedir, name), (time.time() - 100, time.time() - 100))
+		cache.load(self._source)
+		size = sum(os.path.getsize(os.path.join(self._cachedir, _)) for _ in os.listdir(self._cachedir))
+		cache = FileCache(self._cachedir, max_size=size - 1)
+		cache.evict()
+		self.assertNotEqual(None, cache.load(self._source))
+		self.assertEqual(None, cache.load(other))
+
+	def test_temporary(self):
+		cache = FileCache(self._cachedir)
+		cache.store(self._source, {}, np.arange(1000.))
+		size = sum(os.path.getsize(os.path.join(self._cachedir, _)) for _ in os.listdir(self._cachedir))
+		for name, age in (('stale.tmp', 3600), ('pending.tmp', 0)):
+			path = os.path.join(self._cachedir, name)
+			with open(path, 'wb') as fh:
+				fh.write(' ' * 10000)
+			os.utime(path, (time.time() - age, time.time() - age))
+
+		# temporary files neither count towards the limit nor stay forever
+		cache = FileCache(self._cachedir, max_size=size)
+		cache.evict()
+		self.assertNotEqual(None, cache.load(self._source))
+		self.assertFalse(os.path.exists(os.path.join(self._cachedir, 'stale.tmp')))
+		self.assertTrue(os.path.exists(os.path.join(self._cachedir, 'pending.tmp')))
+
+	def test_invalidsize(self):
+		self.assertRaises(ValueError, FileCache, self._cachedir, -1)
+
+	def test_cubefile(self):
+		cache = FileCache(self._cachedir)
+		cube = CubeFile(self._source, cache=cache)
+		self.assertEqual(2, len(os.listdir(self._cachedir)))
+		cached = CubeFile(self._source, cache=cache)
+		self.assertEqual(None, cached._fh)
+		self.assertTrue(np.all(cube._data == cached._data))
+		self.assertTrue(np.allclose(cube.get_coordinates(), cached.get_coordinates()))
+		self.assertTrue(np.allclose(cube.get_h_matrix(), cached.get_h_matrix()))
+		self.assertEqual(cube.count_atoms(), cached.count_atoms())
+		self.assertEqual(cube.to_string(), cached.to_string())
+
+	def test_lazy(self):
+		cache = FileCache(self._cachedir)
+		cube = CubeFile(self._source)
+		for attempt in range(2):
+			lazy = CubeFile(self._source, cache=cache, lazy=True)
+			self.assertTrue(isinstance(lazy.get_data(), np.memmap))
+			self.assertTrue(np.all(cube.get_data() == lazy.get_data()))
+			self.assertEqual(cube.get_val(1, 0, 0), lazy.get_val(1, 0, 0))
+			for axis in range(3):
+				self.assertTrue(np.allclose(cube.get_projection(axis, True), lazy.get_projection(axis, True)))
+				self.assertTrue(np.allclose(cube.get_projection(axis, True), lazy.get_projection(axis, True, processes=2)))
+		self.assertRaises(ValueError, lazy.get_data().__setitem__, (0, 0, 0), 1)
+
+		eager = CubeFile(self._source, cache=cache)
+		self.assertFalse(isinstance(eager.get_data(), np.memmap))
+		self.assertRaises(ValueError, CubeFile, filehandle=open(self._source), lazy=True)
+
+	def test_dtype(self):
+		cache = FileCache(self._cachedir)
+		CubeFile(self._source, cache=cache)
+		cube = CubeFile(self._source, cache=cache, dtype=np.float32)
+		self.assertNotEqual(None, cube._fh)
+		self.assertEqual(np.float32, cube.get_data().dtype)
+		cube = CubeFile(self._source, cache=cache, dtype=np.float32)
+		self.assertEqual(None, cube._fh)
+		self.assertEqual(np.float32, cube.get_data().dtype)
@@ -0,0 +1,92 @@
+import unittest
+import os
+import gzip
+import shutil
+import tempfile
+
+import euston.catalog as catalog
+
+simple5 = '''HEADER 1
+HEADER 2
+1 0 0 0
+-2 1 0 0
+-2 0 1 0
+-1 0 0 1
+12 0 1 2 3
+1 -2 3 -4
+'''
+
+simple4 = '''HEADER 1
+HEADER 2
+1 0 0 0
+1 1 0 0
+-1 0 1 0
+1 0 0 1
+12 0 1 2 3
+1
+'''
+
+
+class TestCatalog(unittest.TestCase):
+	def setUp(self):
+		self._directory = tempfile.mkdtemp()
+		os.mkdir(os.path.join(self._directory, 'sub'))
+		self._write('a.cube', simple5)
+		self._write('sub/b.cube', simple5)
+		self._write('sub/c.cube', simple4)
+		self._write('broken.cube', 'HEADER 1\n')
+		self._write('notes.txt', 'not a cube file')
+		fh = gzip.open(os.path.join(self._directory, 'd.cube.gz'), 'w')
+		fh.write(simple5)
+		fh.close()
+
+	def tearDown(self):
+		shutil.rmtree(self._directory)
+
+	def _write(self, name, content):
+		with open(os.path.join(self._directory, name), 'w') as fh:
+			fh.write(content)
+
+	def _path(self, name):
+		return os.path.join(self._directory, name)
+
+	def test_readheader(self):
+		header = catalog.read_header(self._path('a.cube'))
+		self.assertEqual(1, header['natoms'])
+		self.assertEqual([2, 2, 1], header['nvoxel'])
+		self.assertEqual(len(simple5), header['size'])
+
+	def test_update(self):
+		index = catalog.CubeCatalog()
+		errors = index.update(self._directory)
+		self.assertEqual([self._path('broken.cube')], errors.keys())
+		self.assertEqual(4, len(index))
+		self.assertTrue(self._path('sub/c.cube') in index)
+		self.assertFalse(self._path('notes.txt') in index)
+
+		os.remove(self._path('sub/b.cube'))
+		index.update(self._directory)
+		self.assertEqual(3, len(index))
+
+	def test_parallel(self):
+		index = catalog.CubeCatalog()
+		index.update(self._directory, jobs=2)
+		self.assertEqual(4, len(index))
+		self.assertEqual([2, 2, 1], index.get(self._path('d.cube.gz'))['nvoxel'])
+
+	def test_save(self):
+		filename = self._path('index.json')
+		index = catalog.CubeCatalog(filename)
+		index.update(self._directory)
+		index.save()
+		loaded = catalog.CubeCatalog(filename)
+		self.assertEqual(index.get_filenames(), loaded.get_filenames())
+		self.assertEqual(index.get(self._path('a.cube')), loaded.get(self._path('a.cube')))
+
+	def test_groups(self):
+		index = catalog.CubeCatalog()
+		index.update(self._directory)
+		groups = index.group_compatible()
+		self.assertEqual(2, len(groups))
+		self.assertEqual(sorted([self._path('a.cube'), self._path('sub/b.cube'), self._path('d.cube.gz')]), groups[0])
+		self.assertEqual([self._path('sub/c.cube')], groups[1])
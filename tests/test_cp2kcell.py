@@ -0,0 +1,20 @@
+import unittest
+
+import StringIO
+import numpy as np
+from euston.io import Cp2kCell
+
+cellfile = '''#   Step   Time [fs]       Ax [Angstrom]       Ay [Angstrom]       Az [Angstrom]       Bx [Angstrom]       By [Angstrom]       Bz [Angstrom]       Cx [Angstrom]       Cy [Angstrom]       Cz [Angstrom]      Volume [Angstrom^3]
+       0        0.000       10.0 0.0 0.0 1.0 11.0 0.0 0.0 0.0 12.0 1320.0
+      10        5.000       10.5 0.0 0.0 1.0 11.0 0.0 0.0 0.0 12.0 1386.0
+'''
+
+
+class TestCp2kCell(unittest.TestCase):
+	def test_parse(self):
+		cells = Cp2kCell(filehandle=StringIO.StringIO(cellfile))
+		self.assertEqual(2, cells.count_frames())
+		self.assertEqual([0, 10], cells.get_steps().tolist())
+		self.assertTrue(np.allclose([1, 11, 0], cells.get_h_matrices()[0][:, 1]))
+		self.assertTrue(np.allclose([1320, 1386], cells.get_volumes()))
+		self.assertRaises(ValueError, Cp2kCell, filehandle=StringIO.StringIO('0 0 1 2 3'))
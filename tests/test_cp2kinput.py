@@ -77,6 +77,8 @@ class TestCp2kInput(unittest.TestCase):
 		self.assertTrue(np.allclose(a, np.array([4, 0, 0])))
 		self.assertTrue(np.allclose(b, np.array([0, 5, 0])))
 		self.assertTrue(np.allclose(c, np.array([0, 0, 6])))
+		self.assertTrue(np.allclose(a, cp2k.get_cell_vectors()[0]))
+		self.assertAlmostEqual(120., cp2k.get_cell().get_volume())
 
 	def test_tostring(self):
 		cp2k = Cp2kInput()
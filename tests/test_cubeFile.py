@@ -1,8 +1,12 @@
 from unittest import TestCase
 
 import StringIO
+import gzip
+import os
+import tempfile
 import numpy as np
-from euston.io import CubeFile
+import euston.io as io
+from euston.io import CubeFile, read_values
 
 simple = '''HEADER 1
 HEADER 2
@@ -53,6 +57,17 @@ adv1 = '''-Quickstep-
   '''
 adv1 += '1 ' * 1000
 
+#: adv1 as written by the original to_string implementation
+adv1_written = '''-Quickstep-
+HARTREE POTENTIAL
+1 0.000000e+00 0.000000e+00 0.000000e+00
+10 0.154626 0.000154 0.004382
+10 -0.077234 0.134457 -0.001403
+10 0.004438 0.000880 0.155833
+1 0 0.000000 0.000000 0.000000
+'''
+adv1_written += (' '.join(['1.000000e+00'] * 5) + '\n') * 200 + '\n'
+
 simple5 = '''HEADER 1
 HEADER 2
 1 0 0 0
@@ -111,6 +126,18 @@ class TestCubeFile(TestCase):
 		pos = cube.get_voxel_pos(0, 0, 0, centered=False)
 		self.assertTrue((pos == ref).all())
 
+		# relative to the first voxel unless requested otherwise
+		cube = CubeFile(filehandle=StringIO.StringIO(self._indexed_cube()))
+		self.assertTrue(np.allclose([1, 2, 3], cube.get_voxel_pos(1, 1, 1)))
+		self.assertTrue(np.allclose([2, 4, 6], cube.get_voxel_pos(1, 1, 1, origin=True)))
+
+	def test_get_voxel_positions(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(self._indexed_cube()))
+		positions = cube.get_voxel_positions(5, 50, centered=True)
+		for offset, pos in enumerate(positions):
+			x, y, z = np.unravel_index(5 + offset, (4, 5, 6))
+			self.assertTrue(np.allclose(pos, cube.get_voxel_pos(x, y, z, centered=True, origin=True)))
+
 	def test_units(self):
 		fh = StringIO.StringIO(simple4)
 		cube = CubeFile(filehandle=fh)
@@ -136,6 +163,8 @@ class TestCubeFile(TestCase):
 						[2.31885453e-02, -7.42435626e-03, 8.24632722e-01]])
 		for val in np.ravel(np.abs(h_mat - ref)):
 			self.assertAlmostEqual(val, 0)
+		self.assertTrue(np.allclose(ref, cube.get_cell().get_h_matrix()))
+		self.assertAlmostEqual(np.linalg.det(ref), cube.get_cell().get_volume())
 
 	def test_stringrepresentation(self):
 		fh = StringIO.StringIO(simple4)
@@ -189,6 +218,12 @@ class TestCubeFile(TestCase):
 		self.assertEqual(cube.get_projection(0, absolute=False)[0], -1)
 		self.assertEqual(cube.get_projection(0, absolute=True)[1], 7)
 
+		cube = CubeFile(filehandle=StringIO.StringIO(self._indexed_cube()))
+		for axis in range(3):
+			for absolute in (False, True):
+				reference = cube.get_projection(axis, absolute)
+				self.assertTrue(np.allclose(reference, cube.get_projection(axis, absolute, processes=2)))
+
 	def test_parse(self):
 		fh = StringIO.StringIO(' ')
 		self.assertRaises(ValueError, CubeFile, filehandle=fh)
@@ -217,3 +252,140 @@ class TestCubeFile(TestCase):
 
 		fh = StringIO.StringIO(simple3)
 		self.assertRaises(IndexError, CubeFile, filehandle=fh)
+
+	def test_readvalues_blocks(self):
+		text = '1 2 3\n4 5\n6\n7 8 9 10\n'
+		ref = np.arange(1, 11)
+		for blocksize in (1, 3, 7, 1000):
+			out = read_values(StringIO.StringIO(text), np.zeros(10), blocksize=blocksize)
+			self.assertTrue(np.all(out == ref))
+		out = read_values(iter(text.splitlines(True)), np.zeros(10), divisor=2, blocksize=200)
+		self.assertTrue(np.all(out == ref / 2.))
+		self.assertRaises(ValueError, read_values, StringIO.StringIO(text), np.zeros(11))
+		self.assertRaises(IndexError, read_values, StringIO.StringIO(text), np.zeros(9))
+
+	def test_readvalues_invalid(self):
+		for text in ('1 2 3\n4 x5\n6 7 8 9 10\n', '1 2 3\n4 5,5 6 7 8 9 10\n', '1 2 3 4 5 6 7 8 9 1,0'):
+			for blocksize in (1, 1000):
+				with self.assertRaises(ValueError) as context:
+					read_values(StringIO.StringIO(text), np.zeros(10), blocksize=blocksize)
+				self.assertIn('Invalid voxel value', str(context.exception))
+
+	def test_gzip(self):
+		fd, filename = tempfile.mkstemp(suffix='.cube.gz')
+		os.close(fd)
+		try:
+			fh = gzip.open(filename, 'wb')
+			fh.write(simple5)
+			fh.close()
+			cube = CubeFile(filename)
+			ref = CubeFile(filehandle=StringIO.StringIO(simple5))
+			self.assertTrue(np.allclose(cube._data, ref._data))
+		finally:
+			os.remove(filename)
+
+	def test_write(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(adv1))
+		expected = adv1_written
+		self.assertEqual(expected, '\n'.join(cube.to_string()) + '\n')
+
+		blocksize = io.VALUE_BLOCK_SIZE
+		io.VALUE_BLOCK_SIZE = 100
+		try:
+			fh = StringIO.StringIO()
+			cube.write(fh)
+			self.assertEqual(expected, fh.getvalue())
+		finally:
+			io.VALUE_BLOCK_SIZE = blocksize
+
+		fd, filename = tempfile.mkstemp(suffix='.cube.gz')
+		os.close(fd)
+		try:
+			cube.write(filename)
+			self.assertEqual(expected, gzip.open(filename).read())
+			cube.write(filename, compress=False)
+			self.assertEqual(expected, open(filename).read())
+		finally:
+			os.remove(filename)
+
+	def test_stream(self):
+		ref = CubeFile(filehandle=StringIO.StringIO(adv1))
+		for axis in range(3):
+			for absolute in (True, False):
+				cube = CubeFile(filehandle=StringIO.StringIO(adv1), stream=True)
+				self.assertEqual(1000, cube.count_voxels())
+				self.assertTrue(np.allclose(ref.get_projection(axis, absolute), cube.get_projection(axis, absolute)))
+				self.assertRaises(AssertionError, cube.get_projection, axis, absolute)
+
+		fh = StringIO.StringIO(simple5)
+		cube = CubeFile(filehandle=fh, stream=True)
+		self.assertTrue(np.all(np.concatenate(list(cube.iter_voxels(blocksize=4))) == np.array([1, -2, 3, -4])))
+		self.assertTrue(fh.closed)
+		fh = StringIO.StringIO(simple5)
+		blocks = CubeFile(filehandle=fh, stream=True).iter_voxels(blocksize=4)
+		next(blocks)
+		blocks.close()
+		self.assertTrue(fh.closed)
+		cube = CubeFile(filehandle=StringIO.StringIO(simple5))
+		self.assertEqual(4, len(list(cube.iter_voxels(blocksize=8))))
+
+		fh = StringIO.StringIO(simple3)
+		cube = CubeFile(filehandle=fh, stream=True)
+		self.assertRaises(IndexError, list, cube.iter_voxels())
+		self.assertTrue(fh.closed)
+		self.assertRaises(ValueError, CubeFile, filehandle=StringIO.StringIO(simple5), stream=True, cache=True)
+
+	def _indexed_cube(self):
+		lines = ['HEADER 1', 'HEADER 2', '1 1 2 3', '-4 1 0 0', '-5 0 2 0', '-6 0 0 3', '12 0 1 2 3']
+		lines += [' '.join(map(str, range(start, min(start + 7, 120)))) for start in range(0, 120, 7)]
+		return '\n'.join(lines)
+
+	def test_region(self):
+		full = CubeFile(filehandle=StringIO.StringIO(self._indexed_cube()))
+		sub = CubeFile(filehandle=StringIO.StringIO(self._indexed_cube()), region=[(1, 3), (0, 4), (2, 6)],
+					   stride=[1, 2, 3])
+		self.assertEqual((2, 2, 2), sub.get_data().shape)
+		self.assertTrue(np.all(full.get_data()[1:3, 0:4:2, 2:6:3] == sub.get_data()))
+		self.assertTrue(np.allclose(full.get_voxel_pos(2, 2, 5, origin=True), sub.get_voxel_pos(1, 1, 1, origin=True)))
+		self.assertTrue(np.allclose(np.array([1, 2, 3]), full.get_voxel_pos(0, 0, 0, origin=True)))
+		self.assertTrue(np.allclose(np.diag([2, 8, 18]), sub.get_h_matrix()))
+		self.assertEqual(8, sub.count_voxels())
+
+		# written sub-grid keeps its position
+		copy = CubeFile(filehandle=StringIO.StringIO('\n'.join(sub.to_string())))
+		self.assertTrue(np.allclose(full.get_voxel_pos(1, 0, 2, origin=True), copy.get_voxel_pos(0, 0, 0, origin=True)))
+
+		# strided full axes keep the periodic cell
+		sub = CubeFile(filehandle=StringIO.StringIO(self._indexed_cube()), stride=np.array([2, 5, 3]))
+		self.assertTrue(np.all(full.get_data()[::2, ::5, ::3] == sub.get_data()))
+		self.assertTrue(np.allclose(full.get_h_matrix(), sub.get_h_matrix()))
+		sub = CubeFile(filehandle=StringIO.StringIO(self._indexed_cube()), region=[None, (0, 5), None], stride=np.int64(2))
+		self.assertTrue(np.all(full.get_data()[::2, ::2, ::2] == sub.get_data()))
+		self.assertRaises(ValueError, CubeFile, filehandle=StringIO.StringIO(self._indexed_cube()), stride=2)
+
+		for region in ([(0, 5), None, None], [(2, 2), None, None], [None, None]):
+			self.assertRaises(ValueError, CubeFile, filehandle=StringIO.StringIO(self._indexed_cube()), region=region)
+		self.assertRaises(ValueError, CubeFile, filehandle=StringIO.StringIO(self._indexed_cube()), stride=0)
+		truncated = self._indexed_cube().rsplit('\n', 1)[0]
+		self.assertRaises(ValueError, CubeFile, filehandle=StringIO.StringIO(truncated), region=[(3, 4), None, None])
+		sub = CubeFile(filehandle=StringIO.StringIO(truncated), region=[(0, 1), None, None])
+		self.assertEqual(30, sub.count_voxels())
+
+	def test_dtype(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(adv1), dtype=np.float32)
+		self.assertEqual(np.float32, cube.get_data().dtype)
+		self.assertEqual(np.float32, cube.get_coordinates().dtype)
+		self.assertEqual(np.float64, cube.get_projection(0, False).dtype)
+		ref = CubeFile(filehandle=StringIO.StringIO(adv1))
+		self.assertTrue(np.allclose(ref.get_projection(1, False), cube.get_projection(1, False)))
+		sub = CubeFile(filehandle=StringIO.StringIO(adv1), stride=2, dtype=np.float32)
+		self.assertEqual(np.float32, sub.get_data().dtype)
+		self.assertRaises(ValueError, CubeFile, filehandle=StringIO.StringIO(adv1), dtype=np.int32)
+
+		default = io.DEFAULT_DTYPE
+		try:
+			io.set_default_dtype(np.float32)
+			self.assertEqual(np.float32, CubeFile(filehandle=StringIO.StringIO(adv1)).get_data().dtype)
+		finally:
+			io.set_default_dtype(default)
+		self.assertEqual(np.float64, CubeFile(filehandle=StringIO.StringIO(adv1)).get_data().dtype)
@@ -0,0 +1,130 @@
+import unittest
+import StringIO
+import os
+import tempfile
+
+import numpy as np
+import euston.cubemath as cubemath
+from euston.io import CubeFile
+
+simple5 = '''HEADER 1
+HEADER 2
+1 0 0 0
+-2 1 0 0
+-2 0 1 0
+-1 0 0 1
+12 0 1 2 3
+1 -2 3 -4
+'''
+
+simple5b = '''HEADER 1
+HEADER 2
+1 0 0 0
+-2 1 0 0
+-2 0 1 0
+-1 0 0 1
+12 0 1 2 3
+2 0
+1 1
+'''
+
+simple4 = '''HEADER 1
+HEADER 2
+1 0 0 0
+1 1 0 0
+-1 0 1 0
+1 0 0 1
+12 0 1 2 3
+1
+'''
+
+# same grid as simple5 shifted by one Angstrom, in Bohr
+simple5bohr = '''HEADER 1
+HEADER 2
+1 1.88972612546 0 0
+2 1.88972612546 0 0
+2 0 1.88972612546 0
+1 0 0 1.88972612546
+12 0 1 2 3
+1 -2 3 -4
+'''
+
+simple5shifted = '''HEADER 1
+HEADER 2
+1 1 0 0
+-2 1 0 0
+-2 0 1 0
+-1 0 0 1
+12 0 1 2 3
+1 -2 3 -4
+'''
+
+
+class _RecordingIO(object):
+	"""Stands in for the io module in cubemath and keeps the cube files it opens."""
+
+	def __init__(self):
+		self.opened = []
+
+	def CubeFile(self, *args, **kwargs):
+		self.opened.append(CubeFile(*args, **kwargs))
+		return self.opened[-1]
+
+
+class TestCubeMath(unittest.TestCase):
+	def _stream(self, content):
+		return CubeFile(filehandle=StringIO.StringIO(content), stream=True)
+
+	def test_iterchunks(self):
+		blocks = [np.arange(3), np.arange(3, 4), np.arange(4, 11)]
+		chunks = list(cubemath.iter_chunks(blocks, 4))
+		self.assertEqual([4, 4, 3], map(len, chunks))
+		self.assertTrue(np.all(np.concatenate(chunks) == np.arange(11)))
+		self.assertEqual([], list(cubemath.iter_chunks([], 4)))
+
+	def test_linearcombination(self):
+		cubes = [self._stream(simple5), self._stream(simple5b)]
+		result = np.concatenate(list(cubemath.iter_linear_combination(cubes, [2, -1], constant=1, chunksize=3)))
+		self.assertTrue(np.allclose(result, np.array([1, -3, 6, -8])))
+
+	def test_incompatible(self):
+		cubes = [self._stream(simple5), self._stream(simple4)]
+		self.assertRaises(ValueError, cubemath.iter_linear_combination, cubes, [1, 1])
+		cubes = [self._stream(simple5), self._stream(simple5b)]
+		self.assertRaises(ValueError, cubemath.iter_linear_combination, cubes, [1])
+
+		# grids are compared in Angstrom
+		cubes = [self._stream(simple5shifted), self._stream(simple5bohr)]
+		self.assertEqual(2, len(list(cubemath.iter_linear_combination(cubes, [1, 1], chunksize=2))))
+		cubes = [self._stream(simple5bohr), self._stream(simple5bohr.replace('1 1.88972612546 0 0', '1 1 0 0'))]
+		self.assertRaises(ValueError, cubemath.iter_linear_combination, cubes, [1, 1])
+
+	def test_files(self):
+		names = []
+		try:
+			for content in (simple5, simple5b, ''):
+				fd, filename = tempfile.mkstemp(suffix='.cube')
+				os.write(fd, content)
+				os.close(fd)
+				names.append(filename)
+			cubemath.linear_combination(names[:2], [0.5, 0.5], names[2])
+			result = CubeFile(names[2])
+			self.assertTrue(np.allclose(result.get_data().reshape(-1), np.array([1.5, -1, 2, -1.5])))
+			self.assertEqual(1, result.count_atoms())
+			self.assertRaises(ValueError, cubemath.linear_combination, names[:2], [1, 1], names[1])
+			self.assertEqual(simple5b, open(names[1]).read())
+
+			# input files are closed if the grids do not match
+			with open(names[1], 'w') as fh:
+				fh.write(simple5b.replace('-2 0 1 0', '-2 0 2 0'))
+			recording, module = _RecordingIO(), cubemath.io
+			cubemath.io = recording
+			try:
+				self.assertRaises(ValueError, cubemath.linear_combination, names[:2], [1, 1], names[2])
+			finally:
+				cubemath.io = module
+			self.assertEqual(2, len(recording.opened))
+			self.assertTrue(all(cube._fh is None for cube in recording.opened))
+		finally:
+			for filename in names:
+				os.remove(filename)
@@ -83,6 +83,10 @@ class Test_Cellmultiply(unittest.TestCase):
 
 		args = self._build_args('%s %s --sc_in --hmat a,b,c,d,e,f,g,h,i' % (infile, outfile))
 		self.assertSystemExit(args, 2)
+		args = self._build_args('%s %s --sc_in --hmat 1,0,0,0,1,0,0,0' % (infile, outfile))
+		self.assertSystemExit(args, 2)
+		args = self._build_args('%s %s --sc_in --hmat 1,0,0,2,0,0,0,0,1' % (infile, outfile))
+		self.assertSystemExit(args, 2)
 
 	def test_invalidabc(self):
 		"""Tests whether invalid cell lengths and angles cancel the program."""
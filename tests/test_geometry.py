@@ -1,3 +1,4 @@
+import pickle
 import unittest
 import numpy as np
 import euston.geometry as geo
@@ -45,6 +46,23 @@ class TestGeometry(unittest.TestCase):
 		for system in bravais_lattices:
 			_docheck(self, system)
 
+	def test_hmatabc_arrays(self):
+		abc = np.array(bravais_lattices, dtype=np.float64)
+		hmats = geo.abc_to_hmatrix(*abc.T)
+		self.assertEqual((len(abc), 3, 3), hmats.shape)
+		for i in range(len(abc)):
+			self.assertTrue(np.allclose(geo.abc_to_hmatrix(*abc[i]), hmats[i]))
+			self.assertTrue(np.allclose(geo.cell_volume(hmats[i]), geo.cell_volume(hmats)[i]))
+		self.assertTrue(np.allclose(abc, geo.hmatrix_to_abc(hmats, degrees=True)))
+		self.assertTrue(np.allclose(np.eye(3), np.matmul(hmats, geo.cell_inverse(hmats))))
+
+		# one cell per frame
+		scaled = np.random.random((len(abc), 5, 3))
+		cartesian = geo.scaled_to_cartesian_coordinates(scaled, hmats)
+		self.assertTrue(np.allclose(np.dot(scaled[2], hmats[2].T), cartesian[2]))
+		self.assertTrue(np.allclose(scaled, geo.cartesian_to_scaled_coordinates(cartesian, hmats)))
+		self.assertRaises(ValueError, geo.cartesian_to_scaled_coordinates, cartesian[:2], hmats)
+
 	def test_boxvertices(self):
 		abc = [1, 1, 1, 90, 90, 90]
 		hmat = geo.abc_to_hmatrix(*abc, degrees=True)
@@ -71,6 +89,30 @@ class TestGeometry(unittest.TestCase):
 				self.assertTrue(np.allclose(
 					geo.cartesian_to_scaled_coordinates(geo.scaled_to_cartesian_coordinates(base, hmat), hmat), base))
 
+	def test_scaledcartesian_arrays(self):
+		hmat = geo.abc_to_hmatrix(*triclinic)
+		frames = np.random.random((4, 5, 3))
+		original = np.copy(frames)
+		cartesian = geo.scaled_to_cartesian_coordinates(frames, hmat)
+		self.assertTrue(np.all(original == frames))
+		for i in range(len(frames)):
+			for j in range(5):
+				self.assertTrue(np.allclose(cartesian[i, j], np.dot(hmat, frames[i, j])))
+
+		out = np.empty((5, 3))
+		result = geo.cartesian_to_scaled_coordinates(cartesian[0], hmat, out=out)
+		self.assertTrue(result is out)
+		self.assertTrue(np.allclose(frames[0], out))
+
+		result = geo.cartesian_to_scaled_coordinates(cartesian, hmat, inplace=True)
+		self.assertTrue(result is cartesian)
+		self.assertTrue(np.allclose(frames, cartesian))
+
+		self.assertRaises(ValueError, geo.scaled_to_cartesian_coordinates, frames, hmat, out=out, inplace=True)
+		self.assertRaises(ValueError, geo.scaled_to_cartesian_coordinates, frames, hmat, out=out)
+		self.assertRaises(TypeError, geo.scaled_to_cartesian_coordinates, np.zeros((2, 3), dtype=np.int), hmat,
+						  inplace=True)
+
 	def test_distancepbc(self):
 		hmat = np.array([[10.23825455, -5.17090513, 3.04986372], [0., 8.85893229, -2.54570325], [0., 0., 46.75847679]])
 
@@ -78,6 +120,27 @@ class TestGeometry(unittest.TestCase):
 		bpos = np.array([-1.73797166, 5.51723909, 12.60285091])
 		self.assertAlmostEqual(geo.distance_pbc(apos, bpos, hmat), 1.89199191315)
 
+	def test_distancespbc(self):
+		np.random.seed(1)
+		hmat = geo.abc_to_hmatrix(*triclinic, degrees=True)
+		a = np.random.random((7, 3)) * 20 - 5
+		b = np.random.random((5, 3)) * 20 - 5
+		distances, vectors = geo.distances_pbc(a, b, hmat, return_vectors=True, blocksize=6)
+		self.assertEqual((7, 5), distances.shape)
+		for i in range(len(a)):
+			for j in range(len(b)):
+				self.assertAlmostEqual(geo.distance_pbc(a[i], b[j], hmat), distances[i, j])
+				self.assertAlmostEqual(distances[i, j], np.linalg.norm(vectors[i, j]))
+				shift = np.dot(np.linalg.inv(hmat), b[j] - a[i] - vectors[i, j])
+				self.assertTrue(np.allclose(shift, np.round(shift)))
+
+		condensed, vectors = geo.pairwise_distances_pbc(a, hmat, return_vectors=True, blocksize=10)
+		full, fullvectors = geo.distances_pbc(a, a, hmat, return_vectors=True)
+		upper = np.triu_indices(len(a), 1)
+		self.assertTrue(np.allclose(full[upper], condensed))
+		self.assertTrue(np.allclose(fullvectors[upper], vectors))
+		self.assertEqual(0, len(geo.pairwise_distances_pbc(a[:1], hmat)))
+
 	def test_cellmultiply(self):
 		base = np.array([[0.5, 0.5, 0.5]])
 		self.assertRaises(ValueError, geo.cell_multiply, base, -1, -1, -1)
@@ -103,3 +166,139 @@ class TestGeometry(unittest.TestCase):
 					# single result part of multiplied result
 					residuals = np.linalg.norm(result - result2[0], axis=1)
 					self.assertTrue(min(residuals) < 10e-5)
+
+	def test_periodickdtree(self):
+		def _reference(sites, points, hmat):
+			shifts = np.array([(x, y, z) for x in range(-3, 4) for y in range(-3, 4) for z in range(-3, 4)])
+			images = (sites[np.newaxis, :, :] + np.dot(shifts, hmat.T)[:, np.newaxis, :]).reshape(-1, 3)
+			d = np.linalg.norm(images[np.newaxis, :, :] - points[:, np.newaxis, :], axis=2)
+			return d.min(axis=1), d.argmin(axis=1) % len(sites)
+
+		np.random.seed(42)
+		skewed = geo.abc_to_hmatrix(3, 3, 12, 90, 90, 90)
+		skewed[:, 2] += 2 * skewed[:, 0]
+		for hmat in [geo.abc_to_hmatrix(*_, degrees=True) for _ in bravais_lattices] + [skewed]:
+			sites = np.dot(np.random.random((7, 3)) * 3 - 1, hmat.T)
+			points = np.dot(np.random.random((50, 3)) * 3 - 1, hmat.T)
+			tree = geo.PeriodicKDTree(sites, hmat, margin=0.1)
+			nimages = tree.count_images()
+			distances, indices = tree.query(points)
+			refdistances, refindices = _reference(sites, points, hmat)
+			self.assertTrue(np.allclose(distances, refdistances))
+			self.assertTrue(np.all(indices == refindices))
+			self.assertTrue(nimages < 27 * len(sites))
+			# the enlarged margin is kept for later queries
+			self.assertTrue(tree.count_images() > nimages)
+			self.assertTrue(np.all(tree.query(points)[1] == refindices))
+
+			# all sites with an image within the radius
+			shifts = np.array([(x, y, z) for x in range(-3, 4) for y in range(-3, 4) for z in range(-3, 4)])
+			images = sites[np.newaxis, :, :] + np.dot(shifts, hmat.T)[:, np.newaxis, :]
+			for point, found in zip(points, tree.query_ball_point(points, 2.5)):
+				d = np.linalg.norm(images - point, axis=2).min(axis=0)
+				self.assertEqual(list(np.where(d < 2.5)[0]), list(found))
+		self.assertRaises(ValueError, geo.PeriodicKDTree, np.zeros((0, 3)), hmat)
+
+	def test_neighborlist(self):
+		def _reference(coord, hmat, cutoff):
+			pairs = set()
+			reach = 4
+			for i in range(len(coord)):
+				for j in range(i, len(coord)):
+					for x in range(-reach, reach + 1):
+						for y in range(-reach, reach + 1):
+							for z in range(-reach, reach + 1):
+								if i == j and (x, y, z) <= (0, 0, 0):
+									continue
+								d = np.linalg.norm(coord[j] + np.dot(hmat, (x, y, z)) - coord[i])
+								if d < cutoff:
+									pairs.add((i, j, round(d, 6)))
+			return sorted(pairs)
+
+		np.random.seed(3)
+		hmat = geo.abc_to_hmatrix(*triclinic, degrees=True)
+		small = geo.abc_to_hmatrix(2.5, 3, 2.8, 80, 95, 105)
+		for cell, cutoff in ((hmat, 4.), (small, 3.5)):
+			coord = np.dot(np.random.random((12, 3)) * 1.4 - 0.2, cell.T)
+			nl = geo.NeighborList(cutoff, skin=0.5)
+			self.assertTrue(nl.update(coord, cell))
+			i, j, d, v = nl.get_pairs()
+			self.assertEqual(_reference(coord, cell, cutoff), sorted(zip(i, j, np.round(d, 6))))
+			self.assertTrue(np.allclose(d, np.linalg.norm(v, axis=1)))
+
+			# small moves reuse the list
+			moved = coord + (np.random.random(coord.shape) - 0.5) * 0.2
+			self.assertFalse(nl.update(moved, cell))
+			i, j, d, v = nl.get_pairs()
+			self.assertEqual(_reference(moved, cell, cutoff), sorted(zip(i, j, np.round(d, 6))))
+
+			# large moves rebuild
+			self.assertTrue(nl.update(moved + np.random.random(coord.shape), cell))
+			self.assertEqual(2, nl.count_rebuilds())
+		self.assertRaises(ValueError, geo.NeighborList, -1.)
+
+	def test_supercell(self):
+		hmat = geo.abc_to_hmatrix(*monoclinic)
+		base = np.random.random((4, 3))
+		reference = geo.cell_multiply(base, 2, 3, 2, h_matrix=hmat, scaling_in=True)
+		self.assertTrue(np.allclose(geo.scaled_to_cartesian_coordinates(base, hmat), reference[:4]))
+		self.assertTrue(np.allclose(reference[4:8] - reference[:4], hmat[:, 2]))
+
+		supercell = geo.Supercell(base, 2, 3, 2, hmat, scaling_in=True)
+		self.assertEqual(48, len(supercell))
+		self.assertTrue(np.allclose(reference, supercell.get_coordinates()))
+		blocks = list(supercell.iter_blocks(images=5))
+		self.assertEqual([20, 20, 8], map(len, blocks))
+		self.assertTrue(np.allclose(reference, np.concatenate(blocks)))
+		self.assertTrue(np.allclose(reference[4 * (1 * 6 + 2 * 2 + 1) + 3], supercell.get_position(3, 1, 2, 1)))
+		self.assertRaises(IndexError, supercell.get_position, 0, 2, 0, 0)
+		self.assertTrue(np.allclose(geo.cell_volume(supercell.get_h_matrix()), 12 * geo.cell_volume(hmat)))
+		self.assertEqual([[0, 0, 0], [0, 0, 1], [0, 1, 0], [0, 1, 1]], geo.image_offsets(1, 2, 2).tolist())
+
+	def test_cell(self):
+		hmat = geo.abc_to_hmatrix(*triclinic)
+		cell = geo.Cell(hmat)
+		self.assertTrue(np.allclose(hmat, cell.get_h_matrix()))
+		self.assertTrue(np.allclose(triclinic, cell.get_abc(degrees=True)))
+		self.assertAlmostEqual(geo.cell_volume(hmat), cell.get_volume())
+		self.assertTrue(np.allclose(np.linalg.inv(hmat), cell.get_inverse()))
+		self.assertIs(cell.get_inverse(), cell.get_inverse())
+		self.assertTrue(np.allclose(hmat, np.array(cell)))
+		self.assertTrue(np.allclose(geo.cell_longest_diameter(hmat), cell.get_longest_diameter()))
+
+		# immutable
+		self.assertRaises(AttributeError, setattr, cell, '_h_matrix', None)
+		self.assertRaises(ValueError, cell.get_h_matrix().__setitem__, (0, 0), 1.)
+		hmat[0, 0] = 100.
+		self.assertNotEqual(100., cell.get_h_matrix()[0, 0])
+		self.assertTrue(np.allclose(cell.get_h_matrix(), pickle.loads(pickle.dumps(cell)).get_h_matrix()))
+
+		# parsing
+		self.assertTrue(np.allclose(cell.get_h_matrix(), geo.Cell.from_string(','.join(map(str, triclinic)), abc=True).get_h_matrix()))
+		self.assertTrue(np.allclose([[1, 4, 7], [0, 5, 8], [0, 0, 9]], geo.Cell.from_string('1,0,0,4,5,0,7,8,9').get_h_matrix()))
+		self.assertRaises(ValueError, geo.Cell.from_string, '1,2,3', abc=True)
+		self.assertRaises(ValueError, geo.Cell.from_string, '1,a,3,4,5,6', abc=True)
+
+	def test_reducedcell(self):
+		hmat = np.array([[5., 14., 3.], [0., 4., -9.], [0., 0., 6.]])
+		reduced, transformation = geo.reduce_h_matrix(hmat)
+		self.assertAlmostEqual(np.linalg.det(hmat), np.linalg.det(reduced))
+		self.assertTrue(np.allclose(reduced, np.dot(hmat, transformation)))
+		self.assertTrue(np.allclose(np.round(transformation), transformation))
+		self.assertAlmostEqual(1., abs(np.linalg.det(transformation)))
+		self.assertTrue(np.linalg.norm(reduced, axis=0).max() < np.linalg.norm(hmat, axis=0).max())
+
+		cell = geo.Cell(reduced)
+		self.assertIs(cell, cell.get_reduced())
+
+		# exact minimum image in strongly skewed cells
+		a = np.random.random((20, 3)) * 10
+		b = np.random.random((15, 3)) * 10
+		images = np.dot(np.indices((7, 7, 7)).reshape(3, -1).T - 3, reduced.T)
+		expected = np.linalg.norm(b[np.newaxis, :, np.newaxis] - a[:, np.newaxis, np.newaxis] + images, axis=3).min(axis=2)
+		self.assertTrue(np.allclose(expected, geo.distances_pbc(a, b, hmat)))
+		self.assertTrue(np.allclose(expected[3, 4], geo.distance_pbc(a[3], b[4], geo.Cell(hmat))))
+		expected = np.linalg.norm(a[np.newaxis, :, np.newaxis] - a[:, np.newaxis, np.newaxis] + images, axis=3).min(axis=2)
+		self.assertTrue(np.allclose(expected[np.triu_indices(len(a), 1)], geo.pairwise_distances_pbc(a, hmat)))
+		hexagonal_cell = geo.Cell.from_abc(*hexagonal)
+		self.assertTrue(np.allclose(geo.distances_pbc(a, b, hexagonal_cell), geo.distances_pbc(a, b, hexagonal_cell.get_reduced())))
@@ -0,0 +1,59 @@
+import unittest
+import StringIO
+
+import numpy as np
+import euston.hirshfeld as hirshfeld
+from euston.io import CubeFile
+from tests.cubes import grid_cube
+
+
+class TestHirshfeld(unittest.TestCase):
+	def _reference(self, cube, cutoff, periodic):
+		coord = cube.get_coordinates()
+		hmat = cube.get_h_matrix()
+		profiles = dict((_, hirshfeld.default_profile(_)) for _ in (1, 6, 8))
+		shifts = np.array([(x, y, z) for x in range(-2, 3) for y in range(-2, 3) for z in range(-2, 3)])
+		images = np.dot(shifts, hmat.T)
+		result = np.zeros(3)
+		for x in range(cube.get_xlen()):
+			for y in range(cube.get_ylen()):
+				for z in range(cube.get_zlen()):
+					delta = cube.get_voxel_pos(x, y, z, centered=True, origin=True) - coord
+					if periodic:
+						r = np.linalg.norm(delta[:, np.newaxis, :] + images[np.newaxis, :, :], axis=2).min(axis=1)
+					else:
+						r = np.linalg.norm(delta, axis=1)
+					w = np.array([profiles[n](d) for n, d in zip(cube.get_atomic_numbers(), r)])
+					w[r > cutoff] = 0
+					if w.sum() > 0:
+						result += cube.get_val(x, y, z) * w / w.sum()
+		return result * cube.get_voxel_volume()
+
+	def test_profiles(self):
+		profile = hirshfeld.default_profile(8)
+		r = np.linspace(0, 20, 20001)
+		self.assertAlmostEqual(8, np.trapz(4 * np.pi * r ** 2 * profile(r), r), places=3)
+		tabulated = hirshfeld.TabulatedProfile([0, 1, 2], [2, 1, 0.5])
+		self.assertTrue(np.allclose([1.5, 0.75, 0], tabulated(np.array([0.5, 1.5, 3]))))
+		self.assertRaises(ValueError, hirshfeld.TabulatedProfile, [0, 2, 1], [1, 1, 1])
+
+	def test_charges(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(grid_cube(skew=.2, offset=1.)))
+		for periodic in (False, True):
+			for cutoff in (1.5, 50):
+				ref = self._reference(cube, cutoff, periodic)
+				for processes, bricksize in ((1, 2), (2, 16)):
+					charges = hirshfeld.hirshfeld_charges(cube, cutoff=cutoff, periodic=periodic, processes=processes,
+														  bricksize=bricksize)
+					self.assertTrue(np.allclose(ref, charges))
+		self.assertAlmostEqual(cube.get_data().sum() * cube.get_voxel_volume(), charges.sum())
+
+		# cell large enough to use the atom images closest to each brick
+		cube = CubeFile(filehandle=StringIO.StringIO(grid_cube((12, 10, 8), skew=.2, offset=1.)))
+		ref = self._reference(cube, 2., True)
+		for bricksize in (1, 3):
+			self.assertTrue(np.allclose(ref, hirshfeld.hirshfeld_charges(cube, cutoff=2., bricksize=bricksize)))
+
+	def test_stream(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(grid_cube(skew=.2, offset=1.)), stream=True)
+		self.assertRaises(ValueError, hirshfeld.hirshfeld_charges, cube)
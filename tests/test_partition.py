@@ -0,0 +1,84 @@
+import unittest
+import StringIO
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import euston.cache as fcache
+import euston.partition as partition
+from euston.io import CubeFile
+from tests.cubes import grid_cube
+
+
+class TestPartition(unittest.TestCase):
+	def _reference(self, cube, sites, nsites):
+		vals = np.zeros(nsites)
+		for x in range(cube.get_xlen()):
+			for y in range(cube.get_ylen()):
+				for z in range(cube.get_zlen()):
+					d = np.linalg.norm(sites - cube.get_voxel_pos(x, y, z, centered=True, origin=True), axis=1)
+					vals[np.argmin(d) % nsites] += cube.get_val(x, y, z)
+		return vals
+
+	def test_sums(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(grid_cube()))
+		coord = cube.get_coordinates()
+		ref = self._reference(cube, coord, 3)
+		for chunksize in (7, 1000):
+			vals = partition.wigner_seitz_sums(cube, chunksize=chunksize, jobs=1)
+			self.assertTrue(np.allclose(ref, vals))
+		self.assertAlmostEqual(cube.get_data().sum(), vals.sum())
+
+	def test_images(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(grid_cube()))
+		coord = cube.get_coordinates()
+		sites = np.vstack((coord, coord + cube.get_h_matrix()[:, 0]))
+		ref = self._reference(cube, sites, 3)
+		self.assertTrue(np.allclose(ref, partition.wigner_seitz_sums(cube, sites, 3, jobs=2)))
+
+	def test_stream(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(grid_cube()))
+		ref = partition.wigner_seitz_sums(cube)
+		stream = CubeFile(filehandle=StringIO.StringIO(grid_cube()), stream=True)
+		self.assertTrue(np.allclose(ref, partition.wigner_seitz_sums(stream, chunksize=5)))
+
+	def test_labelcache(self):
+		directory = tempfile.mkdtemp()
+		try:
+			cache = fcache.FileCache(directory)
+			cube = CubeFile(filehandle=StringIO.StringIO(grid_cube()))
+			coord = cube.get_coordinates()
+			labels = partition.cached_labels(cache, cube, coord, chunksize=11, jobs=1)
+			self.assertEqual(np.uint16, labels.dtype)
+			self.assertEqual(1, len([_ for _ in os.listdir(directory) if _.endswith('.npy')]))
+
+			stream = CubeFile(filehandle=StringIO.StringIO(grid_cube()), stream=True)
+			self.assertTrue(np.allclose(partition.wigner_seitz_sums(cube), partition.apply_labels(stream, labels, 3)))
+
+			# small coordinate noise hits the same entry
+			reused = partition.cached_labels(cache, cube, coord + 1e-7)
+			self.assertTrue(isinstance(reused, np.memmap))
+			self.assertTrue(np.all(labels == reused))
+			partition.cached_labels(cache, cube, coord + 0.1)
+			self.assertEqual(2, len([_ for _ in os.listdir(directory) if _.endswith('.npy')]))
+		finally:
+			shutil.rmtree(directory)
+
+	def test_periodic(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(grid_cube()))
+		coord = cube.get_coordinates()
+		shifts = np.array([(x, y, z) for x in range(-1, 2) for y in range(-1, 2) for z in range(-1, 2)])
+		images = (coord[np.newaxis, :, :] + np.dot(shifts, cube.get_h_matrix().T)[:, np.newaxis, :]).reshape(-1, 3)
+		ref = self._reference(cube, images, 3)
+		self.assertTrue(np.allclose(ref, partition.wigner_seitz_sums(cube, periodic=True, jobs=1)))
+		self.assertFalse(np.allclose(ref, partition.wigner_seitz_sums(cube, jobs=1)))
+
+	def test_processes(self):
+		cube = CubeFile(filehandle=StringIO.StringIO(grid_cube()))
+		for periodic in (False, True):
+			ref = partition.wigner_seitz_sums(cube, periodic=periodic)
+			vals = partition.wigner_seitz_sums(cube, periodic=periodic, processes=2, chunksize=7)
+			self.assertTrue(np.allclose(ref, vals))
+		labels = partition.compute_labels(cube, cube.get_coordinates(), periodic=True)
+		self.assertTrue(np.allclose(ref, partition.apply_labels(cube, labels, 3, processes=3)))
@@ -0,0 +1,156 @@
+import unittest
+import gzip
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import euston.geometry as geo
+import euston.rdf as rdf
+
+
+class TestRdf(unittest.TestCase):
+	def test_uniquepositions(self):
+		corners = np.indices((2, 2, 2)).reshape(3, -1).T
+		unique = rdf.unique_scaled_positions(np.vstack((corners, [[0.5, 0.5, 0.5], [-0.5, 1.5, 0.5]])))
+		self.assertEqual([[0, 0, 0], [0.5, 0.5, 0.5]], unique.tolist())
+
+	def test_translations(self):
+		hmat = geo.abc_to_hmatrix(3, 4, 5, 70, 100, 115)
+		translations = rdf.lattice_translations(hmat, 9.)
+		coefficients = np.indices((21, 21, 21)).reshape(3, -1).T - 10
+		expected = np.dot(coefficients, hmat.T)
+		expected = expected[np.linalg.norm(expected, axis=1) <= 9.]
+		self.assertEqual(len(expected), len(translations))
+		self.assertTrue(np.allclose(np.sort(np.linalg.norm(expected, axis=1)), np.sort(np.linalg.norm(translations, axis=1))))
+
+	def test_latticerdf(self):
+		fcc = np.array([[0, 0, 0], [0, 0.5, 0.5], [0.5, 0, 0.5], [0.5, 0.5, 0], [1, 1, 0]])
+		hmat = geo.abc_to_hmatrix(3.6, 3.6, 3.6, 90, 90, 90)
+		edges, counts, gr = rdf.lattice_rdf(hmat, fcc, 12., bins=997, blocksize=1000)
+		self.assertEqual(998, len(edges))
+		shells = np.nonzero(counts)[0]
+		self.assertEqual([12, 6, 24], (counts[shells[:3]] / 4).tolist())
+		self.assertTrue(np.allclose(3.6 / np.sqrt(2), edges[shells[0]], atol=0.01))
+
+		# on average, the lattice looks like an ideal gas
+		self.assertAlmostEqual(1., (gr * rdf.shell_volumes(edges)).sum() / rdf.shell_volumes(edges).sum(), 1)
+
+		# the same lattice from its primitive cell
+		primitive = geo.abc_to_hmatrix(3.6 / np.sqrt(2), 3.6 / np.sqrt(2), 3.6 / np.sqrt(2), 60, 60, 60)
+		edges, primitive_counts, primitive_gr = rdf.lattice_rdf(primitive, [[0.2, 0.2, 0.2]], 12., bins=997)
+		self.assertEqual(counts.tolist(), (primitive_counts * 4).tolist())
+		self.assertTrue(np.allclose(gr, primitive_gr))
+
+	def test_accumulator(self):
+		# simple cubic lattice as supercell matches the infinite lattice without the images of each atom itself
+		hmat = geo.abc_to_hmatrix(3, 3, 3, 90, 90, 90)
+		supercell = geo.cell_multiply(np.zeros((1, 3)), 2, 2, 2, h_matrix=hmat)
+		accumulator = rdf.RdfAccumulator(['A'] * 8, 8., bins=97)
+		accumulator.add_frame(supercell, 2 * hmat)
+		edges, counts, gr = rdf.lattice_rdf(hmat, [[0, 0, 0]], 8., bins=97)
+		edges, images, _ = rdf.lattice_rdf(2 * hmat, [[0, 0, 0]], 8., bins=97)
+		expected = rdf.normalize_rdf(counts - images, edges, 1, 7 / (8 * 27.))
+		self.assertTrue(np.allclose(edges, accumulator.get_edges()))
+		self.assertTrue(np.allclose(expected, accumulator.get_rdf()))
+		self.assertTrue(np.allclose(expected, accumulator.get_rdf('A', 'A')))
+		self.assertRaises(ValueError, accumulator.add_frame, supercell, 2 * hmat, ['B'] * 8)
+
+		# each frame is normalized with its own volume
+		labels = ['O', 'H', 'H', 'O', 'H']
+		coordinates = np.random.random((5, 3)) * 4
+		single = []
+		for scale in (1., 1.3):
+			accumulator = rdf.RdfAccumulator(labels, 6., bins=50)
+			accumulator.add_frame(coordinates * scale, hmat * scale * 4. / 3)
+			single.append(accumulator)
+		merged = rdf.RdfAccumulator(labels, 6., bins=50)
+		merged.merge(single[0])
+		merged.merge(single[1])
+		self.assertEqual(2, merged.count_frames())
+		self.assertEqual(['H', 'O'], merged.get_species())
+		for pair in ((None, None), ('H', 'O'), ('O', 'H'), ('H', 'H')):
+			self.assertTrue(np.allclose(merged.get_rdf(*pair), (single[0].get_rdf(*pair) + single[1].get_rdf(*pair)) / 2))
+
+		# total is the weighted sum of the partials over the N (N - 1) pairs of distinct atoms
+		total = (6 * merged.get_rdf('H', 'H') + 2 * merged.get_rdf('O', 'O') + 12 * merged.get_rdf('H', 'O')) / 20
+		self.assertTrue(np.allclose(total, merged.get_rdf()))
+
+	def test_accumulatornormalization(self):
+		# two atoms of the same label in a large cell: each is the only partner of the other
+		hmat = geo.abc_to_hmatrix(20, 20, 20, 90, 90, 90)
+		accumulator = rdf.RdfAccumulator(['A', 'A', 'B'], 5., bins=10, skin=1.)
+		accumulator.add_frame([[1, 1, 1], [1, 1, 3.2], [10, 10, 10]], hmat)
+		# the neighbour list is kept between frames
+		accumulator.add_frame([[1, 1, 1.1], [1, 1, 3.3], [10, 10, 10]], hmat)
+		self.assertEqual(1, accumulator._neighbors.count_rebuilds())
+		shells = rdf.shell_volumes(accumulator.get_edges())
+		expected = np.zeros(10)
+		expected[4] = 8000. / shells[4]
+		self.assertTrue(np.allclose(expected, accumulator.get_rdf('A', 'A')))
+		self.assertTrue(np.allclose(np.zeros(10), accumulator.get_rdf('B', 'B')))
+		self.assertTrue(np.allclose(expected / 3, accumulator.get_rdf()))
+
+		# ideal gas approaches one, also beyond half the cell where atoms meet their own images
+		np.random.seed(7)
+		hmat = geo.abc_to_hmatrix(4, 4, 4, 90, 90, 90)
+		accumulator = rdf.RdfAccumulator(['A'] * 6, 6., bins=6, skin=0.5)
+		for frame in range(100):
+			accumulator.add_frame(np.random.random((6, 3)) * 4, hmat)
+		self.assertTrue(np.allclose(1., accumulator.get_rdf()[1:], atol=0.1))
+
+	def test_trajectory(self):
+		directory = tempfile.mkdtemp()
+		try:
+			filenames = []
+			combined = os.path.join(directory, 'trajectory.xyz.gz')
+			plain = os.path.join(directory, 'trajectory.xyz')
+			with gzip.open(combined, 'wb') as trajectory, open(plain, 'w') as uncompressed:
+				for i in range(5):
+					filename = os.path.join(directory, 'frame-%d.xyz' % i)
+					coordinates = np.random.random((6, 3)) * 5
+					lines = ['6', 'i = %d' % i]
+					for label, atom in zip('CCHHHH', coordinates):
+						lines.append('%s %f %f %f' % (label, atom[0], atom[1], atom[2]))
+					with open(filename, 'w') as fh:
+						fh.write('\n'.join(lines) + '\n')
+					trajectory.write('\n'.join(lines) + '\n')
+					uncompressed.write('\n'.join(lines) + '\n')
+					filenames.append(filename)
+			hmats = geo.abc_to_hmatrix(5 + np.arange(5), 5, 5, 90, 90, 90)
+
+			serial = rdf.trajectory_rdf(filenames, 4., bins=20, h_matrices=list(hmats))
+			self.assertEqual(5, serial.count_frames())
+			parallel = rdf.trajectory_rdf(filenames, 4., bins=20, h_matrices=list(hmats), processes=2)
+			self.assertTrue(np.allclose(serial.get_rdf('C', 'H'), parallel.get_rdf('C', 'H')))
+			self.assertRaises(ValueError, rdf.trajectory_rdf, filenames, 4.)
+
+			# frames of a multi-frame file and frame selection across files
+			self.assertEqual(5, rdf.count_file_frames(combined))
+			streamed = rdf.trajectory_rdf([combined], 4., bins=20, h_matrices=list(hmats), processes=2)
+			self.assertTrue(np.allclose(serial.get_rdf(), streamed.get_rdf()))
+			indexed = rdf.trajectory_rdf([combined], 4., bins=20, h_matrices=list(hmats), processes=2, index=True)
+			self.assertTrue(np.allclose(serial.get_rdf(), indexed.get_rdf()))
+
+			# plain files are split between workers without writing an index
+			for processes in (1, 3):
+				split = rdf.trajectory_rdf([plain, combined], 4., bins=20, h_matrices=list(hmats) * 2, processes=processes,
+										   step=2)
+				reference = rdf.trajectory_rdf([filenames[_] for _ in (0, 2, 4, 1, 3)], 4., bins=20,
+											   h_matrices=[hmats[_] for _ in (0, 2, 4, 1, 3)])
+				self.assertEqual(5, split.count_frames())
+				self.assertTrue(np.allclose(reference.get_rdf(), split.get_rdf()))
+			self.assertFalse(os.path.exists(plain + '.frames.npz'))
+			selected = rdf.trajectory_rdf([combined] + filenames, 4., bins=20, h_matrices=list(hmats) * 2, start=3,
+										  step=4)
+			reference = rdf.trajectory_rdf([filenames[3], filenames[2]], 4., bins=20, h_matrices=[hmats[3], hmats[2]])
+			self.assertEqual(2, selected.count_frames())
+			self.assertTrue(np.allclose(reference.get_rdf(), selected.get_rdf()))
+			self.assertRaises(ValueError, rdf.trajectory_rdf, filenames, 4., h_matrices=hmats[0], start=5)
+
+			# blocks with more or fewer frames than cells
+			for cells in (list(hmats[:3]), list(hmats) * 2):
+				self.assertRaises(ValueError, rdf._rdf_frames, ([(plain, 0, None, 1, cells, False)], 4., 20, 0.))
+		finally:
+			shutil.rmtree(directory)
+
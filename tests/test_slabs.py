@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import euston.slabs as slabs
+
+
+def _slab_sum(parts, start, factor):
+	values, weights = parts
+	return np.array([start, factor * (values * weights).sum()])
+
+
+def _prepare_sum(factor):
+	return (np.array([factor]), )
+
+
+class TestSlabs(unittest.TestCase):
+	def test_split(self):
+		self.assertEqual([(0, 3), (3, 6), (6, 10)], slabs.split_slabs(10, 3))
+		self.assertEqual([(0, 1), (1, 2)], slabs.split_slabs(2, 5))
+		self.assertEqual([(0, 4)], slabs.split_slabs(4, 0))
+
+	def test_sharedarray(self):
+		data = np.arange(24, dtype=np.float32).reshape(4, 3, 2)
+		shared = slabs.SharedArray(data)
+		self.assertEqual(np.float32, shared.get_array().dtype)
+		self.assertTrue(np.all(data == shared.get_array()))
+
+		# neither shared memory nor memory-mapped files are copied
+		data = slabs.zeros((4, 3, 2), dtype=np.float32)
+		data[...] = np.arange(24).reshape(data.shape)
+		shared = slabs.SharedArray(data[1:])
+		self.assertIs(data.base.base, shared._buffer)
+		self.assertTrue(np.all(data[1:] == shared.get_array()))
+		directory = tempfile.mkdtemp()
+		try:
+			filename = os.path.join(directory, 'data.npy')
+			np.save(filename, data)
+			mapped = np.load(filename, mmap_mode='r')
+			shared = slabs.SharedArray(mapped[2:])
+			self.assertIsNone(shared._buffer)
+			self.assertTrue(np.all(data[2:] == shared.get_array()))
+			del mapped, shared
+		finally:
+			shutil.rmtree(directory)
+
+	def test_map(self):
+		values = np.arange(60.).reshape(10, 3, 2)
+		weights = np.ones((10, 3, 2))
+		for processes in (1, 2):
+			results = slabs.map_slabs(_slab_sum, [values, weights], processes, (2, ))
+			self.assertEqual(0, results[0][0])
+			self.assertEqual(sorted(_[0] for _ in results), [_[0] for _ in results])
+			self.assertEqual(2 * values.sum(), slabs.reduce_slabs(_slab_sum, [values, weights], processes, (2, ))[1])
+		self.assertRaises(ValueError, slabs.map_slabs, _slab_sum, [values, weights[:3]], 2)
+
+	def test_prepare(self):
+		values = slabs.zeros((10, 3, 2))
+		values[...] = np.arange(60.).reshape(values.shape)
+		for processes in (1, 2):
+			result = slabs.reduce_slabs(_slab_sum, [values, np.ones(values.shape)], processes, (3, ), _prepare_sum)
+			self.assertEqual(3 * values.sum(), result[1])